@@ -16,6 +16,8 @@ from builtins import range
 
 import os
 import os.path as op
+import tempfile
+from itertools import chain
 
 import nibabel as nb
 import numpy as np
@@ -28,7 +30,7 @@ from ..interfaces.base import (traits, TraitedSpec, BaseInterface,
                                BaseInterfaceInputSpec, File, isdefined,
                                InputMultiPath, OutputMultiPath)
 from ..utils import NUMPY_MMAP
-from ..utils.misc import normalize_mc_params
+from ..utils.misc import normalize_mc_params, iter_volume_chunks
 
 IFLOG = logging.getLogger('interface')
 
@@ -267,12 +269,8 @@ Bradley L. and Petersen, Steven E.},
 
     def _run_interface(self, runtime):
         mpars = np.loadtxt(self.inputs.in_file)  # mpars is N_t x 6
-        mpars = np.apply_along_axis(func1d=normalize_mc_params,
-                                    axis=1, arr=mpars,
-                                    source=self.inputs.parameter_source)
-        diff = mpars[:-1, :6] - mpars[1:, :6]
-        diff[:, 3:6] *= self.inputs.radius
-        fd_res = np.abs(diff).sum(axis=1)
+        fd_res = framewise_displacement(mpars, self.inputs.parameter_source,
+                                        self.inputs.radius)
 
         self._results = {
             'out_file': op.abspath(self.inputs.out_file),
@@ -302,6 +300,66 @@ Bradley L. and Petersen, Steven E.},
         return self._results
 
 
+class FramewiseDisplacementBatchInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(File(exists=True), mandatory=True,
+                              desc='motion parameters of each run')
+    parameter_source = traits.Enum("FSL", "AFNI", "SPM", "FSFAST", "NIPY",
+                                   desc="Source of movement parameters",
+                                   mandatory=True)
+    radius = traits.Float(50, usedefault=True,
+                          desc='radius in mm to calculate angular FDs, 50mm is the '
+                               'default since it is used in Power et al. 2012')
+    out_file = File('fd_power_2012.tsv', usedefault=True,
+                    desc='output table, with the FD of each time step of '
+                         'each run')
+
+
+class FramewiseDisplacementBatchOutputSpec(TraitedSpec):
+    out_file = File(desc='calculated FD per run and timestep')
+    fd_average = traits.List(traits.Float, desc='average FD of each run')
+
+
+class FramewiseDisplacementBatch(BaseInterface):
+    """
+    Calculate the :abbr:`FD (framewise displacement)` of many runs, as
+    :py:class:`FramewiseDisplacement` does for one run, and write them to
+    one table. The table has a row per time step of each run, with the index
+    of the run in ``in_files`` and the index of the volume the displacement
+    leads to.
+
+    >>> fd = FramewiseDisplacementBatch()
+    >>> fd.inputs.in_files = ['fsl_mcflirt_movpar.txt', 'fsl_mcflirt_movpar.txt']
+    >>> fd.inputs.parameter_source = 'FSL'
+    >>> res = fd.run() # doctest: +SKIP
+    """
+
+    input_spec = FramewiseDisplacementBatchInputSpec
+    output_spec = FramewiseDisplacementBatchOutputSpec
+
+    def _run_interface(self, runtime):
+        fd_runs = [framewise_displacement(np.loadtxt(in_file),
+                                          self.inputs.parameter_source,
+                                          self.inputs.radius)
+                   for in_file in self.inputs.in_files]
+        lengths = [len(fd_res) for fd_res in fd_runs]
+        table = np.column_stack((
+            np.repeat(np.arange(len(fd_runs)), lengths),
+            np.concatenate([np.arange(1, n + 1) for n in lengths]),
+            np.concatenate(fd_runs)))
+
+        self._results = {
+            'out_file': op.abspath(self.inputs.out_file),
+            'fd_average': [float(fd_res.mean()) for fd_res in fd_runs]
+        }
+        np.savetxt(self.inputs.out_file, table, fmt=[b'%d', b'%d', b'%.18e'],
+                   delimiter=b'\t', header='run\tvolume\tFramewiseDisplacement',
+                   comments='')
+        return runtime
+
+    def _list_outputs(self):
+        return self._results
+
+
 class CompCorInputSpec(BaseInterfaceInputSpec):
     realigned_file = File(exists=True, mandatory=True,
                           desc='already realigned brain image (4D)')
@@ -333,6 +391,17 @@ class CompCorInputSpec(BaseInterfaceInputSpec):
     header_prefix = traits.Str(desc=('the desired header for the output tsv '
                                      'file (one column). If undefined, will '
                                      'default to "CompCor"'))
+    svd_method = traits.Enum(
+        'full', 'randomized', 'gram', usedefault=True,
+        desc=('how the components are computed - `full` decomposes the whole '
+              'time x voxels matrix in memory, `randomized` computes only '
+              '`num_components` with a randomized SVD, `gram` decomposes the '
+              'timepoints x timepoints covariance matrix (fastest when '
+              'voxels far outnumber timepoints). `randomized` and `gram` '
+              'read the voxels in chunks, as float32'))
+    chunk_size = traits.Int(10000, usedefault=True,
+                            desc=('number of voxels read at once by the '
+                                  '`randomized` and `gram` methods'))
 
 
 class CompCorOutputSpec(TraitedSpec):
@@ -405,7 +474,9 @@ class CompCor(BaseInterface):
 
         components = compute_noise_components(imgseries.get_data(),
                                               mask_images, degree,
-                                              self.inputs.num_components)
+                                              self.inputs.num_components,
+                                              self.inputs.svd_method,
+                                              self.inputs.chunk_size)
 
         components_file = os.path.join(os.getcwd(), self.inputs.components_file)
         np.savetxt(components_file, components, fmt=b"%.10f", delimiter='\t',
@@ -493,9 +564,12 @@ class TCompCor(CompCor):
         self._mask_files = []
         for i, img in enumerate(mask_images):
             mask = img.get_data().astype(np.bool)
-            imgseries = timeseries[mask, :]
-            imgseries = regress_poly(2, imgseries)
-            tSTD = _compute_tSTD(imgseries, 0, axis=-1)
+            voxels = np.nonzero(mask)
+            tSTD = np.zeros(len(voxels[0]))
+            for chunk in _chunks(len(voxels[0]), self.inputs.chunk_size):
+                imgseries = timeseries[tuple(v[chunk] for v in voxels)]
+                imgseries = regress_poly(2, imgseries)
+                tSTD[chunk] = _compute_tSTD(imgseries, 0, axis=-1)
             threshold_std = np.percentile(tSTD, np.round(100. *
                            (1. - self.inputs.percentile_threshold)).astype(int))
             mask_data = np.zeros_like(mask)
@@ -530,6 +604,13 @@ class TSNRInputSpec(BaseInterfaceInputSpec):
                        desc='output tSNR file')
     detrended_file = File('detrend.nii.gz', usedefault=True, hash_files=False,
                           desc='input file after detrending')
+    streaming = traits.Bool(False, usedefault=True,
+                            desc=('read the inputs a chunk of volumes at a '
+                                  'time, and detrend them a slab of slices at '
+                                  'a time, instead of loading them whole'))
+    chunk_size = traits.Int(100000, usedefault=True,
+                            desc=('approximate number of voxels of the slabs '
+                                  'detrended at once in streaming mode'))
 
 
 class TSNROutputSpec(TraitedSpec):
@@ -545,6 +626,11 @@ class TSNR(BaseInterface):
 
     Typically you want to run this on a realigned time-series.
 
+    With ``streaming``, the inputs are never loaded whole: they are read in
+    chunks of volumes, over which the mean and variance are accumulated, and
+    the polynomial detrending is done on slabs of ``chunk_size`` voxels of a
+    temporary memory-mapped copy.
+
     Example
     -------
 
@@ -560,21 +646,26 @@ class TSNR(BaseInterface):
         img = nb.load(self.inputs.in_file[0], mmap=NUMPY_MMAP)
         header = img.header.copy()
         vollist = [nb.load(filename, mmap=NUMPY_MMAP) for filename in self.inputs.in_file]
-        data = np.concatenate([vol.get_data().reshape(
-            vol.shape[:3] + (-1,)) for vol in vollist], axis=3)
-        data = np.nan_to_num(data)
 
-        if data.dtype.kind == 'i':
-            header.set_data_dtype(np.float32)
-            data = data.astype(np.float32)
+        if self.inputs.streaming:
+            meanimg, stddevimg = self._streaming_stats(vollist, header)
+        else:
+            data = np.concatenate([vol.get_data().reshape(
+                vol.shape[:3] + (-1,)) for vol in vollist], axis=3)
+            data = np.nan_to_num(data)
 
-        if isdefined(self.inputs.regress_poly):
-            data = regress_poly(self.inputs.regress_poly, data, remove_mean=False)
-            img = nb.Nifti1Image(data, img.affine, header)
-            nb.save(img, op.abspath(self.inputs.detrended_file))
+            if data.dtype.kind == 'i':
+                header.set_data_dtype(np.float32)
+                data = data.astype(np.float32)
+
+            if isdefined(self.inputs.regress_poly):
+                data = regress_poly(self.inputs.regress_poly, data, remove_mean=False)
+                img = nb.Nifti1Image(data, img.affine, header)
+                nb.save(img, op.abspath(self.inputs.detrended_file))
+
+            meanimg = np.mean(data, axis=3)
+            stddevimg = np.std(data, axis=3)
 
-        meanimg = np.mean(data, axis=3)
-        stddevimg = np.std(data, axis=3)
         tsnr = np.zeros_like(meanimg)
         tsnr[stddevimg > 1.e-3] = meanimg[stddevimg > 1.e-3] / stddevimg[stddevimg > 1.e-3]
         img = nb.Nifti1Image(tsnr, img.affine, header)
@@ -585,6 +676,73 @@ class TSNR(BaseInterface):
         nb.save(img, op.abspath(self.inputs.stddev_file))
         return runtime
 
+    def _streaming_stats(self, vollist, header):
+        """Mean and standard deviation images, accumulated over chunks of
+        volumes (Chan et al.'s pairwise update), or computed slab by slab
+        from a temporary copy of the inputs when detrending"""
+        shape = vollist[0].shape[:3]
+        chunks = (data for vol in vollist
+                  for _, _, data in iter_volume_chunks(vol))
+        first = next(chunks)
+        # same rule as the in-memory path: integer data becomes float32
+        if first.dtype.kind == 'i':
+            header.set_data_dtype(np.float32)
+
+        if not isdefined(self.inputs.regress_poly):
+            nvols = 0
+            meanimg = np.zeros(shape)
+            m2img = np.zeros(shape)
+            for data in chain([first], chunks):
+                data = np.nan_to_num(data).astype(np.float64)
+                nchunk = data.shape[3]
+                chunk_mean = np.mean(data, axis=3)
+                chunk_m2 = np.sum((data - chunk_mean[..., np.newaxis]) ** 2,
+                                  axis=3)
+                delta = chunk_mean - meanimg
+                total = nvols + nchunk
+                meanimg += delta * (nchunk / total)
+                m2img += chunk_m2 + delta ** 2 * (nvols * nchunk / total)
+                nvols = total
+            return meanimg, np.sqrt(m2img / nvols)
+
+        nvols = sum(int(np.prod(vol.shape[3:])) for vol in vollist)
+        meanimg = np.zeros(shape)
+        stddevimg = np.zeros(shape)
+        if first.dtype.kind == 'i':
+            dtype = np.dtype(np.float32)
+        elif first.dtype.kind == 'f':
+            dtype = first.dtype
+        else:
+            dtype = np.dtype(np.float64)
+        detrended_file = op.abspath(self.inputs.detrended_file)
+        fd, tmp_file = tempfile.mkstemp(suffix='.dat',
+                                        dir=op.dirname(detrended_file))
+        os.close(fd)
+        try:
+            detrended = np.memmap(tmp_file, dtype=dtype, mode='w+',
+                                  shape=shape + (nvols,), order='F')
+            # copy the inputs in one sequential pass, then detrend in place
+            start = 0
+            for data in chain([first], chunks):
+                stop = start + data.shape[3]
+                detrended[..., start:stop] = np.nan_to_num(data)
+                start = stop
+            depth = max(1, self.inputs.chunk_size // (shape[0] * shape[1]))
+            for start in range(0, shape[2], depth):
+                slab = slice(start, start + depth)
+                data = regress_poly(self.inputs.regress_poly,
+                                    np.asarray(detrended[:, :, slab]),
+                                    remove_mean=False)
+                detrended[:, :, slab] = data
+                meanimg[:, :, slab] = np.mean(data, axis=3)
+                stddevimg[:, :, slab] = np.std(data, axis=3)
+            nb.save(nb.Nifti1Image(detrended, vollist[0].affine, header),
+                    detrended_file)
+            del detrended
+        finally:
+            os.remove(tmp_file)
+        return meanimg, stddevimg
+
     def _list_outputs(self):
         outputs = self._outputs().get()
         for k in ['tsnr_file', 'mean_file', 'stddev_file']:
@@ -628,7 +786,7 @@ class NonSteadyStateDetector(BaseInterface):
 
 
 def compute_dvars(in_file, in_mask, remove_zerovariance=False,
-                  intensity_normalization=1000):
+                  intensity_normalization=1000, chunk_size=10000):
     """
     Compute the :abbr:`DVARS (D referring to temporal
     derivative of timecourses, VARS referring to RMS variance over voxels)`
@@ -644,11 +802,13 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
 
     .. note:: Implementation details
 
-      Uses the implementation of the `Yule-Walker equations
-      from nitime
+      The lag-1 autocorrelation used for the :abbr:`AR (auto-regressive)`
+      filtering of the fMRI signal is the Yule-Walker estimate (as in
+      `nitime
       <http://nipy.org/nitime/api/generated/nitime.algorithms.autoregressive.html\
-#nitime.algorithms.autoregressive.AR_est_YW>`_
-      for the :abbr:`AR (auto-regressive)` filtering of the fMRI signal.
+#nitime.algorithms.autoregressive.AR_est_YW>`_), computed for all the
+      voxels at once from sums of products of the demeaned time series.
+      Voxels are processed ``chunk_size`` at a time, in float32.
 
     :param numpy.ndarray func: functional data, after head-motion-correction.
     :param numpy.ndarray mask: a 3D mask of the brain
@@ -659,10 +819,9 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
     """
     import numpy as np
     import nibabel as nb
-    from nitime.algorithms import AR_est_YW
     import warnings
 
-    func = nb.load(in_file, mmap=NUMPY_MMAP).get_data().astype(np.float32)
+    func = nb.load(in_file, mmap=NUMPY_MMAP).get_data()
     mask = nb.load(in_mask, mmap=NUMPY_MMAP).get_data().astype(np.uint8)
 
     if len(func.shape) != 4:
@@ -670,49 +829,86 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
             "Input fMRI dataset should be 4-dimensional")
 
     idx = np.where(mask > 0)
-    mfunc = func[idx[0], idx[1], idx[2], :]
+    chunks = [slice(start, start + chunk_size)
+              for start in range(0, len(idx[0]), chunk_size)]
+    mfunc = np.zeros((len(idx[0]), func.shape[-1]), dtype=np.float32)
+    for chunk in chunks:
+        mfunc[chunk] = func[idx[0][chunk], idx[1][chunk], idx[2][chunk], :]
 
+    scale = None
     if intensity_normalization != 0:
-        mfunc = (mfunc / np.median(mfunc)) * intensity_normalization
-
-    # Robust standard deviation (we are using "lower" interpolation
-    # because this is what FSL is doing
-    func_sd = (np.percentile(mfunc, 75, axis=1, interpolation="lower") -
-               np.percentile(mfunc, 25, axis=1, interpolation="lower")) / 1.349
-
-    if remove_zerovariance:
-        mfunc = mfunc[func_sd != 0, :]
-        func_sd = func_sd[func_sd != 0]
-
-    # Compute (non-robust) estimate of lag-1 autocorrelation
-    ar1 = np.apply_along_axis(AR_est_YW, 1,
-                              regress_poly(0, mfunc, remove_mean=True).astype(
-                                  np.float32), 1)[:, 0]
-
-    # Compute (predicted) standard deviation of temporal difference time series
-    diff_sdhat = np.squeeze(np.sqrt(((1 - ar1) * 2).tolist())) * func_sd
-    diff_sd_mean = diff_sdhat.mean()
-
-    # Compute temporal difference time series
-    func_diff = np.diff(mfunc, axis=1)
+        scale = np.float32(intensity_normalization) / np.median(mfunc)
+
+    nvox = 0
+    diff_sd_sum = 0.
+    diff_sq_sum = np.zeros(func.shape[-1] - 1)
+    diff_vx_sq_sum = np.zeros(func.shape[-1] - 1)
+    for chunk in chunks:
+        cfunc = mfunc[chunk]
+        if scale is not None:
+            cfunc = cfunc * scale
+
+        # Robust standard deviation (we are using "lower" interpolation
+        # because this is what FSL is doing
+        quartiles = np.percentile(cfunc, [25, 75], axis=1,
+                                  interpolation="lower")
+        func_sd = (quartiles[1] - quartiles[0]) / 1.349
+
+        if remove_zerovariance:
+            cfunc = cfunc[func_sd != 0, :]
+            func_sd = func_sd[func_sd != 0]
+
+        # Compute (non-robust) Yule-Walker estimate of lag-1 autocorrelation
+        demeaned = cfunc - cfunc.mean(axis=1, keepdims=True)
+        ar1 = (np.sum(demeaned[:, :-1] * demeaned[:, 1:], axis=1) /
+               np.sum(demeaned * demeaned, axis=1))
+        del demeaned
+
+        # Compute (predicted) standard deviation of temporal difference time
+        # series
+        diff_sdhat = np.sqrt((1 - ar1) * 2) * func_sd
+
+        # Compute temporal difference time series
+        func_diff = np.diff(cfunc, axis=1)
+
+        nvox += len(func_sd)
+        diff_sd_sum += diff_sdhat.sum(dtype=np.float64)
+        diff_sq_sum += np.square(func_diff).sum(axis=0, dtype=np.float64)
+
+        with warnings.catch_warnings():  # catch, e.g., divide by zero errors
+            warnings.filterwarnings('error')
+
+            # voxelwise standardization
+            diff_vx_sq_sum += np.square(
+                func_diff / diff_sdhat[:, np.newaxis]).sum(axis=0,
+                                                           dtype=np.float64)
+
+    diff_sd_mean = diff_sd_sum / nvox
 
     # DVARS (no standardization)
-    dvars_nstd = np.sqrt(np.square(func_diff).mean(axis=0))
+    dvars_nstd = np.sqrt(diff_sq_sum / nvox)
 
     # standardization
     dvars_stdz = dvars_nstd / diff_sd_mean
 
-    with warnings.catch_warnings():  # catch, e.g., divide by zero errors
-        warnings.filterwarnings('error')
-
-        # voxelwise standardization
-        diff_vx_stdz = np.square(
-            func_diff / np.array([diff_sdhat] * func_diff.shape[-1]).T)
-        dvars_vx_stdz = np.sqrt(diff_vx_stdz.mean(axis=0))
+    dvars_vx_stdz = np.sqrt(diff_vx_sq_sum / nvox)
 
     return (dvars_stdz, dvars_nstd, dvars_vx_stdz)
 
 
+def framewise_displacement(mpars, parameter_source, radius=50):
+    """
+    Framewise displacement of a (time points x parameters) array of motion
+    parameters, as the sum of the absolute changes of the translations and
+    of the rotations, converted to displacements on a sphere of the given
+    radius (in mm)
+    """
+    mpars = normalize_mc_params(mpars, parameter_source)
+    diff = mpars[:-1, :6] - mpars[1:, :6]
+    diff[:, 3:6] *= radius
+    return np.abs(diff).sum(axis=1)
+
+
 def plot_confound(tseries, figsize, name, units=None,
                   series_tr=None, normalize=False):
     """
@@ -886,13 +1082,17 @@ def combine_mask_files(mask_files, mask_method=None, mask_index=None):
         return [img]
 
 
-def compute_noise_components(imgseries, mask_images, degree, num_components):
+def compute_noise_components(imgseries, mask_images, degree, num_components,
+                             svd_method='full', chunk_size=10000):
     """Compute the noise components from the imgseries for each mask
 
     imgseries: a nibabel img
     mask_images: a list of nibabel images
     degree: order of polynomial used to remove trends from the timeseries
     num_components: number of noise components to return
+    svd_method: 'full', 'randomized' or 'gram' (see CompCor)
+    chunk_size: number of voxels read at once by the 'randomized' and 'gram'
+        methods
 
     returns:
 
@@ -908,27 +1108,28 @@ def compute_noise_components(imgseries, mask_images, degree, num_components):
                              '({} and {}, respectively)'.format(
                 imgseries.shape[:3], mask.shape))
 
-        voxel_timecourses = imgseries[mask, :]
+        if svd_method == 'full':
+            M = _noise_matrix(imgseries[mask, :], degree)
 
-        # Zero-out any bad values
-        voxel_timecourses[np.isnan(np.sum(voxel_timecourses, axis=1)), :] = 0
-
-        # from paper:
-        # "The constant and linear trends of the columns in the matrix M were
-        # removed [prior to ...]"
-        voxel_timecourses = regress_poly(degree, voxel_timecourses)
-
-        # "Voxel time series from the noise ROI (either anatomical or tSTD) were
-        # placed in a matrix M of size Nxm, with time along the row dimension
-        # and voxels along the column dimension."
-        M = voxel_timecourses.T
+            # "The covariance matrix C = MMT was constructed and decomposed
+            # into its principal components using a singular value
+            # decomposition."
+            u, _, _ = linalg.svd(M, full_matrices=False)
+        else:
+            voxels = np.nonzero(mask)
 
-        # "[... were removed] prior to column-wise variance normalization."
-        M = M / _compute_tSTD(M, 1.)
+            def noise_matrices():
+                for chunk in _chunks(len(voxels[0]), chunk_size):
+                    yield _noise_matrix(
+                        np.asarray(imgseries[tuple(v[chunk] for v in voxels)],
+                                   dtype=np.float32), degree)
 
-        # "The covariance matrix C = MMT was constructed and decomposed into its
-        # principal components using a singular value decomposition."
-        u, _, _ = linalg.svd(M, full_matrices=False)
+            ncomp = min(num_components, imgseries.shape[3], len(voxels[0]))
+            if svd_method == 'gram':
+                u = _gram_components(noise_matrices, imgseries.shape[3], ncomp)
+            else:
+                u = _randomized_components(noise_matrices, imgseries.shape[3],
+                                           ncomp)
         if components is None:
             components = u[:, :num_components]
         else:
@@ -939,6 +1140,69 @@ def compute_noise_components(imgseries, mask_images, degree, num_components):
     return components
 
 
+def _noise_matrix(voxel_timecourses, degree):
+    """The time x voxels matrix M of CompCor, from voxel timecourses"""
+    # Zero-out any bad values
+    voxel_timecourses[np.isnan(np.sum(voxel_timecourses, axis=1)), :] = 0
+
+    # from paper:
+    # "The constant and linear trends of the columns in the matrix M were
+    # removed [prior to ...]"
+    voxel_timecourses = regress_poly(degree, voxel_timecourses)
+
+    # "Voxel time series from the noise ROI (either anatomical or tSTD) were
+    # placed in a matrix M of size Nxm, with time along the row dimension
+    # and voxels along the column dimension."
+    M = voxel_timecourses.T
+
+    # "[... were removed] prior to column-wise variance normalization."
+    return M / _compute_tSTD(M, 1.)
+
+
+def _chunks(length, chunk_size):
+    """Slices of at most chunk_size elements covering range(length)"""
+    chunk_size = max(1, chunk_size)
+    return [slice(start, start + chunk_size)
+            for start in range(0, length, chunk_size)]
+
+
+def _gram_components(noise_matrices, ntimepoints, num_components):
+    """Left singular vectors of the concatenation of the matrices generated
+    by noise_matrices(), as the eigenvectors of its time x time covariance
+    """
+    C = np.zeros((ntimepoints, ntimepoints))
+    for M in noise_matrices():
+        C += M.dot(M.T)
+    _, u = linalg.eigh(C, eigvals=(ntimepoints - num_components,
+                                   ntimepoints - 1))
+    return u[:, ::-1]
+
+
+def _randomized_components(noise_matrices, ntimepoints, num_components,
+                           n_oversamples=10, n_iter=4):
+    """First num_components left singular vectors of the concatenation of the
+    matrices generated by noise_matrices(), with a randomized SVD (Halko et
+    al., 2011) that only needs products of the chunks with thin matrices
+    """
+    rng = np.random.RandomState(0)
+    rank = min(num_components + n_oversamples, ntimepoints)
+    Y = np.zeros((ntimepoints, rank))
+    for M in noise_matrices():
+        Y += M.dot(rng.normal(size=(M.shape[1], rank)))
+    for _ in range(n_iter):
+        Q, _ = linalg.qr(Y, mode='economic')
+        Y = np.zeros((ntimepoints, rank))
+        for M in noise_matrices():
+            Y += M.dot(M.T.dot(Q))
+    Q, _ = linalg.qr(Y, mode='economic')
+    B = np.zeros((rank, rank))
+    for M in noise_matrices():
+        P = Q.T.dot(M)
+        B += P.dot(P.T)
+    _, v = linalg.eigh(B)
+    return Q.dot(v[:, ::-1][:, :num_components])
+
+
 def _compute_tSTD(M, x, axis=0):
     stdM = np.std(M, axis=axis)
     # set bad values to x
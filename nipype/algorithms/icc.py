@@ -3,7 +3,7 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 from builtins import range
 import os
 import numpy as np
-from numpy import ones, kron, mean, eye, hstack, dot, tile
+from numpy import ones, kron, eye, hstack, dot, tile
 import nibabel as nb
 from scipy.linalg import pinv
 from ..interfaces.base import BaseInterfaceInputSpec, TraitedSpec, \
@@ -16,12 +16,15 @@ class ICCInputSpec(BaseInterfaceInputSpec):
                                     desc="n subjects m sessions 3D stat files",
                                     mandatory=True)
     mask = File(exists=True, mandatory=True)
+    chunk_size = traits.Int(50000, usedefault=True,
+                            desc="number of voxels processed at once")
 
 
 class ICCOutputSpec(TraitedSpec):
     icc_map = File(exists=True)
     session_var_map = File(exists=True, desc="variance between sessions")
     subject_var_map = File(exists=True, desc="variance between subjects")
+    sessions_F_map = File(exists=True, desc="F statistic of the session effect")
 
 
 class ICC(BaseInterface):
@@ -30,6 +33,9 @@ class ICC(BaseInterface):
     P. E. Shrout & Joseph L. Fleiss (1979). "Intraclass Correlations: Uses in
     Assessing Rater Reliability". Psychological Bulletin 86 (2): 420-428. This
     particular implementation is aimed at relaibility (test-retest) studies.
+
+    The in-mask voxels are processed ``chunk_size`` at a time, reading only
+    the planes spanned by the current chunk from the input images.
     '''
     input_spec = ICCInputSpec
     output_spec = ICCOutputSpec
@@ -37,34 +43,44 @@ class ICC(BaseInterface):
     def _run_interface(self, runtime):
         maskdata = nb.load(self.inputs.mask).get_data()
         maskdata = np.logical_not(np.logical_or(maskdata == 0, np.isnan(maskdata)))
-
-        session_datas = [[nb.load(fname, mmap=NUMPY_MMAP).get_data()[maskdata].reshape(-1, 1) for fname in sessions] for sessions in self.inputs.subjects_sessions]
-        list_of_sessions = [np.dstack(session_data) for session_data in session_datas]
-        all_data = np.hstack(list_of_sessions)
-        icc = np.zeros(session_datas[0][0].shape)
-        session_F = np.zeros(session_datas[0][0].shape)
-        session_var = np.zeros(session_datas[0][0].shape)
-        subject_var = np.zeros(session_datas[0][0].shape)
-
-        for x in range(icc.shape[0]):
-            Y = all_data[x, :, :]
-            icc[x], subject_var[x], session_var[x], session_F[x], _, _ = ICC_rep_anova(Y)
+        voxels = np.nonzero(maskdata)
+        nvoxels = len(voxels[0])
+
+        images = [[nb.load(fname, mmap=NUMPY_MMAP) for fname in sessions]
+                  for sessions in self.inputs.subjects_sessions]
+        nb_subjects = len(images)
+        nb_conditions = len(images[0])
+
+        icc = np.zeros(nvoxels)
+        session_F = np.zeros(nvoxels)
+        session_var = np.zeros(nvoxels)
+        subject_var = np.zeros(nvoxels)
+
+        projection = _anova_projection(nb_subjects, nb_conditions)
+        chunk_size = max(1, self.inputs.chunk_size)
+        for start in range(0, nvoxels, chunk_size):
+            sl = slice(start, start + chunk_size)
+            chunk = tuple(v[sl] for v in voxels)
+            # voxels are in C order: read the slab of planes spanned by the
+            # chunk from the image proxy, without caching the whole array
+            first, last = chunk[0][0], chunk[0][-1] + 1
+            index = (chunk[0] - first,) + chunk[1:]
+            Y = np.empty((len(chunk[0]), nb_subjects, nb_conditions))
+            for i, sessions in enumerate(images):
+                for j, img in enumerate(sessions):
+                    Y[:, i, j] = np.asanyarray(img.dataobj[first:last])[index]
+            icc[sl], subject_var[sl], session_var[sl], session_F[sl], _, _ = \
+                ICC_rep_anova_batch(Y, projection=projection)
 
         nim = nb.load(self.inputs.subjects_sessions[0][0])
-        new_data = np.zeros(nim.shape)
-        new_data[maskdata] = icc.reshape(-1,)
-        new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
-        nb.save(new_img, 'icc_map.nii')
-
-        new_data = np.zeros(nim.shape)
-        new_data[maskdata] = session_var.reshape(-1,)
-        new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
-        nb.save(new_img, 'session_var_map.nii')
-
-        new_data = np.zeros(nim.shape)
-        new_data[maskdata] = subject_var.reshape(-1,)
-        new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
-        nb.save(new_img, 'subject_var_map.nii')
+        for values, fname in [(icc, 'icc_map.nii'),
+                              (session_var, 'session_var_map.nii'),
+                              (subject_var, 'subject_var_map.nii'),
+                              (session_F, 'sessions_F_map.nii')]:
+            new_data = np.zeros(nim.shape)
+            new_data[maskdata] = values
+            new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
+            nb.save(new_img, fname)
 
         return runtime
 
@@ -77,6 +93,18 @@ class ICC(BaseInterface):
         return outputs
 
 
+def _anova_projection(nb_subjects, nb_conditions):
+    '''
+    Projection matrix on the design of the repeated measure ANOVA, for data
+    flattened session by session (Fortran order)
+    '''
+    # create the design matrix for the different levels
+    x = kron(eye(nb_conditions), ones((nb_subjects, 1)))  # sessions
+    x0 = tile(eye(nb_subjects), (nb_conditions, 1))  # subjects
+    X = hstack([x, x0])
+    return dot(dot(X, pinv(dot(X.T, X))), X.T)
+
+
 def ICC_rep_anova(Y):
     '''
     the data Y are entered as a 'table' ie subjects are in rows and repeated
@@ -86,8 +114,22 @@ def ICC_rep_anova(Y):
 
     Y = XB + E with X = [FaTor / Subjects]
     '''
+    ICC, r_var, e_var, session_effect_F, dfc, dfe = \
+        ICC_rep_anova_batch(np.asarray(Y)[np.newaxis])
+    return ICC[0], r_var[0], e_var[0], session_effect_F[0], dfc, dfe
+
+
+def ICC_rep_anova_batch(Y, projection=None):
+    '''
+    Same as :func:`ICC_rep_anova` for many tables at once
 
-    [nb_subjects, nb_conditions] = Y.shape
+    Y is an array of shape (n_tables, nb_subjects, nb_conditions), e.g. one
+    table per voxel. The design matrix is the same for all tables, so its
+    projection is computed once (or given as ``projection``) and applied
+    to all tables with a single matrix product.
+    '''
+    Y = np.asarray(Y, dtype=np.float64)
+    [_, nb_subjects, nb_conditions] = Y.shape
     dfc = nb_conditions - 1
     dfe = (nb_subjects - 1) * dfc
     dfr = nb_subjects - 1
@@ -96,25 +138,21 @@ def ICC_rep_anova(Y):
     # ------------------------------------
 
     # Sum Square Total
-    mean_Y = mean(Y)
-    SST = ((Y - mean_Y) ** 2).sum()
-
-    # create the design matrix for the different levels
-    x = kron(eye(nb_conditions), ones((nb_subjects, 1)))  # sessions
-    x0 = tile(eye(nb_subjects), (nb_conditions, 1))  # subjects
-    X = hstack([x, x0])
+    mean_Y = Y.mean(axis=(1, 2))
+    SST = ((Y - mean_Y[:, None, None]) ** 2).sum(axis=(1, 2))
 
     # Sum Square Error
-    predicted_Y = dot(dot(dot(X, pinv(dot(X.T, X))), X.T), Y.flatten('F'))
-    residuals = Y.flatten('F') - predicted_Y
-    SSE = (residuals ** 2).sum()
-
-    residuals.shape = Y.shape
+    if projection is None:
+        projection = _anova_projection(nb_subjects, nb_conditions)
+    flat_Y = Y.transpose(0, 2, 1).reshape(Y.shape[0], -1)
+    predicted_Y = dot(flat_Y, projection.T)
+    residuals = flat_Y - predicted_Y
+    SSE = (residuals ** 2).sum(axis=1)
 
     MSE = SSE / dfe
 
     # Sum square session effect - between colums/sessions
-    SSC = ((mean(Y, 0) - mean_Y) ** 2).sum() * nb_subjects
+    SSC = ((Y.mean(axis=1) - mean_Y[:, None]) ** 2).sum(axis=1) * nb_subjects
     MSC = SSC / dfc / nb_subjects
 
     session_effect_F = MSC / MSE
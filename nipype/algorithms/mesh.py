@@ -13,7 +13,7 @@ Miscellaneous algorithms for 2D contours and 3D triangularized meshes handling
 
 """
 from __future__ import print_function, division, unicode_literals, absolute_import
-from builtins import zip, str, bytes
+from builtins import str, bytes
 
 import os.path as op
 import numpy as np
@@ -103,7 +103,7 @@ class WarpPoints(TVTKBaseInterface):
         vox2ras = affine[0:3, 0:3]
         ras2vox = np.linalg.inv(vox2ras)
         origin = affine[0:3, 3]
-        voxpoints = np.array([np.dot(ras2vox, (p - origin)) for p in points])
+        voxpoints = np.dot(points - origin, ras2vox.T)
 
         warps = []
         for axis in warp_dims:
@@ -117,9 +117,7 @@ class WarpPoints(TVTKBaseInterface):
 
             warps.append(warp)
 
-        disps = np.squeeze(np.dstack(warps))
-        newpoints = [p + d for p, d in zip(points, disps)]
-        mesh.points = newpoints
+        mesh.points = points + np.vstack(warps).T
         w = tvtk.PolyDataWriter()
         VTKInfo.configure_input_data(w, mesh)
         w.file_name = self._gen_fname(self.inputs.points, suffix='warped', ext='.vtk')
@@ -186,16 +184,6 @@ class ComputeMeshWarp(TVTKBaseInterface):
     input_spec = ComputeMeshWarpInputSpec
     output_spec = ComputeMeshWarpOutputSpec
 
-    def _triangle_area(self, A, B, C):
-        A = np.array(A)
-        B = np.array(B)
-        C = np.array(C)
-        ABxAC = nla.norm(A - B) * nla.norm(A - C)
-        prod = np.dot(B - A, C - A)
-        angle = np.arccos(prod / ABxAC)
-        area = 0.5 * ABxAC * np.sin(angle)
-        return area
-
     def _run_interface(self, runtime):
         r1 = tvtk.PolyDataReader(file_name=self.inputs.surface1)
         r2 = tvtk.PolyDataReader(file_name=self.inputs.surface2)
@@ -221,18 +209,7 @@ class ComputeMeshWarp(TVTKBaseInterface):
 
         if self.inputs.weighting == 'area':
             faces = vtk1.polys.to_array().reshape(-1, 4).astype(int)[:, 1:]
-
-            for i, p1 in enumerate(points2):
-                # compute surfaces, set in weight
-                w = 0.0
-                point_faces = faces[(faces[:, :] == i).any(axis=1)]
-
-                for idset in point_faces:
-                    fp1 = points1[int(idset[0])]
-                    fp2 = points1[int(idset[1])]
-                    fp3 = points1[int(idset[2])]
-                    w += self._triangle_area(fp1, fp2, fp3)
-                weights[i] = w
+            weights = vertex_areas(points1, faces)
 
         result = np.vstack([errvector, weights])
         np.save(op.abspath(self.inputs.out_file), result.transpose())
@@ -258,6 +235,30 @@ class ComputeMeshWarp(TVTKBaseInterface):
         return outputs
 
 
+def vertex_areas(points, faces):
+    """
+    Returns, for each vertex of a triangular mesh, the sum of the areas of
+    the faces it belongs to
+
+    >>> points = np.array([[0., 0., 0.], [1., 0., 0.], [0., 1., 0.],
+    ...                    [0., 0., 2.]])
+    >>> faces = np.array([[0, 1, 2], [0, 1, 3]])
+    >>> vertex_areas(points, faces).tolist()
+    [1.5, 1.5, 0.5, 1.0]
+
+    """
+    points = np.asarray(points, dtype=np.float64)
+    faces = np.asarray(faces, dtype=int)
+    edges1 = points[faces[:, 1]] - points[faces[:, 0]]
+    edges2 = points[faces[:, 2]] - points[faces[:, 0]]
+    face_areas = 0.5 * np.sqrt(np.sum(np.cross(edges1, edges2) ** 2, axis=1))
+
+    areas = np.zeros(len(points))
+    for i in range(faces.shape[1]):
+        np.add.at(areas, faces[:, i], face_areas)
+    return areas
+
+
 class MeshWarpMathsInputSpec(BaseInterfaceInputSpec):
     in_surf = File(exists=True, mandatory=True,
                    desc=('Input surface in vtk format, with associated warp '
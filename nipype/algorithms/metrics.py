@@ -21,6 +21,7 @@ import os.path as op
 import nibabel as nb
 import numpy as np
 from scipy.ndimage.morphology import binary_erosion
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist, euclidean, dice, jaccard
 from scipy.ndimage.measurements import center_of_mass, label
 
@@ -57,6 +58,15 @@ class DistanceInputSpec(BaseInterfaceInputSpec):
     )
     mask_volume = File(
         exists=True, desc="calculate overlap only within this mask.")
+    percentile = traits.Range(
+        low=0.0, high=100.0, value=100.0, usedefault=True,
+        desc=('percentile of the minimum distances reported by "eucl_max", '
+              'e.g. 95 for the 95th percentile Hausdorff distance (HD95)'))
+    per_label = traits.Bool(
+        False, usedefault=True,
+        desc=('volume1 and volume2 are label maps, compute the distance '
+              'between each label present in both volumes ("eucl_min", '
+              '"eucl_mean" and "eucl_max" only)'))
 
 
 class DistanceOutputSpec(TraitedSpec):
@@ -64,10 +74,28 @@ class DistanceOutputSpec(TraitedSpec):
     point1 = traits.Array(shape=(3,))
     point2 = traits.Array(shape=(3,))
     histogram = File()
+    labels = traits.List(traits.Int(), desc='labels found in both volumes')
+    label_distances = traits.List(traits.Float(),
+                                  desc='distance of each label in labels')
 
 
 class Distance(BaseInterface):
     """Calculates distance between two volumes.
+
+    Minimum distances between point sets are found with nearest-neighbour
+    queries on a k-d tree, so memory use grows linearly with the number of
+    voxels.
+
+    Example
+    -------
+
+    >>> dist = Distance()
+    >>> dist.inputs.volume1 = 'tpms_msk.nii.gz'
+    >>> dist.inputs.volume2 = 'tpms_msk.nii.gz'
+    >>> dist.inputs.method = 'eucl_max'
+    >>> dist.inputs.percentile = 95
+    >>> res = dist.run() # doctest: +SKIP
+
     """
     input_spec = DistanceInputSpec
     output_spec = DistanceOutputSpec
@@ -87,20 +115,28 @@ class Distance(BaseInterface):
         coordinates = np.dot(affine, indices)
         return coordinates[:3, :]
 
-    def _eucl_min(self, nii1, nii2):
-        origdata1 = nii1.get_data().astype(np.bool)
+    def _min_distances(self, from_coordinates, to_coordinates):
+        """Distance from each point (column) of from_coordinates to its
+        nearest point in to_coordinates, and the index of that point"""
+        return cKDTree(to_coordinates.T).query(from_coordinates.T)
+
+    def _eucl_min(self, nii1, nii2, origdata1=None, origdata2=None):
+        if origdata1 is None:
+            origdata1 = nii1.get_data().astype(np.bool)
         border1 = self._find_border(origdata1)
 
-        origdata2 = nii2.get_data().astype(np.bool)
+        if origdata2 is None:
+            origdata2 = nii2.get_data().astype(np.bool)
         border2 = self._find_border(origdata2)
 
         set1_coordinates = self._get_coordinates(border1, nii1.affine)
 
         set2_coordinates = self._get_coordinates(border2, nii2.affine)
 
-        dist_matrix = cdist(set1_coordinates.T, set2_coordinates.T)
-        (point1, point2) = np.unravel_index(
-            np.argmin(dist_matrix), dist_matrix.shape)
+        distances, nearest = self._min_distances(set1_coordinates,
+                                                 set2_coordinates)
+        point1 = np.argmin(distances)
+        point2 = nearest[point1]
         return (euclidean(set1_coordinates.T[point1, :],
                           set2_coordinates.T[point2, :]),
                 set1_coordinates.T[point1, :],
@@ -127,23 +163,27 @@ class Distance(BaseInterface):
 
         return np.mean(dist_matrix)
 
-    def _eucl_mean(self, nii1, nii2, weighted=False):
-        origdata1 = nii1.get_data().astype(np.bool)
+    def _eucl_mean(self, nii1, nii2, weighted=False, origdata1=None,
+                   origdata2=None, histogram=True):
+        if origdata1 is None:
+            origdata1 = nii1.get_data().astype(np.bool)
         border1 = self._find_border(origdata1)
 
-        origdata2 = nii2.get_data().astype(np.bool)
+        if origdata2 is None:
+            origdata2 = nii2.get_data().astype(np.bool)
 
         set1_coordinates = self._get_coordinates(border1, nii1.affine)
         set2_coordinates = self._get_coordinates(origdata2, nii2.affine)
 
-        dist_matrix = cdist(set1_coordinates.T, set2_coordinates.T)
-        min_dist_matrix = np.amin(dist_matrix, axis=0)
-        import matplotlib.pyplot as plt
-        plt.figure()
-        plt.hist(min_dist_matrix, 50, normed=1, facecolor='green')
-        plt.savefig(self._hist_filename)
-        plt.clf()
-        plt.close()
+        min_dist_matrix, _ = self._min_distances(set2_coordinates,
+                                                 set1_coordinates)
+        if histogram:
+            import matplotlib.pyplot as plt
+            plt.figure()
+            plt.hist(min_dist_matrix, 50, normed=1, facecolor='green')
+            plt.savefig(self._hist_filename)
+            plt.clf()
+            plt.close()
 
         if weighted:
             return np.average(
@@ -153,13 +193,15 @@ class Distance(BaseInterface):
         else:
             return np.mean(min_dist_matrix)
 
-    def _eucl_max(self, nii1, nii2):
-        origdata1 = nii1.get_data()
-        origdata1 = np.logical_not(
-            np.logical_or(origdata1 == 0, np.isnan(origdata1)))
-        origdata2 = nii2.get_data()
-        origdata2 = np.logical_not(
-            np.logical_or(origdata2 == 0, np.isnan(origdata2)))
+    def _eucl_max(self, nii1, nii2, origdata1=None, origdata2=None):
+        if origdata1 is None:
+            origdata1 = nii1.get_data()
+            origdata1 = np.logical_not(
+                np.logical_or(origdata1 == 0, np.isnan(origdata1)))
+        if origdata2 is None:
+            origdata2 = nii2.get_data()
+            origdata2 = np.logical_not(
+                np.logical_or(origdata2 == 0, np.isnan(origdata2)))
 
         if isdefined(self.inputs.mask_volume):
             maskdata = nb.load(self.inputs.mask_volume).get_data()
@@ -176,18 +218,56 @@ class Distance(BaseInterface):
 
         set1_coordinates = self._get_coordinates(border1, nii1.affine)
         set2_coordinates = self._get_coordinates(border2, nii2.affine)
-        distances = cdist(set1_coordinates.T, set2_coordinates.T)
         mins = np.concatenate(
-            (np.amin(distances, axis=0), np.amin(distances, axis=1)))
+            (self._min_distances(set2_coordinates, set1_coordinates)[0],
+             self._min_distances(set1_coordinates, set2_coordinates)[0]))
 
+        if self.inputs.percentile < 100:
+            return np.percentile(mins, self.inputs.percentile)
         return np.max(mins)
 
+    def _eucl_labels(self, nii1, nii2):
+        data1 = nii1.get_data()
+        data2 = nii2.get_data()
+        if data1.ndim == 4:
+            data1 = data1[:, :, :, 0]
+            data2 = data2[:, :, :, 0]
+        labels = np.intersect1d(np.unique(data1), np.unique(data2))
+        labels = labels[(labels != 0) & ~np.isnan(labels)]
+
+        distances = []
+        for l in labels:
+            mask1 = data1 == l
+            mask2 = data2 == l
+            if self.inputs.method == "eucl_min":
+                distance = self._eucl_min(nii1, nii2, origdata1=mask1,
+                                          origdata2=mask2)[0]
+            elif self.inputs.method == "eucl_mean":
+                distance = self._eucl_mean(nii1, nii2, origdata1=mask1,
+                                           origdata2=mask2, histogram=False)
+            else:
+                distance = self._eucl_max(nii1, nii2, origdata1=mask1,
+                                          origdata2=mask2)
+            distances.append(float(distance))
+        return [int(l) for l in labels], distances
+
     def _run_interface(self, runtime):
         # there is a bug in some scipy ndimage methods that gets tripped by memory mapped objects
         nii1 = nb.load(self.inputs.volume1, mmap=False)
         nii2 = nb.load(self.inputs.volume2, mmap=False)
 
-        if self.inputs.method == "eucl_min":
+        if self.inputs.per_label:
+            if self.inputs.method not in ["eucl_min", "eucl_mean",
+                                          "eucl_max"]:
+                raise ValueError('per_label is not supported with method '
+                                 '"%s"' % self.inputs.method)
+            self._labels, self._label_distances = self._eucl_labels(
+                nii1, nii2)
+            self._distance = np.NaN
+            if self._label_distances:
+                self._distance = np.mean(self._label_distances)
+
+        elif self.inputs.method == "eucl_min":
             self._distance, self._point1, self._point2 = self._eucl_min(
                 nii1, nii2)
 
@@ -207,7 +287,10 @@ class Distance(BaseInterface):
     def _list_outputs(self):
         outputs = self._outputs().get()
         outputs['distance'] = self._distance
-        if self.inputs.method == "eucl_min":
+        if self.inputs.per_label:
+            outputs['labels'] = self._labels
+            outputs['label_distances'] = self._label_distances
+        elif self.inputs.method == "eucl_min":
             outputs['point1'] = self._point1
             outputs['point2'] = self._point2
         elif self.inputs.method in ["eucl_mean", "eucl_wmean"]:
@@ -215,6 +298,45 @@ class Distance(BaseInterface):
         return outputs
 
 
+def label_overlaps(reference, tests, labels):
+    """
+    Voxel counts of the intersection of each label of ``reference`` with
+    the same label in each of the ``tests`` maps, and the volume (in voxels)
+    of each label in every map.
+
+    All maps must be arrays of non-negative integer labels with the same
+    shape. All labels are counted at once with :func:`numpy.bincount`, and
+    the label index of the reference is built only once for all the test
+    maps, so comparing many subjects to a common reference (e.g. an atlas)
+    does not repeat the work for the reference.
+
+    Returns ``(intersections, ref_volumes, tst_volumes)``, of shapes
+    ``(len(tests), len(labels))``, ``(len(labels),)`` and
+    ``(len(tests), len(labels))``.
+
+    >>> ref = np.array([0, 1, 1, 2, 2, 2])
+    >>> inter, vol1, vol2 = label_overlaps(ref, [ref, [0, 1, 2, 2, 2, 0]],
+    ...                                    [1, 2])
+    >>> inter.tolist(), vol1.tolist(), vol2.tolist()
+    ([[2, 3], [1, 2]], [2, 3], [[2, 3], [1, 3]])
+
+    """
+    labels = np.asarray(labels, dtype=np.intp)
+    reference = np.asarray(reference).ravel().astype(np.intp)
+    nbins = int(max(reference.max(), labels.max() if labels.size else 0)) + 1
+    ref_volumes = np.bincount(reference, minlength=nbins)[labels]
+
+    intersections = np.zeros((len(tests), len(labels)), dtype=np.intp)
+    tst_volumes = np.zeros((len(tests), len(labels)), dtype=np.intp)
+    for i, tst in enumerate(tests):
+        tst = np.asarray(tst).ravel().astype(np.intp)
+        tst_bins = max(nbins, int(tst.max()) + 1)
+        intersections[i] = np.bincount(reference[reference == tst],
+                                       minlength=tst_bins)[labels]
+        tst_volumes[i] = np.bincount(tst, minlength=tst_bins)[labels]
+    return intersections, ref_volumes, tst_volumes
+
+
 class OverlapInputSpec(BaseInterfaceInputSpec):
     volume1 = File(exists=True, mandatory=True,
                    desc='Has to have the same dimensions as volume2.')
@@ -261,6 +383,10 @@ class Overlap(BaseInterface):
     now can be reported in :math:`mm^3`, although they are given in voxels
     to keep backwards compatibility.
 
+    The overlaps of all the labels are counted in a single pass over the
+    volumes (see :func:`label_overlaps`, which also compares several maps
+    against a shared reference).
+
     Example
     -------
 
@@ -305,19 +431,19 @@ class Overlap(BaseInterface):
             data1[~maskdata] = 0
             data2[~maskdata] = 0
 
-        res = []
-        volumes1 = []
-        volumes2 = []
-
         labels = np.unique(data1[data1 > 0].reshape(-1)).tolist()
         if self.inputs.bg_overlap:
             labels.insert(0, 0)
 
-        for l in labels:
-            res.append(self._bool_vec_dissimilarity(data1 == l,
-                                                    data2 == l, method='jaccard'))
-            volumes1.append(scale * len(data1[data1 == l]))
-            volumes2.append(scale * len(data2[data2 == l]))
+        intersections, volumes1, volumes2 = label_overlaps(data1, [data2],
+                                                           labels)
+        intersections = intersections[0]
+        volumes2 = volumes2[0]
+        unions = volumes1 + volumes2 - intersections
+        res = np.zeros(len(labels))
+        res[unions > 0] = intersections[unions > 0] / unions[unions > 0]
+        volumes1 = scale * volumes1
+        volumes2 = scale * volumes2
 
         results = dict(jaccard=[], dice=[])
         results['jaccard'] = np.array(res)
@@ -706,9 +706,126 @@ class AddCSVColumn(BaseInterface):
         return outputs
 
 
+def _csv_shard_dir(in_file):
+    return op.abspath(in_file) + '.rows'
+
+
+def _file_id(path):
+    """Identity of a file, changed when the file is replaced by a rename"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime
+
+
+def _read_csv_shards(in_file, shard_dir):
+    import pandas as pd
+
+    shards = []
+    if op.isdir(shard_dir):
+        shards = [op.join(shard_dir, f) for f in sorted(os.listdir(shard_dir))
+                  if f.endswith('.csv')]
+
+    frames = []
+    if op.exists(in_file):
+        frames.append(pd.read_csv(in_file, index_col=0))
+    frames += [pd.read_csv(f, index_col=0) for f in shards]
+    if not frames:
+        return pd.DataFrame(), shards
+    return pd.concat(frames, ignore_index=True), shards
+
+
+def merge_csv_shards(in_file, compact=False, timeout=60.):
+    """Read a CSV file written by :class:`AddCSVRow` in ``append_mode``
+
+    The rows stored in ``in_file`` (if any) are concatenated with the
+    per-row shard files, in the order they were written. Each shard
+    carries its own header, so rows with different columns are aligned
+    by column name and missing values are left empty.
+
+    A compaction holds the ``<in_file>.rows.lock`` file while it rewrites
+    ``in_file`` and removes the merged shards. Other compactions wait for
+    it, and reads that overlap it are retried, so concurrent reads and
+    compactions neither miss nor duplicate rows.
+
+    Parameters
+    ----------
+    in_file : str
+        The CSV file given to :class:`AddCSVRow`
+    compact : bool
+        Write the merged table back to ``in_file`` and remove the shards
+        that were merged. Rows appended concurrently are kept as shards.
+    timeout : float
+        Seconds to wait for a concurrent compaction to finish before
+        raising a RuntimeError (e.g. if a crashed compaction left its lock
+        behind)
+
+    Returns
+    -------
+    pandas.DataFrame
+        The merged table
+
+    """
+    import errno
+    import time
+
+    shard_dir = _csv_shard_dir(in_file)
+    lock_file = shard_dir + '.lock'
+    deadline = time.time() + timeout
+
+    def _wait():
+        if time.time() > deadline:
+            raise RuntimeError('Timed out waiting for the compaction of %s '
+                               '(remove %s if it is stale)' %
+                               (in_file, lock_file))
+        time.sleep(0.05)
+
+    if compact:
+        while True:
+            try:
+                os.close(os.open(lock_file,
+                                 os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            _wait()
+        try:
+            # only compactions remove shards, and they hold the lock
+            df, shards = _read_csv_shards(in_file, shard_dir)
+            tmp_file = '%s.%d.tmp' % (op.abspath(in_file), os.getpid())
+            with open(tmp_file, 'w') as f:
+                df.to_csv(f)
+            os.rename(tmp_file, in_file)
+            for f in shards:
+                os.remove(f)
+        finally:
+            os.remove(lock_file)
+        return df
+
+    while True:
+        if not op.exists(lock_file):
+            state = _file_id(in_file)
+            try:
+                df, _ = _read_csv_shards(in_file, shard_dir)
+            except (IOError, OSError):
+                # unless a compaction removed a shard being read
+                if not op.exists(lock_file) and _file_id(in_file) == state:
+                    raise
+            else:
+                if not op.exists(lock_file) and _file_id(in_file) == state:
+                    return df
+        _wait()
+
+
 class AddCSVRowInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     in_file = traits.File(mandatory=True,
                           desc='Input comma-separated value (CSV) files')
+    append_mode = traits.Bool(
+        False, usedefault=True,
+        desc=('write the row atomically to its own shard file next to '
+              'in_file instead of rewriting in_file, see merge_csv_shards'))
     _outputs = traits.Dict(traits.Any, value={}, usedefault=True)
 
     def __setattr__(self, key, value):
@@ -723,7 +840,8 @@ class AddCSVRowInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
 
 
 class AddCSVRowOutputSpec(TraitedSpec):
-    csv_file = File(desc='Output CSV file containing rows ')
+    csv_file = File(desc=('Output CSV file containing rows (in append_mode, '
+                          'the shard file with the new row)'))
 
 
 class AddCSVRow(BaseInterface):
@@ -750,6 +868,20 @@ class AddCSVRow(BaseInterface):
     >>> addrow.inputs.subject_id = 'S400'
     >>> addrow.inputs.list_of_values = [ 0.4, 0.7, 0.3 ]
     >>> addrow.run() # doctest: +SKIP
+
+    With ``append_mode`` every row is written to its own file in the
+    ``scores.csv.rows`` directory, so appending does not depend on the size
+    of the table and needs no lock. The ``csv_file`` output is then that
+    shard file, and the whole table is merged on read with
+    :func:`merge_csv_shards`.
+
+    >>> addrow = misc.AddCSVRow()
+    >>> addrow.inputs.in_file = 'scores.csv'
+    >>> addrow.inputs.append_mode = True
+    >>> addrow.inputs.subject_id = 'S400'
+    >>> addrow.inputs.si = 0.74
+    >>> addrow.run() # doctest: +SKIP
+    >>> df = misc.merge_csv_shards('scores.csv') # doctest: +SKIP
     """
     input_spec = AddCSVRowInputSpec
     output_spec = AddCSVRowOutputSpec
@@ -760,6 +892,7 @@ class AddCSVRow(BaseInterface):
         self._infields = infields
         self._have_lock = False
         self._lock = None
+        self._shard_file = None
 
         if infields:
             for key in infields:
@@ -778,6 +911,10 @@ class AddCSVRow(BaseInterface):
             raise_from(ImportError('This interface requires pandas '
                                     '(http://pandas.pydata.org/) to run.'), e)
 
+        if self.inputs.append_mode:
+            self._write_shard(pd.DataFrame([self._row_dict()]))
+            return runtime
+
         try:
             import lockfile as pl
             self._have_lock = True
@@ -786,19 +923,7 @@ class AddCSVRow(BaseInterface):
             warn(('Python module lockfile was not found: AddCSVRow will not be'
                   ' thread-safe in multi-processor execution'))
 
-        input_dict = {}
-        for key, val in list(self.inputs._outputs.items()):
-            # expand lists to several columns
-            if key == 'trait_added' and val in self.inputs.copyable_trait_names():
-                continue
-
-            if isinstance(val, list):
-                for i, v in enumerate(val):
-                    input_dict['%s_%d' % (key, i)] = v
-            else:
-                input_dict[key] = val
-
-        df = pd.DataFrame([input_dict])
+        df = pd.DataFrame([self._row_dict()])
 
         if self._have_lock:
             self._lock = pl.FileLock(self.inputs.in_file)
@@ -825,9 +950,46 @@ class AddCSVRow(BaseInterface):
 
         return runtime
 
+    def _row_dict(self):
+        input_dict = {}
+        for key, val in list(self.inputs._outputs.items()):
+            # expand lists to several columns
+            if key == 'trait_added' and val in self.inputs.copyable_trait_names():
+                continue
+
+            if isinstance(val, list):
+                for i, v in enumerate(val):
+                    input_dict['%s_%d' % (key, i)] = v
+            else:
+                input_dict[key] = val
+        return input_dict
+
+    def _write_shard(self, df):
+        """Atomically write a one-row table to the shard directory"""
+        import time
+        from uuid import uuid4
+
+        shard_dir = _csv_shard_dir(self.inputs.in_file)
+        try:
+            os.makedirs(shard_dir)
+        except OSError:
+            if not op.isdir(shard_dir):
+                raise
+
+        # names sort in write order; the uuid keeps concurrent writers apart
+        name = '%020d-%s' % (int(time.time() * 1e6), uuid4().hex)
+        tmp_file = op.join(shard_dir, '.%s.tmp' % name)
+        with open(tmp_file, 'w') as f:
+            df.to_csv(f)
+        self._shard_file = op.join(shard_dir, name + '.csv')
+        os.rename(tmp_file, self._shard_file)
+
     def _list_outputs(self):
         outputs = self.output_spec().get()
-        outputs['csv_file'] = self.inputs.in_file
+        if self.inputs.append_mode:
+            outputs['csv_file'] = self._shard_file
+        else:
+            outputs['csv_file'] = self.inputs.in_file
         return outputs
 
     def _outputs(self):
@@ -1155,6 +1317,233 @@ class MergeROIs(BaseInterface):
         return outputs
 
 
+class SplitVoxelsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True,
+                   desc='4D file to be processed voxel-wise')
+    in_mask = File(exists=True, desc='only process voxels inside mask')
+    block_size = traits.Int(10000, usedefault=True,
+                            desc='number of voxels in each block')
+
+
+class SplitVoxelsOutputSpec(TraitedSpec):
+    data_file = File(exists=True,
+                     desc='voxels x volumes array of the in-mask voxels')
+    index_file = File(exists=True,
+                      desc='original locations of the rows of data_file')
+    starts = traits.List(traits.Int(), desc='first row of each block')
+    stops = traits.List(traits.Int(), desc='last row (excluded) of each block')
+
+
+class SplitVoxels(BaseInterface):
+    """
+    Stores the time series of the in-mask voxels of a 4D image as an array
+    (in NumPy ``.npy`` format) that can be memory-mapped, and splits it in
+    blocks of voxels to be processed in parallel by :class:`MapVoxelBlock`
+    (e.g. as a MapNode iterating over ``starts`` and ``stops``). Use
+    :class:`MergeVoxels` to assemble the results.
+
+    Example
+    -------
+
+    >>> from nipype.algorithms import misc
+    >>> split = misc.SplitVoxels()
+    >>> split.inputs.in_file = 'diffusion.nii'
+    >>> split.inputs.in_mask = 'mask.nii'
+    >>> split.run() # doctest: +SKIP
+
+    """
+    input_spec = SplitVoxelsInputSpec
+    output_spec = SplitVoxelsOutputSpec
+
+    def _run_interface(self, runtime):
+        mask = None
+        if isdefined(self.inputs.in_mask):
+            mask = self.inputs.in_mask
+        self._data_file, self._index_file, blocks = split_voxels(
+            self.inputs.in_file, mask, self.inputs.block_size)
+        self._starts = [start for start, _ in blocks]
+        self._stops = [stop for _, stop in blocks]
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs['data_file'] = self._data_file
+        outputs['index_file'] = self._index_file
+        outputs['starts'] = self._starts
+        outputs['stops'] = self._stops
+        return outputs
+
+
+class MapVoxelBlockInputSpec(BaseInterfaceInputSpec):
+    function = traits.Str(mandatory=True,
+                          desc=('code of a function taking a voxels x volumes '
+                                'array and returning a voxels x outputs array'))
+    data_file = File(exists=True, mandatory=True,
+                     desc='voxels array written by SplitVoxels')
+    start = traits.Int(mandatory=True, desc='first row of the block')
+    stop = traits.Int(mandatory=True, desc='last row (excluded) of the block')
+
+
+class MapVoxelBlockOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc='result of the block (.npy)')
+
+
+class MapVoxelBlock(BaseInterface):
+    """
+    Applies a function to a block of voxels written by :class:`SplitVoxels`.
+    The function can be given as a function object, which must be
+    importable or defined in a file, or as source code.
+
+    Example
+    -------
+
+    >>> from nipype.algorithms import misc
+    >>> block = misc.MapVoxelBlock()
+    >>> block.inputs.function = 'def mean(data): return data.mean(axis=1)'
+    >>> block.inputs.data_file = 'voxels.npy' # doctest: +SKIP
+    >>> block.inputs.start = 0
+    >>> block.inputs.stop = 10000
+    >>> block.run() # doctest: +SKIP
+
+    """
+    input_spec = MapVoxelBlockInputSpec
+    output_spec = MapVoxelBlockOutputSpec
+
+    def __init__(self, function=None, **inputs):
+        super(MapVoxelBlock, self).__init__(**inputs)
+        if function is not None:
+            self.inputs.function = _function_source(function)
+
+    def _run_interface(self, runtime):
+        self._out_file = map_voxel_block(self.inputs.function,
+                                         self.inputs.data_file,
+                                         self.inputs.start, self.inputs.stop)
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs['out_file'] = self._out_file
+        return outputs
+
+
+class MergeVoxelsInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(File(exists=True), mandatory=True,
+                              desc='results of the blocks, in block order')
+    in_index = File(exists=True, mandatory=True,
+                    desc='index file written by SplitVoxels')
+    in_reference = File(exists=True, mandatory=True,
+                        desc='reference file')
+
+
+class MergeVoxelsOutputSpec(TraitedSpec):
+    merged_file = File(exists=True, desc='the recomposed file')
+
+
+class MergeVoxels(BaseInterface):
+    """
+    Assembles the results of :class:`MapVoxelBlock` into an image.
+
+    Example
+    -------
+
+    >>> from nipype.algorithms import misc
+    >>> merge = misc.MergeVoxels()
+    >>> merge.inputs.in_files = ['block%010d.npy' % i
+    ...                          for i in range(3)] # doctest: +SKIP
+    >>> merge.inputs.in_index = 'voxels_idx.npy' # doctest: +SKIP
+    >>> merge.inputs.in_reference = 'mask.nii'
+    >>> merge.run() # doctest: +SKIP
+
+    """
+    input_spec = MergeVoxelsInputSpec
+    output_spec = MergeVoxelsOutputSpec
+
+    def _run_interface(self, runtime):
+        self._merged = merge_voxels(self.inputs.in_files,
+                                    self.inputs.in_index,
+                                    self.inputs.in_reference)
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs['merged_file'] = self._merged
+        return outputs
+
+
+class MapVoxelsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True,
+                   desc='4D file to be processed voxel-wise')
+    in_mask = File(exists=True, desc='only process voxels inside mask')
+    function = traits.Str(mandatory=True,
+                          desc=('code of a function taking a voxels x volumes '
+                                'array and returning a voxels x outputs array'))
+    block_size = traits.Int(10000, usedefault=True,
+                            desc='number of voxels in each block')
+    n_procs = traits.Int(1, usedefault=True,
+                         desc='number of processes the blocks are mapped on')
+    out_file = File('mapped.nii.gz', usedefault=True,
+                    desc='output file name')
+
+
+class MapVoxelsOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc='the result of the function')
+
+
+class MapVoxels(BaseInterface):
+    """
+    Applies a function to the time series of the voxels of a 4D image,
+    block by block, on a pool of processes. The in-mask voxels are shared
+    with the processes through a memory-mapped array, and the results of
+    the blocks are written straight into the output image.
+
+    The function takes a voxels x volumes array and returns an array with
+    one row per voxel (e.g. the parameters of a model fitted at each
+    voxel). It can be given as a function object, which must be importable
+    or defined in a file, or as source code.
+
+    Example
+    -------
+
+    >>> from nipype.algorithms import misc
+    >>> vmap = misc.MapVoxels()
+    >>> vmap.inputs.function = 'def mean(data): return data.mean(axis=1)'
+    >>> vmap.inputs.in_file = 'diffusion.nii'
+    >>> vmap.inputs.in_mask = 'mask.nii'
+    >>> vmap.inputs.n_procs = 4
+    >>> vmap.run() # doctest: +SKIP
+
+    """
+    input_spec = MapVoxelsInputSpec
+    output_spec = MapVoxelsOutputSpec
+
+    def __init__(self, function=None, **inputs):
+        super(MapVoxels, self).__init__(**inputs)
+        if function is not None:
+            self.inputs.function = _function_source(function)
+
+    def _run_interface(self, runtime):
+        mask = None
+        if isdefined(self.inputs.in_mask):
+            mask = self.inputs.in_mask
+        map_voxels(self.inputs.function, self.inputs.in_file, mask,
+                   block_size=self.inputs.block_size,
+                   n_procs=self.inputs.n_procs,
+                   out_file=op.abspath(self.inputs.out_file))
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs['out_file'] = op.abspath(self.inputs.out_file)
+        return outputs
+
+
+def _function_source(function):
+    if hasattr(function, '__call__'):
+        from ..utils.misc import getsource
+        return getsource(function)
+    return function
+
+
 def normalize_tpms(in_files, in_mask=None, out_files=[]):
     """
     Returns the input tissue probability maps (tpms, aka volume fractions)
@@ -1294,88 +1683,222 @@ def merge_rois(in_files, in_idxs, in_ref,
                dtype=None, out_file=None):
     """
     Re-builds an image resulting from a parallelized processing
+
+    The chunks are scattered, one at a time, into a single memory-mapped
+    array that is written to ``out_file`` at the end, so the memory use does
+    not depend on the size of the output image.
     """
     import nibabel as nb
     import numpy as np
     import os.path as op
-    import subprocess as sp
 
     if out_file is None:
         out_file = op.abspath('merged.nii.gz')
 
-    if dtype is None:
-        dtype = np.float32
+    def _chunks():
+        for cname, iname in zip(in_files, in_idxs):
+            with np.load(iname) as f:
+                idxs = np.atleast_1d(np.squeeze(f['arr_0']))
+            cdata = nb.load(cname, mmap=NUMPY_MMAP).get_data()
+            cdata = cdata.reshape(-1, int(np.prod(cdata.shape[3:])))
+            yield idxs, cdata[0:len(idxs), ...]
+
+    return _scatter_chunks(_chunks(), in_ref, dtype, out_file)
+
+
+def split_voxels(in_file, mask=None, block_size=None, out_prefix=None,
+                 chunk_size=None):
+    """
+    Writes the time series of the in-mask voxels of a 4D image to a
+    voxels x volumes array in NumPy format, which can be memory-mapped,
+    and the (flat) location of each voxel to an index file. The image is
+    read ``chunk_size`` voxels at a time (see
+    :func:`nipype.utils.misc.iter_volume_chunks`).
+
+    Returns the data and index files, and the ``(start, stop)`` rows of the
+    blocks of ``block_size`` voxels.
+    """
+    import nibabel as nb
+    import numpy as np
+    import os.path as op
+    from ..utils.misc import iter_volume_chunks
+
+    if block_size is None:
+        block_size = 10000
+    if out_prefix is None:
+        out_prefix = op.abspath('voxels')
+
+    im = nb.load(in_file, mmap=NUMPY_MMAP)
+    dshape = im.shape[:3]
+    nvols = im.shape[3] if len(im.shape) > 3 else 1
+
+    if mask is not None:
+        mask = nb.load(mask, mmap=NUMPY_MMAP).get_data() > 0
+    else:
+        mask = np.ones(dshape, dtype=bool)
+    idxs = np.flatnonzero(mask)
+
+    index_file = out_prefix + '_idx.npy'
+    np.save(index_file, idxs)
+    data_file = out_prefix + '.npy'
+    data = np.lib.format.open_memmap(data_file, mode='w+', dtype=np.float32,
+                                     shape=(len(idxs), nvols))
+    # a bounded chunk of volumes in memory at a time
+    for start, stop, vols in iter_volume_chunks(im, chunk_size):
+        data[:, start:stop] = vols[mask]
+    del data
+
+    blocks = [(start, min(start + block_size, len(idxs)))
+              for start in range(0, len(idxs), block_size)]
+    return data_file, index_file, blocks
+
+
+def map_voxel_block(function, data_file, start, stop, out_file=None):
+    """
+    Applies ``function`` (a function object or its source code) to the rows
+    ``start:stop`` of a voxels array written by :func:`split_voxels`, and
+    saves the result to ``out_file`` (in NumPy format).
+    """
+    import numpy as np
+    import os.path as op
+
+    if out_file is None:
+        out_file = op.abspath('block%010d.npy' % start)
+    np.save(out_file, _map_voxel_block((function, data_file, start, stop))[2])
+    return out_file
+
+
+def _map_voxel_block(args):
+    function, data_file, start, stop = args
+    if not hasattr(function, '__call__'):
+        from ..utils.misc import create_function_from_source
+        function = create_function_from_source(function)
+    data = np.load(data_file, mmap_mode='r')
+    result = np.asarray(function(np.asarray(data[start:stop])))
+    return start, stop, result.reshape(stop - start, -1)
+
+
+def merge_voxels(in_files, index_file, in_ref, dtype=None, out_file=None):
+    """
+    Assembles the results of :func:`map_voxel_block`, given in block order,
+    into an image
+    """
+    import numpy as np
+    import os.path as op
+
+    if out_file is None:
+        out_file = op.abspath('merged.nii.gz')
+
+    def _chunks():
+        idxs = np.load(index_file, mmap_mode='r')
+        start = 0
+        for fname in in_files:
+            cdata = np.load(fname, mmap_mode='r')
+            cdata = cdata.reshape(cdata.shape[0], -1)
+            yield idxs[start:start + cdata.shape[0]], cdata
+            start += cdata.shape[0]
 
-    # if file is compressed, uncompress using os
-    # to avoid memory errors
-    if op.splitext(in_ref)[1] == '.gz':
+    return _scatter_chunks(_chunks(), in_ref, dtype, out_file)
+
+
+def map_voxels(function, in_file, mask=None, block_size=None, n_procs=1,
+               dtype=None, out_file=None):
+    """
+    Applies ``function`` to the time series of the in-mask voxels of
+    ``in_file``, ``block_size`` voxels at a time, on ``n_procs`` processes.
+
+    ``function`` takes a voxels x volumes array and returns an array with
+    one row per voxel. It is either the source code of a function or a
+    function object, which must be picklable when ``n_procs > 1``. The
+    voxels are read by the processes from a memory-mapped array, and the
+    results of the blocks are scattered into the output image as soon as
+    they are available.
+    """
+    import os.path as op
+    import shutil
+    import tempfile
+    from multiprocessing import Pool
+
+    if out_file is None:
+        out_file = op.abspath('mapped.nii.gz')
+
+    tmp_dir = tempfile.mkdtemp(dir=op.dirname(op.abspath(out_file)))
+    try:
+        data_file, index_file, blocks = split_voxels(
+            in_file, mask, block_size, op.join(tmp_dir, 'voxels'))
+        idxs = np.load(index_file, mmap_mode='r')
+        args = [(function, data_file, start, stop) for start, stop in blocks]
+
+        if n_procs > 1:
+            pool = Pool(processes=n_procs)
+            results = pool.imap_unordered(_map_voxel_block, args)
+        else:
+            pool = None
+            results = (_map_voxel_block(arg) for arg in args)
         try:
-            iflogger.info('uncompress %i' % in_ref)
-            sp.check_call(['gunzip', in_ref], stdout=sp.PIPE, shell=True)
-            in_ref = op.splitext(in_ref)[0]
-        except:
-            pass
+            _scatter_chunks(((idxs[start:stop], result)
+                             for start, stop, result in results),
+                            in_file, dtype, out_file)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    finally:
+        shutil.rmtree(tmp_dir)
+    return out_file
+
 
+def _scatter_chunks(chunks, in_ref, dtype, out_file):
+    """
+    Scatters ``(flat indices, values)`` chunks into a memory-mapped array
+    with the spatial shape of ``in_ref``, and writes it to ``out_file``.
+    The number of values per voxel is given by the first chunk.
+    """
+    import nibabel as nb
+    import numpy as np
+    import os
+    import os.path as op
+    import tempfile
+
+    if dtype is None:
+        dtype = np.float32
+
+    # only the header of the reference is read
     ref = nb.load(in_ref, mmap=NUMPY_MMAP)
     aff = ref.affine
     hdr = ref.header.copy()
-    rsh = ref.shape
+    rsh = ref.shape[:3]
     del ref
-    npix = rsh[0] * rsh[1] * rsh[2]
-    fcdata = nb.load(in_files[0]).get_data()
 
-    if fcdata.ndim == 4:
-        ndirs = fcdata.shape[-1]
-    else:
-        ndirs = 1
-    newshape = (rsh[0], rsh[1], rsh[2], ndirs)
-    hdr.set_data_dtype(dtype)
-    hdr.set_xyzt_units('mm', 'sec')
-
-    if ndirs < 300:
-        data = np.zeros((npix, ndirs))
-        for cname, iname in zip(in_files, in_idxs):
-            f = np.load(iname)
-            idxs = np.squeeze(f['arr_0'])
-            cdata = nb.load(cname, mmap=NUMPY_MMAP).get_data().reshape(-1, ndirs)
-            nels = len(idxs)
-            idata = (idxs, )
+    fd, tmp_file = tempfile.mkstemp(suffix='.dat',
+                                    dir=op.dirname(op.abspath(out_file)))
+    os.close(fd)
+    try:
+        data = None
+        for idxs, cdata in chunks:
+            if data is None:
+                newshape = rsh + (cdata.shape[-1],)
+                # NIfTI data is stored in Fortran order, so the array is
+                # written out sequentially
+                data = np.memmap(tmp_file, dtype=dtype, mode='w+',
+                                 shape=newshape, order='F')
             try:
-                data[idata, ...] = cdata[0:nels, ...]
+                data[np.unravel_index(idxs, rsh)] = cdata
             except:
                 print(('Consistency between indexes and chunks was '
                        'lost: data=%s, chunk=%s') % (str(data.shape),
                                                      str(cdata.shape)))
                 raise
+        if data is None:
+            raise ValueError('No voxels to merge into %s' % out_file)
 
+        hdr.set_data_dtype(dtype)
+        hdr.set_xyzt_units('mm', 'sec')
         hdr.set_data_shape(newshape)
-        nb.Nifti1Image(data.reshape(newshape).astype(dtype),
-                       aff, hdr).to_filename(out_file)
-
-    else:
-        hdr.set_data_shape(rsh[:3])
-        nii = []
-        for d in range(ndirs):
-            fname = op.abspath('vol%06d.nii' % d)
-            nb.Nifti1Image(np.zeros(rsh[:3]), aff, hdr).to_filename(fname)
-            nii.append(fname)
-
-        for cname, iname in zip(in_files, in_idxs):
-            f = np.load(iname)
-            idxs = np.squeeze(f['arr_0'])
-
-            for d, fname in enumerate(nii):
-                data = nb.load(fname, mmap=NUMPY_MMAP).get_data().reshape(-1)
-                cdata = nb.load(cname, mmap=NUMPY_MMAP).get_data().reshape(-1, ndirs)[:, d]
-                nels = len(idxs)
-                idata = (idxs, )
-                data[idata] = cdata[0:nels]
-                nb.Nifti1Image(data.reshape(rsh[:3]),
-                               aff, hdr).to_filename(fname)
-
-        imgs = [nb.load(im, mmap=NUMPY_MMAP) for im in nii]
-        allim = nb.concat_images(imgs)
-        allim.to_filename(out_file)
+        nb.Nifti1Image(data, aff, hdr).to_filename(out_file)
+        del data
+    finally:
+        os.remove(tmp_file)
 
     return out_file
 
@@ -26,6 +26,7 @@ import os
 
 from nibabel import load
 import numpy as np
+from scipy.signal import fftconvolve
 from scipy.special import gammaln
 
 from ..utils import NUMPY_MMAP
@@ -397,9 +398,8 @@ None])
         if isdefined(self.inputs.realignment_parameters):
             for parfile in self.inputs.realignment_parameters:
                 realignment_parameters.append(
-                    np.apply_along_axis(func1d=normalize_mc_params,
-                                        axis=1, arr=np.loadtxt(parfile),
-                                        source=self.inputs.parameter_source))
+                    normalize_mc_params(np.loadtxt(parfile),
+                                        self.inputs.parameter_source))
         outliers = []
         if isdefined(self.inputs.outlier_files):
             for filename in self.inputs.outlier_files:
@@ -562,9 +562,8 @@ class SpecifySPMModel(SpecifyModel):
         if isdefined(self.inputs.realignment_parameters):
             realignment_parameters = []
             for parfile in self.inputs.realignment_parameters:
-                mc = np.apply_along_axis(func1d=normalize_mc_params,
-                                         axis=1, arr=np.loadtxt(parfile),
-                                         source=self.inputs.parameter_source)
+                mc = normalize_mc_params(np.loadtxt(parfile),
+                                         self.inputs.parameter_source)
                 if not realignment_parameters:
                     realignment_parameters.insert(0, mc)
                 else:
@@ -709,34 +708,45 @@ durations=[[1]])
                                                                 response.max()))
             iflogger.info('reg_scale: %.4f' % reg_scale)
 
-        for i, t in enumerate(onsets):
-            idx = int(np.round(t / dt))
-            if i_amplitudes:
-                if len(i_amplitudes) > 1:
-                    timeline2[idx] = i_amplitudes[i]
-                else:
-                    timeline2[idx] = i_amplitudes[0]
+        # lay down the events of all the onsets at once
+        idx = np.round(onsets / dt).astype(int)
+        if i_amplitudes:
+            if len(i_amplitudes) > 1:
+                amplitudes = np.array(i_amplitudes, dtype=float)
             else:
-                timeline2[idx] = 1
+                amplitudes = i_amplitudes[0] * np.ones(len(idx))
+        else:
+            amplitudes = np.ones(len(idx))
 
-            if bplot:
-                plt.subplot(4, 1, 1)
-                plt.plot(times, timeline2)
+        if bplot:
+            np.add.at(timeline2, idx, amplitudes)
+            plt.subplot(4, 1, 1)
+            plt.plot(times, timeline2)
 
-            if not self.inputs.stimuli_as_impulses:
-                if durations[i] == 0:
-                    durations[i] = TA * nvol
-                stimdur = np.ones((int(durations[i] / dt)))
-                timeline2 = np.convolve(timeline2, stimdur)[0:len(timeline2)]
-            timeline += timeline2
-            timeline2[:] = 0
+        if self.inputs.stimuli_as_impulses:
+            lengths = np.ones(len(idx), dtype=int)
+        else:
+            durations = durations[:len(idx)]
+            durations[durations == 0] = TA * nvol
+            lengths = np.minimum((durations / dt).astype(int), npts - idx)
+            lengths = np.maximum(lengths, 0)
+        # indices of the points of all the boxcars, one boxcar after the
+        # other: np.add.at adds them in this order, so the overlapping
+        # boxcars sum up exactly as when they are added one at a time
+        starts = np.cumsum(lengths) - lengths
+        points = np.arange(lengths.sum()) + np.repeat(idx - starts, lengths)
+        np.add.at(timeline, points, np.repeat(amplitudes, lengths))
 
         if bplot:
             plt.subplot(4, 1, 2)
             plt.plot(times, timeline)
 
         if isdefined(self.inputs.model_hrf) and self.inputs.model_hrf:
-            timeline = np.convolve(timeline, hrf)[0:len(timeline)]
+            if len(hrf) > 500:
+                # for long kernels (short dt) the FFT is much faster
+                timeline = fftconvolve(timeline, hrf)[0:len(timeline)]
+            else:
+                timeline = np.convolve(timeline, hrf)[0:len(timeline)]
             if isdefined(self.inputs.use_temporal_deriv) and \
                     self.inputs.use_temporal_deriv:
                 # create temporal deriv
@@ -748,18 +758,16 @@ durations=[[1]])
             if isdefined(self.inputs.use_temporal_deriv) and \
                     self.inputs.use_temporal_deriv:
                 plt.plot(times, timederiv)
-        # sample timeline
-        timeline2 = np.zeros((npts))
-        reg = []
+        # sample timeline at the acquisition times of all the scans
+        scans = np.arange(nscans)
+        scanstart = ((SCANONSET + scans / nvol * TR + (scans % nvol) * TA) /
+                     dt).astype(int)
+        scanidx = scanstart[:, np.newaxis] + np.arange(int(TA / dt))
+        reg = (timeline[scanidx].mean(axis=1) * reg_scale).tolist()
         regderiv = []
-        for i, trial in enumerate(np.arange(nscans) / nvol):
-            scanstart = int((SCANONSET + trial * TR + (i % nvol) * TA) / dt)
-            scanidx = scanstart + np.arange(int(TA / dt))
-            timeline2[scanidx] = np.max(timeline)
-            reg.insert(i, np.mean(timeline[scanidx]) * reg_scale)
-            if isdefined(self.inputs.use_temporal_deriv) and \
-                    self.inputs.use_temporal_deriv:
-                regderiv.insert(i, np.mean(timederiv[scanidx]) * reg_scale)
+        if isdefined(self.inputs.use_temporal_deriv) and \
+                self.inputs.use_temporal_deriv:
+            regderiv = (timederiv[scanidx].mean(axis=1) * reg_scale).tolist()
 
         if isdefined(self.inputs.use_temporal_deriv) and \
                 self.inputs.use_temporal_deriv:
@@ -767,6 +775,8 @@ durations=[[1]])
             regderiv = orth(reg, regderiv)
 
         if bplot:
+            timeline2 = np.zeros((npts))
+            timeline2[scanidx] = np.max(timeline)
             plt.subplot(4, 1, 3)
             plt.plot(times, timeline2)
             plt.subplot(4, 1, 4)
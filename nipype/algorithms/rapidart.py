@@ -39,6 +39,10 @@ from .. import logging, config
 iflogger = logging.getLogger('interface')
 
 
+# number of array elements processed at once by the chunked computations
+_CHUNK_ELEMENTS = 2 ** 24
+
+
 def _get_affine_matrix(params, source):
     """Return affine matrix given a set of translation and rotation parameters
 
@@ -46,41 +50,65 @@ def _get_affine_matrix(params, source):
     source : the package that generated the parameters
              supports SPM, AFNI, FSFAST, FSL, NIPY
     """
+    return _get_affine_matrices(np.atleast_2d(params), source)[0]
+
+
+def _get_affine_matrices(params, source):
+    """Return the affine matrices of all the rows of a set of translation and
+    rotation parameters, as an array of shape (n_rows, 4, 4)
+
+    params : np.array (n_rows x upto 12) in native package format
+    source : the package that generated the parameters
+             supports SPM, AFNI, FSFAST, FSL, NIPY
+    """
     if source == 'NIPY':
         # nipy does not store typical euler angles, use nipy to convert
         from nipy.algorithms.registration import to_matrix44
-        return to_matrix44(params)
+        return np.array([to_matrix44(row) for row in params])
 
-    params = normalize_mc_params(params, source)
+    params = normalize_mc_params(np.asarray(params, dtype=np.float64), source)
     # process for FSL, SPM, AFNI and FSFAST
-    rotfunc = lambda x: np.array([[np.cos(x), np.sin(x)],
-                                  [-np.sin(x), np.cos(x)]])
     q = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 0])
-    if len(params) < 12:
-        params = np.hstack((params, q[len(params):]))
-    params.shape = (len(params),)
+    if params.shape[1] < 12:
+        params = np.hstack((params, np.tile(q[params.shape[1]:],
+                                            (params.shape[0], 1))))
+    n_rows = params.shape[0]
+    cos = np.cos(params[:, 3:6])
+    sin = np.sin(params[:, 3:6])
+    eye = np.tile(np.eye(4), (n_rows, 1, 1))
     # Translation
-    T = np.eye(4)
-    T[0:3, -1] = params[0:3]
+    T = eye.copy()
+    T[:, 0:3, -1] = params[:, 0:3]
     # Rotation
-    Rx = np.eye(4)
-    Rx[1:3, 1:3] = rotfunc(params[3])
-    Ry = np.eye(4)
-    Ry[(0, 0, 2, 2), (0, 2, 0, 2)] = rotfunc(params[4]).ravel()
-    Rz = np.eye(4)
-    Rz[0:2, 0:2] = rotfunc(params[5])
+    Rx = eye.copy()
+    Rx[:, 1, 1], Rx[:, 1, 2], Rx[:, 2, 1], Rx[:, 2, 2] = \
+        cos[:, 0], sin[:, 0], -sin[:, 0], cos[:, 0]
+    Ry = eye.copy()
+    Ry[:, 0, 0], Ry[:, 0, 2], Ry[:, 2, 0], Ry[:, 2, 2] = \
+        cos[:, 1], sin[:, 1], -sin[:, 1], cos[:, 1]
+    Rz = eye.copy()
+    Rz[:, 0, 0], Rz[:, 0, 1], Rz[:, 1, 0], Rz[:, 1, 1] = \
+        cos[:, 2], sin[:, 2], -sin[:, 2], cos[:, 2]
     # Scaling
-    S = np.eye(4)
-    S[0:3, 0:3] = np.diag(params[6:9])
+    S = eye.copy()
+    S[:, 0, 0], S[:, 1, 1], S[:, 2, 2] = \
+        params[:, 6], params[:, 7], params[:, 8]
     # Shear
-    Sh = np.eye(4)
-    Sh[(0, 0, 1), (1, 2, 2)] = params[9:12]
+    Sh = eye.copy()
+    Sh[:, 0, 1], Sh[:, 0, 2], Sh[:, 1, 2] = \
+        params[:, 9], params[:, 10], params[:, 11]
     if source in ('AFNI', 'FSFAST'):
-        return np.dot(T, np.dot(Ry, np.dot(Rx, np.dot(Rz, np.dot(S, Sh)))))
-    return np.dot(T, np.dot(Rx, np.dot(Ry, np.dot(Rz, np.dot(S, Sh)))))
+        matrices = [T, Ry, Rx, Rz, S, Sh]
+    else:
+        matrices = [T, Rx, Ry, Rz, S, Sh]
+    affines = matrices[-1]
+    for matrix in matrices[-2::-1]:
+        affines = np.einsum('tij,tjk->tik', matrix, affines)
+    return affines
 
 
-def _calc_norm(mc, use_differences, source, brain_pts=None):
+def _calc_norm(mc, use_differences, source, brain_pts=None,
+               displacement=None):
     """Calculates the maximum overall displacement of the midpoints
     of the faces of a cube due to translation and rotation.
 
@@ -90,6 +118,9 @@ def _calc_norm(mc, use_differences, source, brain_pts=None):
         [3 translation, 3 rotation (radians)]
     use_differences : boolean
     brain_pts : [4 x n_points] of coordinates
+    displacement : [timepoints x n_points] array (e.g. a memory map) in
+        which the displacements are stored, when brain_pts is given.
+        By default, a float32 array is created.
 
     Returns
     -------
@@ -106,36 +137,50 @@ def _calc_norm(mc, use_differences, source, brain_pts=None):
         displacement = None
     else:
         all_pts = brain_pts
-    n_pts = all_pts.size - all_pts.shape[1]
-    newpos = np.zeros((mc.shape[0], n_pts))
-    if brain_pts is not None:
-        displacement = np.zeros((mc.shape[0], int(n_pts / 3)))
-    for i in range(mc.shape[0]):
-        affine = _get_affine_matrix(mc[i, :], source)
-        newpos[i, :] = np.dot(affine,
-                              all_pts)[0:3, :].ravel()
-        if brain_pts is not None:
-            displacement[i, :] = \
-                np.sqrt(np.sum(np.power(np.reshape(newpos[i, :],
-                                                   (3, all_pts.shape[1])) -
-                                        all_pts[0:3, :],
-                                        2),
-                               axis=0))
-    # np.savez('displacement.npz', newpos=newpos, pts=all_pts)
-    normdata = np.zeros(mc.shape[0])
+        if displacement is None:
+            displacement = np.zeros((mc.shape[0], all_pts.shape[1]),
+                                    dtype=np.float32)
+
+    affines = _get_affine_matrices(mc, source)
+    # the positions are linear in the affines, so the differences (or the
+    # deviations from the mean) of the positions are those of the affines
+    # applied to the points
     if use_differences:
-        newpos = np.concatenate((np.zeros((1, n_pts)),
-                                 np.diff(newpos, n=1, axis=0)), axis=0)
-        for i in range(newpos.shape[0]):
-            normdata[i] = \
-                np.max(np.sqrt(np.sum(np.reshape(np.power(np.abs(newpos[i, :]), 2),
-                                                 (3, all_pts.shape[1])), axis=0)))
+        deltas = np.concatenate((np.zeros((1, 4, 4)),
+                                 np.diff(affines, n=1, axis=0)), axis=0)
     else:
-        newpos = np.abs(signal.detrend(newpos, axis=0, type='constant'))
-        normdata = np.sqrt(np.mean(np.power(newpos, 2), axis=1))
+        deltas = affines - affines.mean(axis=0)
+
+    normdata = np.zeros(mc.shape[0])
+    step = max(1, _CHUNK_ELEMENTS // all_pts.size)
+    for start in range(0, mc.shape[0], step):
+        sl = slice(start, start + step)
+        newpos = np.einsum('tij,jn->tin', deltas[sl, 0:3], all_pts)
+        if use_differences:
+            normdata[sl] = np.max(np.sqrt(np.sum(newpos ** 2, axis=1)),
+                                  axis=1)
+        else:
+            normdata[sl] = np.sqrt(np.mean(newpos ** 2, axis=(1, 2)))
+        if brain_pts is not None:
+            moved = np.einsum('tij,jn->tin',
+                              affines[sl, 0:3] - np.eye(4)[0:3], all_pts)
+            displacement[sl] = np.sqrt(np.sum(moved ** 2, axis=1))
     return normdata, displacement
 
 
+def _masked_means(vols, mask=None):
+    """Return the mean of each volume of a 4D block, excluding the voxels
+    that are nan or outside of a 3D (or 4D) mask
+    """
+    valid = ~np.isnan(vols)
+    if mask is not None:
+        if mask.ndim == 3:
+            mask = mask[..., np.newaxis]
+        valid &= mask
+    return (np.where(valid, vols, 0).sum(axis=(0, 1, 2)) /
+            valid.sum(axis=(0, 1, 2)))
+
+
 def _nanmean(a, axis=None):
     """Return the mean excluding items that are nan
 
@@ -212,6 +257,11 @@ class ArtifactDetectInputSpec(BaseInterfaceInputSpec):
     global_threshold = traits.Float(8.0, desc=("use this threshold when mask "
                                                "type equal's spm_global"),
                                     usedefault=True)
+    save_memory = traits.Bool(False, usedefault=True,
+                              desc=("keep the voxel displacement timeseries "
+                                    "computed with bound_by_brainmask in "
+                                    "memory-mapped temporary files instead of "
+                                    "in memory"))
 
 
 class ArtifactDetectOutputSpec(TraitedSpec):
@@ -247,6 +297,11 @@ class ArtifactDetect(BaseInterface):
     True, it computes the movement of the center of each face a cuboid centered
     around the head and returns the maximal movement across the centers.
 
+    The global intensity is computed over blocks of volumes at once, and the
+    affines of all the timepoints are built together. With
+    `bound_by_brainmask`, the voxel displacement timeseries is saved as
+    float32; set `save_memory` to keep it in memory-mapped files while it is
+    computed.
 
     Examples
     --------
@@ -365,6 +420,9 @@ class ArtifactDetect(BaseInterface):
 
         data = nim.get_data()
         affine = nim.affine
+        # blocks of volumes processed at once
+        step = max(1, _CHUNK_ELEMENTS // (x * y * z))
+        blocks = [slice(t0, t0 + step) for t0 in range(0, timepoints, step)]
         g = np.zeros((timepoints, 1))
         masktype = self.inputs.mask_type
         if masktype == 'spm_global':  # spm_global like calculation
@@ -372,40 +430,40 @@ class ArtifactDetect(BaseInterface):
             intersect_mask = self.inputs.intersect_mask
             if intersect_mask:
                 mask = np.ones((x, y, z), dtype=bool)
-                for t0 in range(timepoints):
-                    vol = data[:, :, :, t0]
+                for block in blocks:
+                    vols = np.asarray(data[:, :, :, block])
                     # Use an SPM like approach
-                    mask_tmp = vol > \
-                        (_nanmean(vol) / self.inputs.global_threshold)
-                    mask = mask * mask_tmp
-                for t0 in range(timepoints):
-                    vol = data[:, :, :, t0]
-                    g[t0] = _nanmean(vol[mask])
+                    mask &= np.all(vols > (_masked_means(vols) /
+                                           self.inputs.global_threshold),
+                                   axis=3)
+                for block in blocks:
+                    g[block, 0] = _masked_means(
+                        np.asarray(data[:, :, :, block]), mask)
                 if len(find_indices(mask)) < (np.prod((x, y, z)) / 10):
                     intersect_mask = False
                     g = np.zeros((timepoints, 1))
             if not intersect_mask:
                 iflogger.info('not intersect_mask is True')
-                mask = np.zeros((x, y, z, timepoints))
-                for t0 in range(timepoints):
-                    vol = data[:, :, :, t0]
-                    mask_tmp = vol > \
-                        (_nanmean(vol) / self.inputs.global_threshold)
-                    mask[:, :, :, t0] = mask_tmp
-                    g[t0] = np.nansum(vol * mask_tmp) / np.nansum(mask_tmp)
+                mask = np.zeros((x, y, z, timepoints), dtype=bool)
+                for block in blocks:
+                    vols = np.asarray(data[:, :, :, block])
+                    mask[:, :, :, block] = vols > (
+                        _masked_means(vols) / self.inputs.global_threshold)
+                    g[block, 0] = _masked_means(vols, mask[:, :, :, block])
         elif masktype == 'file':  # uses a mask image to determine intensity
             maskimg = load(self.inputs.mask_file, mmap=NUMPY_MMAP)
             mask = maskimg.get_data()
             affine = maskimg.affine
             mask = mask > 0.5
-            for t0 in range(timepoints):
-                vol = data[:, :, :, t0]
-                g[t0] = _nanmean(vol[mask])
+            for block in blocks:
+                g[block, 0] = _masked_means(np.asarray(data[:, :, :, block]),
+                                            mask)
         elif masktype == 'thresh':  # uses a fixed signal threshold
-            for t0 in range(timepoints):
-                vol = data[:, :, :, t0]
-                mask = vol > self.inputs.mask_threshold
-                g[t0] = _nanmean(vol[mask])
+            for block in blocks:
+                vols = np.asarray(data[:, :, :, block])
+                masks = vols > self.inputs.mask_threshold
+                g[block, 0] = _masked_means(vols, masks)
+            mask = masks[:, :, :, -1]
         else:
             mask = np.ones((x, y, z))
             g = _nanmean(data[mask > 0, :], 1)
@@ -438,20 +496,37 @@ class ArtifactDetect(BaseInterface):
                                    np.hstack((coords,
                                               np.ones((coords.shape[0], 1)))).T)
             # calculate the norm of the motion parameters
+            displacement = None
+            if brain_pts is not None and self.inputs.save_memory:
+                disp_mmap = os.path.join(cwd, 'disp.%d.dat' % runidx)
+                displacement = np.memmap(disp_mmap, dtype=np.float32,
+                                         mode='w+',
+                                         shape=(timepoints,
+                                                brain_pts.shape[1]))
             normval, displacement = _calc_norm(mc,
                                                self.inputs.use_differences[0],
                                                self.inputs.parameter_source,
-                                               brain_pts=brain_pts)
+                                               brain_pts=brain_pts,
+                                               displacement=displacement)
             tidx = find_indices(normval > self.inputs.norm_threshold)
             ridx = find_indices(normval < 0)
             if displacement is not None:
-                dmap = np.zeros((x, y, z, timepoints), dtype=np.float)
-                for i in range(timepoints):
+                if self.inputs.save_memory:
+                    dmap_mmap = os.path.join(cwd, 'dmap.%d.dat' % runidx)
+                    dmap = np.memmap(dmap_mmap, dtype=np.float32, mode='w+',
+                                     shape=(x, y, z, timepoints))
+                else:
+                    dmap = np.zeros((x, y, z, timepoints), dtype=np.float32)
+                for block in blocks:
                     dmap[voxel_coords[0],
                          voxel_coords[1],
-                         voxel_coords[2], i] = displacement[i, :]
+                         voxel_coords[2], block] = displacement[block].T
                 dimg = Nifti1Image(dmap, affine)
                 dimg.to_filename(displacementfile)
+                if self.inputs.save_memory:
+                    del dimg, dmap, displacement
+                    os.remove(dmap_mmap)
+                    os.remove(disp_mmap)
         else:
             if self.inputs.use_differences[0]:
                 mc = np.concatenate((np.zeros((1, 6)),
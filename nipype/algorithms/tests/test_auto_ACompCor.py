@@ -4,7 +4,9 @@ from ..confounds import ACompCor
 
 
 def test_ACompCor_inputs():
-    input_map = dict(components_file=dict(usedefault=True,
+    input_map = dict(chunk_size=dict(usedefault=True,
+    ),
+    components_file=dict(usedefault=True,
     ),
     header_prefix=dict(),
     ignore_exception=dict(nohash=True,
@@ -23,6 +25,8 @@ def test_ACompCor_inputs():
     ),
     regress_poly_degree=dict(usedefault=True,
     ),
+    svd_method=dict(usedefault=True,
+    ),
     use_regress_poly=dict(usedefault=True,
     ),
     )
@@ -6,6 +6,8 @@ from ..misc import AddCSVRow
 def test_AddCSVRow_inputs():
     input_map = dict(_outputs=dict(usedefault=True,
     ),
+    append_mode=dict(usedefault=True,
+    ),
     ignore_exception=dict(nohash=True,
     usedefault=True,
     ),
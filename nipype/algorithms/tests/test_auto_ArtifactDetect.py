@@ -30,6 +30,8 @@ def test_ArtifactDetect_inputs():
     rotation_threshold=dict(mandatory=True,
     xor=['norm_threshold'],
     ),
+    save_memory=dict(usedefault=True,
+    ),
     save_plot=dict(usedefault=True,
     ),
     translation_threshold=dict(mandatory=True,
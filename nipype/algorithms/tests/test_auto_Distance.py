@@ -10,6 +10,10 @@ def test_Distance_inputs():
     mask_volume=dict(),
     method=dict(usedefault=True,
     ),
+    per_label=dict(usedefault=True,
+    ),
+    percentile=dict(usedefault=True,
+    ),
     volume1=dict(mandatory=True,
     ),
     volume2=dict(mandatory=True,
@@ -25,6 +29,8 @@ def test_Distance_inputs():
 def test_Distance_outputs():
     output_map = dict(distance=dict(),
     histogram=dict(),
+    label_distances=dict(),
+    labels=dict(),
     point1=dict(),
     point2=dict(),
     )
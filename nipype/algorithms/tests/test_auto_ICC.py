@@ -4,7 +4,9 @@ from ..icc import ICC
 
 
 def test_ICC_inputs():
-    input_map = dict(ignore_exception=dict(nohash=True,
+    input_map = dict(chunk_size=dict(usedefault=True,
+    ),
+    ignore_exception=dict(nohash=True,
     usedefault=True,
     ),
     mask=dict(mandatory=True,
@@ -22,6 +24,7 @@ def test_ICC_inputs():
 def test_ICC_outputs():
     output_map = dict(icc_map=dict(),
     session_var_map=dict(),
+    sessions_F_map=dict(),
     subject_var_map=dict(),
     )
     outputs = ICC.output_spec()
@@ -0,0 +1,33 @@
+# AUTO-GENERATED by tools/checkspecs.py - DO NOT EDIT
+from __future__ import unicode_literals
+from ..misc import MapVoxelBlock
+
+
+def test_MapVoxelBlock_inputs():
+    input_map = dict(data_file=dict(mandatory=True,
+    ),
+    function=dict(mandatory=True,
+    ),
+    ignore_exception=dict(nohash=True,
+    usedefault=True,
+    ),
+    start=dict(mandatory=True,
+    ),
+    stop=dict(mandatory=True,
+    ),
+    )
+    inputs = MapVoxelBlock.input_spec()
+
+    for key, metadata in list(input_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(inputs.traits()[key], metakey) == value
+
+
+def test_MapVoxelBlock_outputs():
+    output_map = dict(out_file=dict(),
+    )
+    outputs = MapVoxelBlock.output_spec()
+
+    for key, metadata in list(output_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(outputs.traits()[key], metakey) == value
@@ -0,0 +1,36 @@
+# AUTO-GENERATED by tools/checkspecs.py - DO NOT EDIT
+from __future__ import unicode_literals
+from ..misc import MapVoxels
+
+
+def test_MapVoxels_inputs():
+    input_map = dict(block_size=dict(usedefault=True,
+    ),
+    function=dict(mandatory=True,
+    ),
+    ignore_exception=dict(nohash=True,
+    usedefault=True,
+    ),
+    in_file=dict(mandatory=True,
+    ),
+    in_mask=dict(),
+    n_procs=dict(usedefault=True,
+    ),
+    out_file=dict(usedefault=True,
+    ),
+    )
+    inputs = MapVoxels.input_spec()
+
+    for key, metadata in list(input_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(inputs.traits()[key], metakey) == value
+
+
+def test_MapVoxels_outputs():
+    output_map = dict(out_file=dict(),
+    )
+    outputs = MapVoxels.output_spec()
+
+    for key, metadata in list(output_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(outputs.traits()[key], metakey) == value
@@ -0,0 +1,31 @@
+# AUTO-GENERATED by tools/checkspecs.py - DO NOT EDIT
+from __future__ import unicode_literals
+from ..misc import MergeVoxels
+
+
+def test_MergeVoxels_inputs():
+    input_map = dict(ignore_exception=dict(nohash=True,
+    usedefault=True,
+    ),
+    in_files=dict(mandatory=True,
+    ),
+    in_index=dict(mandatory=True,
+    ),
+    in_reference=dict(mandatory=True,
+    ),
+    )
+    inputs = MergeVoxels.input_spec()
+
+    for key, metadata in list(input_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(inputs.traits()[key], metakey) == value
+
+
+def test_MergeVoxels_outputs():
+    output_map = dict(merged_file=dict(),
+    )
+    outputs = MergeVoxels.output_spec()
+
+    for key, metadata in list(output_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(outputs.traits()[key], metakey) == value
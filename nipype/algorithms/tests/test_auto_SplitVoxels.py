@@ -0,0 +1,33 @@
+# AUTO-GENERATED by tools/checkspecs.py - DO NOT EDIT
+from __future__ import unicode_literals
+from ..misc import SplitVoxels
+
+
+def test_SplitVoxels_inputs():
+    input_map = dict(block_size=dict(usedefault=True,
+    ),
+    ignore_exception=dict(nohash=True,
+    usedefault=True,
+    ),
+    in_file=dict(mandatory=True,
+    ),
+    in_mask=dict(),
+    )
+    inputs = SplitVoxels.input_spec()
+
+    for key, metadata in list(input_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(inputs.traits()[key], metakey) == value
+
+
+def test_SplitVoxels_outputs():
+    output_map = dict(data_file=dict(),
+    index_file=dict(),
+    starts=dict(),
+    stops=dict(),
+    )
+    outputs = SplitVoxels.output_spec()
+
+    for key, metadata in list(output_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(outputs.traits()[key], metakey) == value
@@ -4,7 +4,9 @@ from ..confounds import TCompCor
 
 
 def test_TCompCor_inputs():
-    input_map = dict(components_file=dict(usedefault=True,
+    input_map = dict(chunk_size=dict(usedefault=True,
+    ),
+    components_file=dict(usedefault=True,
     ),
     header_prefix=dict(),
     ignore_exception=dict(nohash=True,
@@ -25,6 +27,8 @@ def test_TCompCor_inputs():
     ),
     regress_poly_degree=dict(usedefault=True,
     ),
+    svd_method=dict(usedefault=True,
+    ),
     use_regress_poly=dict(usedefault=True,
     ),
     )
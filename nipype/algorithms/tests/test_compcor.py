@@ -7,7 +7,8 @@ import numpy as np
 
 import pytest
 from ...testing import utils
-from ..confounds import CompCor, TCompCor, ACompCor
+from ..confounds import (CompCor, TCompCor, ACompCor,
+                         compute_noise_components)
 
 
 class TestCompCor():
@@ -136,6 +137,25 @@ class TestCompCor():
         with pytest.raises(ValueError, message='more than one mask file'):
             interface.run()
 
+    def test_compcor_svd_methods(self):
+        rng = np.random.RandomState(0)
+        imgseries = rng.normal(size=(6, 5, 4, 20))
+        time = np.arange(20)
+        imgseries[:2] += 4 * np.sin(time)
+        imgseries[2:4] += 2 * np.cos(time / 3.)
+        imgseries[4:] += np.sin(time / 5.)
+        mask = nb.Nifti1Image((rng.rand(6, 5, 4) > 0.2).astype(np.uint8),
+                              np.eye(4))
+        expected = compute_noise_components(imgseries, [mask], 1, 3)
+        for method in ['gram', 'randomized']:
+            components = compute_noise_components(imgseries, [mask], 1, 3,
+                                                  svd_method=method,
+                                                  chunk_size=17)
+            assert components.shape == expected.shape
+            # components are defined up to their sign
+            assert np.allclose(np.abs((components * expected).sum(axis=0)),
+                               1, atol=1e-4)
+
     def run_cc(self, ccinterface, expected_components, expected_header='CompCor'):
         # run
         ccresult = ccinterface.run()
@@ -4,21 +4,12 @@ import os
 
 from io import open
 
-import pytest
 from nipype.testing import example_data
 from nipype.algorithms.confounds import FramewiseDisplacement, ComputeDVARS, \
-    is_outlier
+    FramewiseDisplacementBatch, is_outlier
 import numpy as np
 
 
-nonitime = True
-try:
-    import nitime
-    nonitime = False
-except ImportError:
-    pass
-
-
 def test_fd(tmpdir):
     tempdir = str(tmpdir)
     ground_truth = np.loadtxt(example_data('fsl_motion_outliers_fd.txt'))
@@ -36,7 +27,26 @@ def test_fd(tmpdir):
     assert np.abs(ground_truth.mean() - res.outputs.fd_average) < 1e-2
 
 
-@pytest.mark.skipif(nonitime, reason="nitime is not installed")
+def test_fd_batch(tmpdir):
+    tmpdir.chdir()
+    in_file = example_data('fsl_mcflirt_movpar.txt')
+    np.savetxt('short.txt', np.loadtxt(in_file)[:10])
+    single = FramewiseDisplacement(in_file=in_file,
+                                   parameter_source="FSL").run()
+    fd = np.loadtxt(single.outputs.out_file, skiprows=1)
+
+    res = FramewiseDisplacementBatch(in_files=[in_file, 'short.txt'],
+                                     parameter_source="FSL").run()
+    table = np.loadtxt(res.outputs.out_file, skiprows=1)
+    assert table.shape == (len(fd) + 9, 3)
+    assert np.all(table[:len(fd), 0] == 0)
+    assert np.all(table[len(fd):, 0] == 1)
+    assert np.all(table[len(fd):, 1] == np.arange(1, 10))
+    assert np.allclose(table[:len(fd), 2], fd)
+    assert np.allclose(table[len(fd):, 2], fd[:9])
+    assert np.isclose(res.outputs.fd_average[0], single.outputs.fd_average)
+
+
 def test_dvars(tmpdir):
     ground_truth = np.loadtxt(example_data('ds003_sub-01_mc.DVARS'))
     dvars = ComputeDVARS(in_file=example_data('ds003_sub-01_mc.nii.gz'),
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy.spatial.distance import cdist
+
+from nipype.algorithms.metrics import Distance
+
+
+def _border_coordinates(data, affine):
+    dist = Distance()
+    return dist._get_coordinates(dist._find_border(data), affine)
+
+
+@pytest.fixture()
+def volumes(tmpdir):
+    tmpdir.chdir()
+    affine = np.diag([2., 1., 1.5, 1.])
+    data1 = np.zeros((12, 10, 8))
+    data1[2:6, 2:7, 1:5] = 1
+    data1[7:10, 3:6, 4:7] = 2
+    data2 = np.zeros((12, 10, 8))
+    data2[3:7, 1:6, 2:6] = 1
+    data2[8:11, 4:8, 3:7] = 2
+    nb.Nifti1Image(data1, affine).to_filename('vol1.nii')
+    nb.Nifti1Image(data2, affine).to_filename('vol2.nii')
+    return data1, data2, affine
+
+
+def test_distance_eucl(volumes):
+    data1, data2, affine = volumes
+    set1 = _border_coordinates(data1.astype(bool), affine)
+    set2 = _border_coordinates(data2.astype(bool), affine)
+    distances = cdist(set1.T, set2.T)
+    mins = np.concatenate((distances.min(axis=0), distances.min(axis=1)))
+
+    res = Distance(volume1='vol1.nii', volume2='vol2.nii',
+                   method='eucl_min').run()
+    assert np.isclose(res.outputs.distance, distances.min())
+
+    res = Distance(volume1='vol1.nii', volume2='vol2.nii',
+                   method='eucl_max').run()
+    assert np.isclose(res.outputs.distance, mins.max())
+
+    res = Distance(volume1='vol1.nii', volume2='vol2.nii',
+                   method='eucl_max', percentile=95).run()
+    assert np.isclose(res.outputs.distance, np.percentile(mins, 95))
+
+
+def test_distance_per_label(volumes):
+    data1, data2, affine = volumes
+    res = Distance(volume1='vol1.nii', volume2='vol2.nii',
+                   method='eucl_max', per_label=True).run()
+    assert res.outputs.labels == [1, 2]
+    for l, distance in zip(res.outputs.labels, res.outputs.label_distances):
+        set1 = _border_coordinates(data1 == l, affine)
+        set2 = _border_coordinates(data2 == l, affine)
+        distances = cdist(set1.T, set2.T)
+        expected = max(distances.min(axis=0).max(),
+                       distances.min(axis=1).max())
+        assert np.isclose(distance, expected)
+    assert np.isclose(res.outputs.distance,
+                      np.mean(res.outputs.label_distances))
+
+    with pytest.raises(ValueError):
+        Distance(volume1='vol1.nii', volume2='vol2.nii',
+                 method='eucl_cog', per_label=True).run()
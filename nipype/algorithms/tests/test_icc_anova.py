@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 import numpy as np
-from nipype.algorithms.icc import ICC_rep_anova
+import nibabel as nb
+from nipype.algorithms.icc import ICC, ICC_rep_anova, ICC_rep_anova_batch
 
 
 def test_ICC_rep_anova():
@@ -20,3 +21,46 @@ def test_ICC_rep_anova():
     assert dfc == 3
     assert dfe == 15
     assert np.isclose(r_var / (r_var + e_var), icc)
+
+
+def test_ICC_rep_anova_batch():
+    rng = np.random.RandomState(0)
+    Y = rng.randn(20, 6, 3)
+
+    batch = ICC_rep_anova_batch(Y)
+    for i in range(Y.shape[0]):
+        single = ICC_rep_anova(Y[i])
+        for b, s in zip(batch[:4], single[:4]):
+            assert np.isclose(b[i], s)
+    assert batch[4:] == single[4:]
+
+
+def test_ICC(tmpdir):
+    tmpdir.chdir()
+    rng = np.random.RandomState(0)
+    affine = np.eye(4)
+    mask = np.zeros((4, 4, 3))
+    mask[1:3, :, 1:] = 1
+    nb.Nifti1Image(mask, affine).to_filename('mask.nii')
+
+    subjects_sessions = []
+    data = rng.randn(5, 2, 4, 4, 3)
+    for i in range(5):
+        sessions = []
+        for j in range(2):
+            fname = 'sub%d_ses%d.nii' % (i, j)
+            nb.Nifti1Image(data[i, j], affine).to_filename(fname)
+            sessions.append(fname)
+        subjects_sessions.append(sessions)
+
+    icc = ICC(subjects_sessions=subjects_sessions, mask='mask.nii',
+              chunk_size=7)
+    res = icc.run()
+
+    icc_map = nb.load(res.outputs.icc_map).get_data()
+    f_map = nb.load(res.outputs.sessions_F_map).get_data()
+    for x, y, z in zip(*np.nonzero(mask)):
+        expected = ICC_rep_anova(data[:, :, x, y, z])
+        assert np.isclose(icc_map[x, y, z], expected[0])
+        assert np.isclose(f_map[x, y, z], expected[3])
+    assert icc_map[0, 0, 0] == 0
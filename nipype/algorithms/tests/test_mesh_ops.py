@@ -61,6 +61,19 @@ def test_trans_distances(tmpdir):
     assert np.allclose(res.outputs.distance, np.linalg.norm(inc), 4)
 
 
+def test_vertex_areas():
+    rng = np.random.RandomState(0)
+    points = rng.rand(20, 3)
+    faces = np.array([rng.choice(20, 3, replace=False) for _ in range(40)])
+
+    expected = np.zeros(len(points))
+    for face in faces:
+        A, B, C = points[face]
+        area = 0.5 * np.linalg.norm(np.cross(B - A, C - A))
+        expected[face] += area
+    assert np.allclose(m.vertex_areas(points, faces), expected)
+
+
 @pytest.mark.skipif(VTKInfo.no_tvtk(), reason="tvtk is not installed")
 def test_warppoints(tmpdir):
     os.chdir(str(tmpdir))
@@ -32,3 +32,75 @@ def test_CreateNifti(create_analyze_pair_file_in_directory):
 
     assert os.path.exists(result.outputs.nifti_file)
     assert nb.load(result.outputs.nifti_file)
+
+
+def test_AddCSVRow_append_mode(tmpdir):
+    pytest.importorskip('pandas')
+    in_file = tmpdir.join('scores.csv').strpath
+
+    for i, extra in enumerate([{}, {'extra': 'x'}, {}]):
+        addrow = misc.AddCSVRow()
+        addrow.inputs.in_file = in_file
+        addrow.inputs.append_mode = True
+        addrow.inputs.subject_id = 'S%d' % i
+        addrow.inputs.si = 0.5 + i
+        for key, val in extra.items():
+            setattr(addrow.inputs, key, val)
+        addrow.run()
+
+    assert not os.path.exists(in_file)
+    df = misc.merge_csv_shards(in_file)
+    assert list(df['subject_id']) == ['S0', 'S1', 'S2']
+    assert list(df['si']) == [0.5, 1.5, 2.5]
+    assert df['extra'].isnull().tolist() == [True, False, True]
+
+    # compaction folds the shards into in_file, later rows keep appending
+    misc.merge_csv_shards(in_file, compact=True)
+    assert os.listdir(in_file + '.rows') == []
+    addrow.inputs.subject_id = 'S3'
+    addrow.run()
+    df = misc.merge_csv_shards(in_file)
+    assert list(df['subject_id']) == ['S0', 'S1', 'S2', 'S3']
+
+
+def test_AddCSVRow_append_mode_output(tmpdir):
+    pd = pytest.importorskip('pandas')
+    in_file = tmpdir.join('scores.csv').strpath
+
+    addrow = misc.AddCSVRow()
+    addrow.inputs.in_file = in_file
+    addrow.inputs.append_mode = True
+    addrow.inputs.subject_id = 'S0'
+    res = addrow.run()
+    # the output holds the row just written
+    csv_file = res.outputs.csv_file
+    assert os.path.dirname(csv_file) == in_file + '.rows'
+    assert list(pd.read_csv(csv_file, index_col=0)['subject_id']) == ['S0']
+
+
+def test_merge_csv_shards_concurrent(tmpdir):
+    pytest.importorskip('pandas')
+    from multiprocessing import Pool
+    in_file = tmpdir.join('scores.csv').strpath
+
+    addrow = misc.AddCSVRow()
+    addrow.inputs.in_file = in_file
+    addrow.inputs.append_mode = True
+    for i in range(40):
+        addrow.inputs.subject_id = 'S%d' % i
+        addrow.run()
+
+    # overlapping compactions and reads see every row exactly once
+    pool = Pool(4)
+    try:
+        results = [pool.apply_async(misc.merge_csv_shards, (in_file, i % 2 == 0))
+                   for i in range(12)]
+        dfs = [r.get(timeout=60) for r in results]
+    finally:
+        pool.terminate()
+        pool.join()
+    expected = ['S%d' % i for i in range(40)]
+    for df in dfs:
+        assert list(df['subject_id']) == expected
+    assert list(misc.merge_csv_shards(in_file)['subject_id']) == expected
+    assert not os.path.exists(in_file + '.rows.lock')
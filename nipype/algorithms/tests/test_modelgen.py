@@ -157,3 +157,74 @@ def test_modelgen_sparse(tmpdir):
     npt.assert_almost_equal(res.outputs.session_info[0]['regress'][0]['val'][0], 0.016675298129743384)
     npt.assert_almost_equal(res.outputs.session_info[1]['regress'][1]['val'][5], 0.007671459162258378)
 
+
+def _loop_regressor(onsets, durations, amplitudes, nscans, dt, TR, TA,
+                    hrf=None, impulses=True):
+    """Regressor built event by event, with times in ms"""
+    npts = int(np.ceil((TR * (nscans - 1) + TA) / dt))
+    timeline = np.zeros(npts)
+    for onset, duration, amplitude in zip(onsets, durations, amplitudes):
+        event = np.zeros(npts)
+        event[int(np.round(onset / dt))] = amplitude
+        if not impulses:
+            event = np.convolve(event, np.ones(int(duration / dt)))[:npts]
+        timeline += event
+    if hrf is not None:
+        timeline = np.convolve(timeline, hrf)[:npts]
+    reg = []
+    for scan in range(nscans):
+        scanidx = int(scan * TR / dt) + np.arange(int(TA / dt))
+        reg.append(np.mean(timeline[scanidx]))
+    return np.array(reg)
+
+
+@pytest.mark.parametrize('impulses', [True, False])
+@pytest.mark.parametrize('model_hrf', [False, True])
+@pytest.mark.parametrize('amplitudes', [None, [2.5], 'random'])
+def test_sparse_regressor_parity(impulses, model_hrf, amplitudes):
+    from nipype.algorithms.modelgen import spm_hrf
+    rng = np.random.RandomState(0)
+    onsets = np.sort(rng.rand(100) * 280)
+    durations = rng.rand(100) * 5 + 0.5
+    if amplitudes == 'random':
+        amplitudes = rng.rand(100).tolist()
+    s = SpecifySparseModel(time_repetition=6, time_acquisition=2,
+                           stimuli_as_impulses=impulses,
+                           scale_regressors=False)
+    if model_hrf:
+        s.inputs.model_hrf = True
+    reg = s._gen_regress(onsets.tolist(), durations.tolist(), amplitudes, 50)
+
+    if not amplitudes:
+        amplitudes = [1]
+    if len(amplitudes) == 1:
+        amplitudes = amplitudes * len(onsets)
+    dt = 200.  # TA / 10, in ms
+    expected = _loop_regressor(
+        np.round(onsets * 1000), np.round(durations * 1000), amplitudes,
+        50, dt, 6000., 2000.,
+        hrf=spm_hrf(dt * 1e-3) if model_hrf else None, impulses=impulses)
+    # events are laid down in the same order, so the sums are the same
+    assert np.array_equal(reg, expected)
+
+
+@pytest.mark.parametrize('impulses', [True, False])
+def test_sparse_regressor_fftconvolve(impulses):
+    from nipype.algorithms.modelgen import spm_hrf
+    rng = np.random.RandomState(0)
+    onsets = np.sort(rng.rand(100) * 280)
+    durations = rng.rand(100) * 5 + 0.5
+    amplitudes = rng.rand(100).tolist()
+    # a short acquisition time gives dt = 50 ms and a long HRF kernel
+    s = SpecifySparseModel(time_repetition=6, time_acquisition=0.5,
+                           stimuli_as_impulses=impulses, model_hrf=True,
+                           scale_regressors=False)
+    reg = s._gen_regress(onsets.tolist(), durations.tolist(), amplitudes, 50)
+
+    dt = 50.
+    hrf = spm_hrf(dt * 1e-3)
+    assert len(hrf) > 500
+    expected = _loop_regressor(
+        np.round(onsets * 1000), np.round(durations * 1000), amplitudes,
+        50, dt, 6000., 500., hrf=hrf, impulses=impulses)
+    npt.assert_allclose(reg, expected, rtol=1e-10, atol=1e-12)
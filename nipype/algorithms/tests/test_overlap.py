@@ -42,3 +42,21 @@ def test_overlap(tmpdir):
     check_close(res.outputs.roi_voldiff,
                 np.array([0.0063086, -0.0025506, 0.0]))
 
+
+def test_label_overlaps():
+    from nipype.algorithms.metrics import label_overlaps
+
+    rng = np.random.RandomState(0)
+    reference = rng.randint(0, 6, size=(8, 7, 5))
+    tests = [rng.randint(0, 8, size=(8, 7, 5)) for _ in range(3)]
+    labels = [0, 2, 3, 5, 9]
+
+    intersections, ref_volumes, tst_volumes = label_overlaps(
+        reference, tests, labels)
+    assert intersections.shape == (3, 5)
+    for j, l in enumerate(labels):
+        assert ref_volumes[j] == np.sum(reference == l)
+        for i, tst in enumerate(tests):
+            assert intersections[i, j] == np.sum((reference == l) &
+                                                 (tst == l))
+            assert tst_volumes[i, j] == np.sum(tst == l)
@@ -67,6 +67,64 @@ def test_ad_get_norm():
     npt.assert_almost_equal(norm, np.array([0., 143.72192614, 173.92527131]))
 
 
+def test_ad_get_affine_matrices():
+    rng = np.random.RandomState(0)
+    for source, ncols in [('SPM', 12), ('FSL', 6), ('AFNI', 7)]:
+        params = rng.rand(5, ncols)
+        matrices = ra._get_affine_matrices(params, source)
+        assert matrices.shape == (5, 4, 4)
+        for row, matrix in zip(params, matrices):
+            npt.assert_almost_equal(matrix,
+                                    _loop_affine_matrix(row, source))
+
+
+def _loop_affine_matrix(params, source):
+    params = ra.normalize_mc_params(params, source)
+    rotfunc = lambda x: np.array([[np.cos(x), np.sin(x)],
+                                  [-np.sin(x), np.cos(x)]])
+    q = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 0])
+    params = np.hstack((params, q[len(params):]))
+    T = np.eye(4)
+    T[0:3, -1] = params[0:3]
+    Rx = np.eye(4)
+    Rx[1:3, 1:3] = rotfunc(params[3])
+    Ry = np.eye(4)
+    Ry[(0, 0, 2, 2), (0, 2, 0, 2)] = rotfunc(params[4]).ravel()
+    Rz = np.eye(4)
+    Rz[0:2, 0:2] = rotfunc(params[5])
+    S = np.eye(4)
+    S[0:3, 0:3] = np.diag(params[6:9])
+    Sh = np.eye(4)
+    Sh[(0, 0, 1), (1, 2, 2)] = params[9:12]
+    if source in ('AFNI', 'FSFAST'):
+        return T.dot(Ry).dot(Rx).dot(Rz).dot(S).dot(Sh)
+    return T.dot(Rx).dot(Ry).dot(Rz).dot(S).dot(Sh)
+
+
+def test_ad_get_norm_brain_pts():
+    rng = np.random.RandomState(0)
+    params = rng.rand(4, 6)
+    brain_pts = np.vstack((rng.rand(3, 10) * 50, np.ones((1, 10))))
+    for use_differences in [True, False]:
+        norm, displacement = ra._calc_norm(params, use_differences, 'SPM',
+                                           brain_pts=brain_pts)
+        newpos = np.array([ra._get_affine_matrix(row, 'SPM').dot(brain_pts)
+                           for row in params])[:, 0:3]
+        assert displacement.dtype == np.float32
+        npt.assert_almost_equal(
+            displacement,
+            np.sqrt(np.sum((newpos - brain_pts[0:3]) ** 2, axis=1)),
+            decimal=4)
+        if use_differences:
+            diffs = np.diff(newpos, axis=0)
+            expected = np.hstack(
+                (0, np.sqrt(np.sum(diffs ** 2, axis=1)).max(axis=1)))
+        else:
+            expected = np.sqrt(np.mean((newpos - newpos.mean(axis=0)) ** 2,
+                                       axis=(1, 2)))
+        npt.assert_almost_equal(norm, expected)
+
+
 def test_sc_init():
     sc = ra.StimulusCorrelation(concatenated_design=True)
     assert sc.inputs.concatenated_design
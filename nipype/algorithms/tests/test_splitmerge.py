@@ -31,3 +31,68 @@ def test_split_and_merge(tmpdir):
     dwmasked = dwdata * mskdata[:, :, :, np.newaxis]
 
     assert np.allclose(dwmasked, dwmerged)
+    assert not [f for f in os.listdir(str(tmpdir)) if f.endswith('.dat')]
+
+
+def _voxel_stats(data):
+    import numpy as np
+    return np.vstack((data.mean(axis=1), data.max(axis=1))).T
+
+
+def test_map_voxels(tmpdir):
+    import numpy as np
+    import nibabel as nb
+    import os
+
+    from nipype.algorithms.misc import (split_voxels, map_voxel_block,
+                                        merge_voxels, map_voxels)
+
+    os.chdir(str(tmpdir))
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(6, 5, 4, 7)).astype(np.float32)
+    mask = rng.rand(6, 5, 4) > 0.3
+    nb.Nifti1Image(data, np.eye(4)).to_filename('in.nii')
+    nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)).to_filename('mask.nii')
+    expected = _voxel_stats(data.reshape(-1, 7)).reshape(6, 5, 4, 2)
+    expected[~mask] = 0
+
+    data_file, index_file, blocks = split_voxels('in.nii', 'mask.nii',
+                                                 block_size=15)
+    assert blocks[-1][1] == mask.sum()
+    block_files = [map_voxel_block(_voxel_stats, data_file, start, stop)
+                   for start, stop in blocks]
+    merged = merge_voxels(block_files, index_file, 'mask.nii')
+    assert np.allclose(nb.load(merged).get_data(), expected)
+
+    for n_procs in [1, 2]:
+        out_file = map_voxels(_voxel_stats, 'in.nii', 'mask.nii',
+                              block_size=15, n_procs=n_procs,
+                              out_file='mapped%d.nii' % n_procs)
+        assert np.allclose(nb.load(out_file).get_data(), expected)
+
+    source = 'def mean(data):\n    return data.mean(axis=1)\n'
+    out_file = map_voxels(source, 'in.nii', out_file='mean.nii')
+    assert np.allclose(nb.load(out_file).get_data()[..., 0],
+                       data.mean(axis=3))
+
+
+def test_split_voxels_chunks(tmpdir):
+    import numpy as np
+    import nibabel as nb
+    import os
+
+    from nipype.algorithms.misc import split_voxels
+
+    os.chdir(str(tmpdir))
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(6, 5, 4, 7)).astype(np.float32)
+    mask = rng.rand(6, 5, 4) > 0.3
+    nb.Nifti1Image(data, np.eye(4)).to_filename('in.nii.gz')
+    nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)).to_filename('mask.nii')
+
+    for chunk_size in [1, 250, 360, None]:
+        data_file, index_file, _ = split_voxels(
+            'in.nii.gz', 'mask.nii', chunk_size=chunk_size,
+            out_prefix='voxels%s' % chunk_size)
+        assert np.array_equal(np.load(data_file), data[mask])
+        assert np.array_equal(np.load(index_file), np.flatnonzero(mask))
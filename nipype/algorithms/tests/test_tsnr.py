@@ -2,6 +2,7 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 from ...testing import utils
+from ...utils import misc as utils_misc
 from ..confounds import TSNR
 from .. import misc
 
@@ -85,6 +86,56 @@ class TestTSNR():
             'tsnr_file': (2.6, 57.3)
         })
 
+    @pytest.mark.parametrize('regress_poly', [None, 2])
+    def test_tsnr_streaming(self, regress_poly):
+        inputs = dict(in_file=self.in_filenames['in_file'])
+        if regress_poly is not None:
+            inputs['regress_poly'] = regress_poly
+        TSNR(**inputs).run()
+        expected = {key: nb.load(fname).get_data()
+                    for key, fname in self.out_filenames.items()
+                    if regress_poly is not None or key != 'detrended_file'}
+
+        # the 4D file, and a list of 3D files detrended one slice at a time
+        in_files = []
+        for i, vol in enumerate(np.rollaxis(self.fake_data, 3)):
+            in_files.append(utils.save_toy_nii(vol, 'vol%d.nii' % i))
+        for in_file, chunk_size in [(inputs['in_file'], 100000),
+                                    (in_files, 1)]:
+            inputs.update(in_file=in_file, streaming=True,
+                          chunk_size=chunk_size)
+            TSNR(**inputs).run()
+            for key, value in expected.items():
+                npt.assert_almost_equal(
+                    nb.load(self.out_filenames[key]).get_data(), value,
+                    decimal=5)
+
+    @pytest.mark.parametrize('regress_poly', [None, 2])
+    def test_tsnr_streaming_scaled(self, regress_poly):
+        # a scaled, gzipped input read two volumes at a time
+        img = nb.Nifti1Image(self.fake_data.astype(np.int16), np.eye(4))
+        img.header.set_slope_inter(0.5, 10.)
+        img.to_filename('scaled.nii.gz')
+        inputs = dict(in_file='scaled.nii.gz')
+        if regress_poly is not None:
+            inputs['regress_poly'] = regress_poly
+        TSNR(**inputs).run()
+        expected = {key: nb.load(fname)
+                    for key, fname in self.out_filenames.items()
+                    if regress_poly is not None or key != 'detrended_file'}
+        expected = {key: (img.get_data_dtype(), img.get_data())
+                    for key, img in expected.items()}
+
+        chunk_size = 2 * np.prod(self.fake_data.shape[:3])
+        with mock.patch('nipype.algorithms.confounds.iter_volume_chunks',
+                        side_effect=lambda img: utils_misc.iter_volume_chunks(
+                            img, chunk_size)):
+            TSNR(streaming=True, **inputs).run()
+        for key, (dtype, value) in expected.items():
+            out = nb.load(self.out_filenames[key])
+            assert out.get_data_dtype() == dtype
+            npt.assert_almost_equal(out.get_data(), value, decimal=4)
+
     @mock.patch('warnings.warn')
     def test_warning(self, mock_warn):
         ''' test that usage of misc.TSNR trips a warning to use confounds.TSNR instead '''
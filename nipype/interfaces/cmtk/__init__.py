@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from .cmtk import ROIGen, CreateMatrix, CreateNodes
-from .nx import NetworkXMetrics, AverageNetworks
+from .nx import NetworkXMetrics, BatchNetworkMetrics, AverageNetworks
 from .parcellation import Parcellate
 from .convert import CFFConverter, MergeCNetworks
 from .nbs import NetworkBasedStatistic
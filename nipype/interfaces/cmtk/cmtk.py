@@ -19,10 +19,13 @@ import numpy as np
 import nibabel as nb
 import networkx as nx
 import scipy.io as sio
+from scipy import sparse
 
 from ... import logging
 from ...utils.filemanip import split_filename
 from ...utils import NUMPY_MMAP
+from ...utils.tracks import (concatenate_streamlines, iter_track_chunks,
+                             read_track_header, filter_tracks, write_tracks)
 
 from ..base import (BaseInterface, BaseInterfaceInputSpec, traits, File,
                     TraitedSpec, Directory, OutputMultiPath, isdefined)
@@ -100,30 +103,98 @@ def get_connectivity_matrix(n_rois, list_of_roi_crossed_lists):
     return connectivity_matrix
 
 
+def _point_labels(voxels, roiData):
+    """ Look up the ROI label of each voxel index, 0 outside the volume """
+    labels = np.zeros(len(voxels), dtype=np.int64)
+    inside = np.all((voxels >= 0) & (voxels < roiData.shape[:3]), axis=1)
+    idx = voxels[inside]
+    labels[inside] = roiData[idx[:, 0], idx[:, 1], idx[:, 2]]
+    return labels
+
+
+def _streamline_endpoints(points, offsets):
+    """ First and last point of each streamline (zeros for empty ones),
+    and a mask of the non-empty streamlines """
+    nonempty = np.diff(offsets) > 0
+    endpointsmm = np.zeros((len(nonempty), 2, 3))
+    endpointsmm[nonempty, 0] = points[offsets[:-1][nonempty]]
+    endpointsmm[nonempty, 1] = points[offsets[1:][nonempty] - 1]
+    return endpointsmm, nonempty
+
+
+def label_streamlines(streamlines, roiData, voxelSize, n_rois=None):
+    """ Label the endpoints of a set of streamlines in a single pass
+
+    All points are concatenated and voxelized at once, so the cost does not
+    depend on a Python loop over fibers or points.
+
+    Parameters
+    ----------
+    streamlines: sequence of (points, scalars, properties) tuples
+    roiData: ROI volume
+    voxelSize: 3-tuple containing the voxel size of the ROI image
+    n_rois: if given, also count for every fiber all of the ROIs
+        (labelled 1 to n_rois) it traverses
+
+    Returns
+    -------
+    endpoints: array of shape (n, 2, 3), voxel index of the first and last
+        point of each fiber
+    endpointsmm: array of shape (n, 2, 3), endpoints in millimeter coordinates
+    endlabels: array of shape (n, 2), ROI labels of the endpoints
+    lengths: array of shape (n,), length of each fiber
+    crossed: boolean array of shape (n,), fibers crossing a labelled voxel
+        (None if n_rois is not given)
+    intersections: array of shape (n_rois, n_rois), number of fibers
+        crossing each pair of ROIs (None if n_rois is not given)
+    """
+    points, offsets = concatenate_streamlines(streamlines)
+    n = len(offsets) - 1
+    npoints = np.diff(offsets)
+    endpointsmm, nonempty = _streamline_endpoints(points, offsets)
+    # Translate from mm to index, truncating as int() does
+    voxelSize = np.asarray(voxelSize[:3], dtype=np.float64)
+    endpoints = (endpointsmm / voxelSize).astype(np.intp)
+    endlabels = _point_labels(endpoints.reshape(-1, 3), roiData).reshape(n, 2)
+    endlabels[~nonempty] = 0
+
+    fiber_ids = np.repeat(np.arange(n), npoints)
+    segments = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+    # drop the segments joining the last point of a fiber to the next one
+    boundaries = offsets[1:][nonempty] - 1
+    segments[boundaries[boundaries < len(segments)]] = 0
+    lengths = np.bincount(fiber_ids[:-1], weights=segments, minlength=n)
+
+    crossed = intersections = None
+    if n_rois is not None:
+        labels = _point_labels((points / voxelSize).astype(np.intp), roiData)
+        crossed = np.zeros(n, dtype=bool)
+        crossed[fiber_ids[labels != 0]] = True
+        keep = (labels > 0) & (labels <= n_rois)
+        # unique (fiber, ROI) pairs, i.e. the ROIs crossed by each fiber
+        keys = np.unique(fiber_ids[keep] * n_rois + (labels[keep] - 1))
+        incidence = sparse.csr_matrix(
+            (np.ones(len(keys), dtype=np.int64), (keys // n_rois, keys % n_rois)),
+            shape=(n, n_rois))
+        intersections = (incidence.T * incidence).toarray()
+        np.fill_diagonal(intersections, 0)
+
+    return (endpoints.astype(np.float64), endpointsmm, endlabels,
+            lengths, crossed, intersections)
+
+
 def create_allpoints_cmat(streamlines, roiData, voxelSize, n_rois):
     """ Create the intersection arrays for each fiber
     """
     n_fib = len(streamlines)
-    pc = -1
-    # Computation for each fiber
-    final_fiber_ids = []
-    list_of_roi_crossed_lists = []
-    for i, fiber in enumerate(streamlines):
-        pcN = int(round(float(100 * i) / n_fib))
-        if pcN > pc and pcN % 1 == 0:
-            pc = pcN
-            print('%4.0f%%' % (pc))
-        rois_crossed = get_rois_crossed(fiber[0], roiData, voxelSize)
-        if len(rois_crossed) > 0:
-            list_of_roi_crossed_lists.append(list(rois_crossed))
-            final_fiber_ids.append(i)
-
-    connectivity_matrix = get_connectivity_matrix(n_rois, list_of_roi_crossed_lists)
+    _, _, _, _, crossed, connectivity_matrix = label_streamlines(
+        streamlines, roiData, voxelSize, n_rois)
+    final_fiber_ids = np.flatnonzero(crossed).tolist()
     dis = n_fib - len(final_fiber_ids)
     iflogger.info("Found %i (%f percent out of %i fibers) fibers that start or terminate in a voxel which is not labeled. (orphans)" % (dis, dis * 100.0 / n_fib, n_fib))
     iflogger.info("Valid fibers: %i (%f percent)" % (n_fib - dis, 100 - dis * 100.0 / n_fib))
     iflogger.info('Returning the intersecting point connectivity matrix')
-    return connectivity_matrix, final_fiber_ids
+    return connectivity_matrix.astype(np.uint), final_fiber_ids
 
 
 def create_endpoints_array(fib, voxelSize):
@@ -138,42 +209,47 @@ def create_endpoints_array(fib, voxelSize):
     index of its first and last point in the voxelSize volume
     endpointsmm) : endpoints in milimeter coordinates
     """
-
-    # Init
-    n = len(fib)
-    endpoints = np.zeros((n, 2, 3))
-    endpointsmm = np.zeros((n, 2, 3))
-    pc = -1
-
-    # Computation for each fiber
-    for i, fi in enumerate(fib):
-        f = fi[0]
-
-        # store startpoint
-        endpoints[i, 0, :] = f[0, :]
-        # store endpoint
-        endpoints[i, 1, :] = f[-1, :]
-
-        # store startpoint
-        endpointsmm[i, 0, :] = f[0, :]
-        # store endpoint
-        endpointsmm[i, 1, :] = f[-1, :]
-
-        # Translate from mm to index
-        endpoints[i, 0, 0] = int(endpoints[i, 0, 0] / float(voxelSize[0]))
-        endpoints[i, 0, 1] = int(endpoints[i, 0, 1] / float(voxelSize[1]))
-        endpoints[i, 0, 2] = int(endpoints[i, 0, 2] / float(voxelSize[2]))
-        endpoints[i, 1, 0] = int(endpoints[i, 1, 0] / float(voxelSize[0]))
-        endpoints[i, 1, 1] = int(endpoints[i, 1, 1] / float(voxelSize[1]))
-        endpoints[i, 1, 2] = int(endpoints[i, 1, 2] / float(voxelSize[2]))
+    points, offsets = concatenate_streamlines(fib)
+    endpointsmm, _ = _streamline_endpoints(points, offsets)
+    # Translate from mm to index
+    endpoints = (endpointsmm / np.asarray(voxelSize[:3], dtype=np.float64)
+                 ).astype(np.intp).astype(np.float64)
 
     # Return the matrices
     iflogger.info('Returning the endpoint matrix')
     return (endpoints, endpointsmm)
 
 
-def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_name, endpoint_name, intersections=False):
-    """ Create the connection matrix for each resolution using fibers and ROIs. """
+def _edge_statistics(labels, lengths, n_rois):
+    """ Number of fibers and fiber length statistics for every edge
+
+    labels is an (n, 2) array of sorted ROI pairs, one row per fiber. The
+    fibers are grouped by edge with a single sort, and the sums, medians and
+    deviations are computed with bincount-style reductions.
+    """
+    keys = (labels[:, 0] - 1) * n_rois + (labels[:, 1] - 1)
+    order = np.lexsort((lengths, keys))
+    keys = keys[order]
+    lengths = lengths[order]
+    edges, starts, counts = np.unique(keys, return_index=True,
+                                      return_counts=True)
+    groups = np.repeat(np.arange(len(edges)), counts)
+    means = np.bincount(groups, weights=lengths) / counts
+    medians = (lengths[starts + (counts - 1) // 2] +
+               lengths[starts + counts // 2]) / 2.
+    stds = np.sqrt(np.bincount(groups, weights=(lengths - means[groups]) ** 2) /
+                   counts)
+    return edges // n_rois + 1, edges % n_rois + 1, counts, means, medians, stds
+
+
+def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_name, endpoint_name, intersections=False, chunk_size=100000):
+    """ Create the connection matrix for each resolution using fibers and ROIs.
+
+    The tractogram is streamed from track_file chunk_size fibers at a time:
+    the points of each chunk are concatenated and voxelized at once, and the
+    matrices are built with array reductions instead of per-fiber loops. The
+    filtered tractographies are written streaming from track_file as well.
+    """
 
     stats = {}
     iflogger.info('Running cmat function')
@@ -182,27 +258,11 @@ def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_
     en_fnamemm = op.abspath(endpoint_name + '_endpointsmm.npy')
 
     iflogger.info('Reading Trackvis file {trk}'.format(trk=track_file))
-    fib, hdr = nb.trackvis.read(track_file, False)
-    stats['orig_n_fib'] = len(fib)
+    hdr = read_track_header(track_file)
 
     roi = nb.load(roi_file, mmap=NUMPY_MMAP)
     roiData = roi.get_data()
     roiVoxelSize = roi.header.get_zooms()
-    (endpoints, endpointsmm) = create_endpoints_array(fib, roiVoxelSize)
-
-    # Output endpoint arrays
-    iflogger.info('Saving endpoint array: {array}'.format(array=en_fname))
-    np.save(en_fname, endpoints)
-    iflogger.info('Saving endpoint array in mm: {array}'.format(array=en_fnamemm))
-    np.save(en_fnamemm, endpointsmm)
-
-    n = len(fib)
-    iflogger.info('Number of fibers {num}'.format(num=n))
-
-    # Create empty fiber label array
-    fiberlabels = np.zeros((n, 2))
-    final_fiberlabels = []
-    final_fibers_idx = []
 
     # Add node information from specified parcellation scheme
     path, name, ext = split_filename(resolution_network_file)
@@ -225,76 +285,74 @@ def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_
             xyz = tuple(np.mean(np.where(np.flipud(roiData) == int(d["dn_correspondence_id"])), axis=1))
             G.node[int(u)]['dn_position'] = tuple([xyz[0], xyz[2], -xyz[1]])
 
+    chunks = []
+    intersection_matrix = np.zeros((nROIs, nROIs), dtype=np.int64)
+    chunk_size = max(1, chunk_size)
+    for chunk in iter_track_chunks(track_file, chunk_size):
+        result = label_streamlines(chunk, roiData, roiVoxelSize,
+                                   nROIs if intersections else None)
+        chunks.append(result[:5])
+        if intersections:
+            intersection_matrix += result[5]
+        iflogger.info('Labelled %i fibers' % sum(len(c[3]) for c in chunks))
+
+    def _stack(i, shape):
+        if not chunks:
+            return np.zeros(shape)
+        return np.concatenate([c[i] for c in chunks])
+
+    endpoints = _stack(0, (0, 2, 3))
+    endpointsmm = _stack(1, (0, 2, 3))
+    endlabels = _stack(2, (0, 2)).astype(np.int64)
+    fiberlength = _stack(3, (0,))
+
+    # Output endpoint arrays
+    iflogger.info('Saving endpoint array: {array}'.format(array=en_fname))
+    np.save(en_fname, endpoints)
+    iflogger.info('Saving endpoint array in mm: {array}'.format(array=en_fnamemm))
+    np.save(en_fnamemm, endpointsmm)
+
+    n = len(endpoints)
+    stats['orig_n_fib'] = n
+    iflogger.info('Number of fibers {num}'.format(num=n))
+
     if intersections:
         iflogger.info("Filtering tractography from intersections")
-        intersection_matrix, final_fiber_ids = create_allpoints_cmat(fib, roiData, roiVoxelSize, nROIs)
+        final_fiber_ids = np.flatnonzero(_stack(4, (0,)).astype(bool))
         finalfibers_fname = op.abspath(endpoint_name + '_intersections_streamline_final.trk')
-        stats['intersections_n_fib'] = save_fibers(hdr, fib, finalfibers_fname, final_fiber_ids)
-        intersection_matrix = np.matrix(intersection_matrix)
+        stats['intersections_n_fib'] = filter_tracks(track_file, finalfibers_fname, final_fiber_ids, chunk_size, hdr)
+        intersection_matrix = np.matrix(intersection_matrix.astype(np.uint))
         I = G.copy()
         H = nx.from_numpy_matrix(np.matrix(intersection_matrix))
         H = nx.relabel_nodes(H, lambda x: x + 1)  # relabel nodes so they start at 1
         I.add_weighted_edges_from(((u, v, d['weight']) for u, v, d in H.edges(data=True)))
 
-    dis = 0
-    for i in range(endpoints.shape[0]):
-
-        # ROI start => ROI end
-        try:
-            startROI = int(roiData[endpoints[i, 0, 0], endpoints[i, 0, 1], endpoints[i, 0, 2]])
-            endROI = int(roiData[endpoints[i, 1, 0], endpoints[i, 1, 1], endpoints[i, 1, 2]])
-        except IndexError:
-            iflogger.error(("AN INDEXERROR EXCEPTION OCCURED FOR FIBER %s. PLEASE CHECK ENDPOINT GENERATION" % i))
-            break
-
-        # Filter
-        if startROI == 0 or endROI == 0:
-            dis += 1
-            fiberlabels[i, 0] = -1
-            continue
-
-        if startROI > nROIs or endROI > nROIs:
-            iflogger.error("Start or endpoint of fiber terminate in a voxel which is labeled higher")
-            iflogger.error("than is expected by the parcellation node information.")
-            iflogger.error("Start ROI: %i, End ROI: %i" % (startROI, endROI))
-            iflogger.error("This needs bugfixing!")
-            continue
-
-        # Update fiber label
-        # switch the rois in order to enforce startROI < endROI
-        if endROI < startROI:
-            tmp = startROI
-            startROI = endROI
-            endROI = tmp
-
-        fiberlabels[i, 0] = startROI
-        fiberlabels[i, 1] = endROI
-
-        final_fiberlabels.append([startROI, endROI])
-        final_fibers_idx.append(i)
-
-        # Add edge to graph
-        if G.has_edge(startROI, endROI) and 'fiblist' in G.edge[startROI][endROI]:
-            G.edge[startROI][endROI]['fiblist'].append(i)
-        else:
-            G.add_edge(startROI, endROI, fiblist=[i])
+    # ROI start => ROI end, switching the rois to enforce startROI < endROI
+    endlabels.sort(axis=1)
+    orphans = endlabels[:, 0] == 0
+    dis = int(np.sum(orphans))
+    too_high = ~orphans & (endlabels[:, 1] > nROIs)
+    for i in np.flatnonzero(too_high):
+        iflogger.error("Start or endpoint of fiber terminate in a voxel which is labeled higher")
+        iflogger.error("than is expected by the parcellation node information.")
+        iflogger.error("Start ROI: %i, End ROI: %i" % tuple(endlabels[i]))
+        iflogger.error("This needs bugfixing!")
+
+    valid = ~orphans & ~too_high
+    final_fibers_idx = np.flatnonzero(valid)
+    final_fiberlabels_array = endlabels[valid]
+
+    # Create fiber label array
+    fiberlabels = np.zeros((n, 2))
+    fiberlabels[orphans, 0] = -1
+    fiberlabels[valid] = final_fiberlabels_array
 
     # create a final fiber length array
-    finalfiberlength = []
     if intersections:
         final_fibers_indices = final_fiber_ids
     else:
         final_fibers_indices = final_fibers_idx
-
-    for idx in final_fibers_indices:
-        # compute length of fiber
-        finalfiberlength.append(length(fib[idx][0]))
-
-    # convert to array
-    final_fiberlength_array = np.array(finalfiberlength)
-
-    # make final fiber labels as array
-    final_fiberlabels_array = np.array(final_fiberlabels, dtype=int)
+    final_fiberlength_array = fiberlength[final_fibers_indices]
 
     iflogger.info("Found %i (%f percent out of %i fibers) fibers that start or terminate in a voxel which is not labeled. (orphans)" % (dis, dis * 100.0 / n, n))
     iflogger.info("Valid fibers: %i (%f percent)" % (n - dis, 100 - dis * 100.0 / n))
@@ -304,27 +362,26 @@ def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_
     fibmean = numfib.copy()
     fibmedian = numfib.copy()
     fibdev = numfib.copy()
-    for u, v, d in G.edges_iter(data=True):
+    for u, v in G.edges():
         G.remove_edge(u, v)
-        di = {}
-        if 'fiblist' in d:
-            di['number_of_fibers'] = len(d['fiblist'])
-            idx = np.where((final_fiberlabels_array[:, 0] == int(u)) & (final_fiberlabels_array[:, 1] == int(v)))[0]
-            di['fiber_length_mean'] = float(np.mean(final_fiberlength_array[idx]))
-            di['fiber_length_median'] = float(np.median(final_fiberlength_array[idx]))
-            di['fiber_length_std'] = float(np.std(final_fiberlength_array[idx]))
-        else:
-            di['number_of_fibers'] = 0
-            di['fiber_length_mean'] = 0
-            di['fiber_length_median'] = 0
-            di['fiber_length_std'] = 0
         if not u == v:  # Fix for self loop problem
-            G.add_edge(u, v, di)
-            if 'fiblist' in d:
-                numfib.add_edge(u, v, weight=di['number_of_fibers'])
-                fibmean.add_edge(u, v, weight=di['fiber_length_mean'])
-                fibmedian.add_edge(u, v, weight=di['fiber_length_median'])
-                fibdev.add_edge(u, v, weight=di['fiber_length_std'])
+            G.add_edge(u, v, number_of_fibers=0, fiber_length_mean=0,
+                       fiber_length_median=0, fiber_length_std=0)
+
+    for u, v, count, mean, median, std in zip(*_edge_statistics(
+            final_fiberlabels_array, fiberlength[valid], nROIs)):
+        if u == v:  # Fix for self loop problem
+            continue
+        u, v = int(u), int(v)
+        di = {'number_of_fibers': int(count),
+              'fiber_length_mean': float(mean),
+              'fiber_length_median': float(median),
+              'fiber_length_std': float(std)}
+        G.add_edge(u, v, di)
+        numfib.add_edge(u, v, weight=di['number_of_fibers'])
+        fibmean.add_edge(u, v, weight=di['fiber_length_mean'])
+        fibmedian.add_edge(u, v, weight=di['fiber_length_median'])
+        fibdev.add_edge(u, v, weight=di['fiber_length_std'])
 
     iflogger.info('Writing network as {ntwk}'.format(ntwk=matrix_name))
     nx.write_gpickle(G, op.abspath(matrix_name))
@@ -384,9 +441,11 @@ def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_
 
     iflogger.info("Filtering tractography - keeping only no orphan fibers")
     finalfibers_fname = op.abspath(endpoint_name + '_streamline_final.trk')
-    stats['endpoint_n_fib'] = save_fibers(hdr, fib, finalfibers_fname, final_fibers_idx)
+    iflogger.info("Writing final non-orphan fibers as %s" % finalfibers_fname)
+    stats['endpoint_n_fib'] = filter_tracks(track_file, finalfibers_fname, final_fibers_idx, chunk_size, hdr)
     stats['endpoints_percent'] = float(stats['endpoint_n_fib']) / float(stats['orig_n_fib']) * 100
-    stats['intersections_percent'] = float(stats['intersections_n_fib']) / float(stats['orig_n_fib']) * 100
+    if intersections:
+        stats['intersections_percent'] = float(stats['intersections_n_fib']) / float(stats['orig_n_fib']) * 100
 
     out_stats_file = op.abspath(endpoint_name + '_statistics.mat')
     iflogger.info("Saving matrix creation statistics as %s" % out_stats_file)
@@ -396,14 +455,9 @@ def cmat(track_file, roi_file, resolution_network_file, matrix_name, matrix_mat_
 def save_fibers(oldhdr, oldfib, fname, indices):
     """ Stores a new trackvis file fname using only given indices """
     hdrnew = oldhdr.copy()
-    outstreams = []
-    for i in indices:
-        outstreams.append(oldfib[i])
-    n_fib_out = len(outstreams)
-    hdrnew['n_count'] = n_fib_out
+    hdrnew['n_count'] = 0
     iflogger.info("Writing final non-orphan fibers as %s" % fname)
-    nb.trackvis.write(fname, outstreams, hdrnew)
-    return n_fib_out
+    return write_tracks(fname, (oldfib[i] for i in indices), hdrnew)
 
 
 class CreateMatrixInputSpec(TraitedSpec):
@@ -411,6 +465,7 @@ class CreateMatrixInputSpec(TraitedSpec):
     tract_file = File(exists=True, mandatory=True, desc='Trackvis tract file')
     resolution_network_file = File(exists=True, mandatory=True, desc='Parcellation files from Connectome Mapping Toolkit')
     count_region_intersections = traits.Bool(False, usedefault=True, desc='Counts all of the fiber-region traversals in the connectivity matrix (requires significantly more computational time)')
+    chunk_size = traits.Int(100000, usedefault=True, desc='Number of fibers labelled at once, bounding the memory used by the points of each chunk')
     out_matrix_file = File(genfile=True, desc='NetworkX graph describing the connectivity')
     out_matrix_mat_file = File('cmatrix.mat', usedefault=True, desc='Matlab matrix describing the connectivity')
     out_mean_fiber_length_matrix_mat_file = File(genfile=True, desc='Matlab matrix describing the mean fiber lengths between each node.')
@@ -493,7 +548,8 @@ class CreateMatrix(BaseInterface):
             endpoint_name = op.abspath(self.inputs.out_endpoint_array_name)
 
         cmat(self.inputs.tract_file, self.inputs.roi_file, self.inputs.resolution_network_file,
-             matrix_file, matrix_mat_file, endpoint_name, self.inputs.count_region_intersections)
+             matrix_file, matrix_mat_file, endpoint_name, self.inputs.count_region_intersections,
+             self.inputs.chunk_size)
         return runtime
 
     def _list_outputs(self):
@@ -10,6 +10,7 @@ import networkx as nx
 
 from ... import logging
 from ...utils.misc import package_check
+from .nx import stack_networks
 from ..base import (BaseInterface, BaseInterfaceInputSpec, traits,
                     File, TraitedSpec, InputMultiPath,
                     OutputMultiPath, isdefined)
@@ -25,16 +26,16 @@ else:
 
 
 def ntwks_to_matrices(in_files, edge_key):
-    first = nx.read_gpickle(in_files[0])
-    files = len(in_files)
-    nodes = len(first.nodes())
-    matrix = np.zeros((nodes, nodes, files))
-    for idx, name in enumerate(in_files):
-        graph = nx.read_gpickle(name)
-        for u, v, d in graph.edges(data=True):
-            graph[u][v]['weight'] = d[edge_key]  # Setting the edge requested edge value as weight value
-        matrix[:, :, idx] = nx.to_numpy_matrix(graph)  # Retrieve the matrix
-    return matrix
+    """
+    Returns the edge_key values of the networks as a (nodes x nodes x files)
+    array, with the nodes ordered as in the first network
+    """
+    _, edges, edge_stacks, _ = stack_networks(in_files, edge_keys=[edge_key])
+    if edge_key in edge_stacks:
+        matrix = np.nan_to_num(edge_stacks[edge_key])
+    else:
+        matrix = np.zeros(edges.shape)
+    return matrix.transpose(1, 2, 0)
 
 
 class NetworkBasedStatisticInputSpec(BaseInterfaceInputSpec):
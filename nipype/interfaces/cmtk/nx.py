@@ -18,6 +18,8 @@ import pickle
 import numpy as np
 import networkx as nx
 import scipy.io as sio
+from scipy import sparse
+from scipy.sparse import csgraph
 
 from ... import logging
 from ...utils.filemanip import split_filename
@@ -97,10 +99,81 @@ def add_dicts_by_key(in_dict1, in_dict2):
     return both
 
 
-def average_networks(in_files, ntwk_res_file, group_id):
+def stack_networks(in_files, nodelist=None, edge_keys=None, out_prefix=None):
+    """
+    Stacks the edge data of several networks into arrays
+
+    Returns the list of nodes, a boolean array of shape (n_networks, n_nodes,
+    n_nodes) marking the edges of each network, a dictionary with, for each
+    numeric edge key, an array of the same shape holding the edge values (NaN
+    where the edge or the key is missing), and a dictionary with the numeric
+    node values as (n_networks, n_nodes) arrays (NaN where missing).
+
+    The nodes are those of the first network unless nodelist is given, and
+    only the keys in edge_keys are stacked if given. If out_prefix is given,
+    the edge arrays are memory-mapped .npy files named
+    out_prefix + '_' + key + '.npy' (out_prefix + '_edges.npy' for the edges).
+    """
+    if nodelist is None:
+        nodelist = read_unknown_ntwk(in_files[0]).nodes()
+    nodelist = list(nodelist)
+    index = dict((node, idx) for idx, node in enumerate(nodelist))
+    shape = (len(in_files), len(nodelist), len(nodelist))
+
+    def _new_stack(name, dtype, fill):
+        if out_prefix is None:
+            stack = np.empty(shape, dtype=dtype)
+        else:
+            stack = np.lib.format.open_memmap(
+                op.abspath(out_prefix + '_' + name + '.npy'), mode='w+',
+                dtype=dtype, shape=shape)
+        stack.fill(fill)
+        return stack
+
+    edges = _new_stack('edges', bool, False)
+    edge_stacks = {}
+    node_stacks = {}
+    for subject, in_file in enumerate(in_files):
+        ntwk = read_unknown_ntwk(in_file)
+        rows, cols, values = [], [], {}
+        for u, v, data in ntwk.edges_iter(data=True):
+            if u not in index or v not in index:
+                continue
+            rows.append(index[u])
+            cols.append(index[v])
+            for key, value in data.items():
+                if ((edge_keys is None or key in edge_keys) and
+                        isinstance(value, (int, float, np.number)) and
+                        not isinstance(value, bool)):
+                    values.setdefault(key, []).append((len(rows) - 1, value))
+        rows, cols = np.array(rows, dtype=int), np.array(cols, dtype=int)
+        edges[subject, rows, cols] = True
+        edges[subject, cols, rows] = True
+        for key, items in values.items():
+            if key not in edge_stacks:
+                edge_stacks[key] = _new_stack(key, np.float64, np.nan)
+            idx, vals = np.array(items).T
+            idx = idx.astype(int)
+            edge_stacks[key][subject, rows[idx], cols[idx]] = vals
+            edge_stacks[key][subject, cols[idx], rows[idx]] = vals
+        for node, data in ntwk.nodes_iter(data=True):
+            value = data.get('value')
+            if node in index and isinstance(value, (int, float, np.number)):
+                if 'value' not in node_stacks:
+                    node_stacks['value'] = np.full(shape[:2], np.nan)
+                node_stacks['value'][subject, index[node]] = value
+    return nodelist, edges, edge_stacks, node_stacks
+
+
+def average_networks(in_files, ntwk_res_file, group_id, memmap_stacks=False):
     """
     Sums the edges of input networks and divides by the number of networks
     Writes the average network as .pck and .gexf and returns the name of the written networks
+
+    The edge values of all networks are stacked into (networks x nodes x
+    nodes) arrays (memory-mapped .npy files if memmap_stacks is set) and
+    averaged with reductions over the networks. An edge value is kept if it
+    is defined on every network having the edge.
     """
     import networkx as nx
     import os.path as op
@@ -118,69 +191,51 @@ def average_networks(in_files, ntwk_res_file, group_id):
         ntwk_res_file = read_unknown_ntwk(ntwk_res_file)
         iflogger.info(("{n} Nodes found in network resolution "
                        "file").format(n=ntwk_res_file.number_of_nodes()))
-        ntwk = remove_all_edges(ntwk_res_file)
-        counting_ntwk = ntwk.copy()
-        # Sums all the relevant variables
-        for index, subject in enumerate(in_files):
-            tmp = nx.read_gpickle(subject)
-            iflogger.info(('File {s} has {n} '
-                           'edges').format(s=subject, n=tmp.number_of_edges()))
-            edges = tmp.edges_iter()
-            for edge in edges:
-                data = {}
-                data = tmp.edge[edge[0]][edge[1]]
-                data['count'] = 1
-                if ntwk.has_edge(edge[0], edge[1]):
-                    current = {}
-                    current = ntwk.edge[edge[0]][edge[1]]
-                    data = add_dicts_by_key(current, data)
-                ntwk.add_edge(edge[0], edge[1], data)
-            nodes = tmp.nodes_iter()
-            for node in nodes:
-                data = {}
-                data = ntwk.node[node]
-                if 'value' in tmp.node[node]:
-                    data['value'] = data['value'] + tmp.node[node]['value']
-                ntwk.add_node(node, data)
+        out_prefix = None
+        if memmap_stacks:
+            out_prefix = group_id + '_stack'
+        nodelist, edges, edge_stacks, node_stacks = stack_networks(
+            in_files, sorted(ntwk_res_file.nodes()), out_prefix=out_prefix)
+
+        # Counts and sums all the relevant variables, one network at a time
+        edge_count = np.zeros(edges.shape[1:], dtype=int)
+        for subject_edges in edges:
+            edge_count += subject_edges
+        iflogger.info(('Total network has {n} '
+                       'edges').format(n=np.count_nonzero(np.triu(edge_count))))
+        keep = (edge_count >= count_to_keep_edge) & (edge_count > 0)
 
         # Divides each value by the number of files
-        nodes = ntwk.nodes_iter()
-        edges = ntwk.edges_iter()
-        iflogger.info(('Total network has {n} '
-                       'edges').format(n=ntwk.number_of_edges()))
+        edge_dict = {'count': edge_count.astype(np.float64)}
+        defined = {}
+        for key, stack in edge_stacks.items():
+            total = np.zeros(edges.shape[1:])
+            present = np.zeros(edges.shape[1:], dtype=int)
+            for values in stack:
+                missing = np.isnan(values)
+                total += np.where(missing, 0, values)
+                present += ~missing
+            defined[key] = keep & (present == edge_count)
+            edge_dict[key] = np.where(defined[key], total / len(in_files), 0)
+
         avg_ntwk = nx.Graph()
-        newdata = {}
-        for node in nodes:
-            data = ntwk.node[node]
-            newdata = data
-            if 'value' in data:
-                newdata['value'] = data['value'] / len(in_files)
-                ntwk.node[node]['value'] = newdata
-            avg_ntwk.add_node(node, newdata)
-
-        edge_dict = {}
-        edge_dict['count'] = np.zeros((avg_ntwk.number_of_nodes(),
-                                       avg_ntwk.number_of_nodes()))
-        for edge in edges:
-            data = ntwk.edge[edge[0]][edge[1]]
-            if ntwk.edge[edge[0]][edge[1]]['count'] >= count_to_keep_edge:
-                for key in list(data.keys()):
-                    if not key == 'count':
-                        data[key] = data[key] / len(in_files)
-                ntwk.edge[edge[0]][edge[1]] = data
-                avg_ntwk.add_edge(edge[0], edge[1], data)
-            edge_dict['count'][edge[0] - 1][edge[1] - 1] = ntwk.edge[edge[0]][edge[1]]['count']
+        for node, data in ntwk_res_file.nodes_iter(data=True):
+            avg_ntwk.add_node(node, data)
+        if 'value' in node_stacks:
+            values = node_stacks['value']
+            has_value = ~np.all(np.isnan(values), axis=0)
+            means = np.nansum(values, axis=0) / len(in_files)
+            for idx in np.flatnonzero(has_value):
+                avg_ntwk.node[nodelist[idx]]['value'] = float(means[idx])
+
+        for row, col in zip(*np.nonzero(np.triu(keep))):
+            data = dict((key, float(edge_dict[key][row, col]))
+                        for key in edge_stacks if defined[key][row, col])
+            data['count'] = int(edge_count[row, col])
+            avg_ntwk.add_edge(nodelist[row], nodelist[col], data)
 
         iflogger.info('After thresholding, the average network has has {n} edges'.format(n=avg_ntwk.number_of_edges()))
 
-        avg_edges = avg_ntwk.edges_iter()
-        for edge in avg_edges:
-            data = avg_ntwk.edge[edge[0]][edge[1]]
-            for key in list(data.keys()):
-                if not key == 'count':
-                    edge_dict[key] = np.zeros((avg_ntwk.number_of_nodes(), avg_ntwk.number_of_nodes()))
-                    edge_dict[key][edge[0] - 1][edge[1] - 1] = data[key]
-
         for key in list(edge_dict.keys()):
             tmp = {}
             network_name = group_id + '_' + key + '_average.mat'
@@ -316,6 +371,246 @@ def compute_network_measures(ntwk):
     return measures
 
 
+def ntwk_to_adjacency(ntwk, weight=None, nodelist=None):
+    """
+    Returns the list of nodes and the adjacency matrix of a network, with
+    the edge values of the weight key (1 for edges without it), or 1 for
+    every edge if weight is None. The rows and columns follow nodelist
+    (the order of ntwk.nodes() by default)
+    """
+    if nodelist is None:
+        nodelist = ntwk.nodes()
+    adjacency = np.asarray(nx.to_numpy_matrix(ntwk, nodelist=nodelist,
+                                              weight=weight))
+    return nodelist, adjacency
+
+
+def _binarize(adjacency):
+    """ Binary adjacency matrix without self loops, and the node degrees """
+    binary = (adjacency != 0).astype(np.float64)
+    loops = np.diag(binary).copy()
+    np.fill_diagonal(binary, 0)
+    # as in networkx, a self loop counts twice in the degree
+    degree = binary.sum(axis=1) + 2 * loops
+    return binary, degree
+
+
+def _shortest_path_lengths(binary):
+    """ Number of edges on the shortest paths between all nodes (inf if unreachable) """
+    return csgraph.shortest_path(sparse.csr_matrix(binary), directed=False,
+                                 unweighted=True)
+
+
+def _betweenness_centrality(binary, dist):
+    """
+    Normalized betweenness centrality (Brandes), from all sources at once
+
+    The numbers of shortest paths and the dependencies are propagated layer
+    by layer of the shortest path lengths, with one matrix product per
+    layer for all the sources.
+    """
+    n = len(binary)
+    reachable = np.isfinite(dist)
+    max_dist = int(dist[reachable].max()) if n else 0
+    sigma = np.eye(n)
+    for layer in range(1, max_dist + 1):
+        sigma += np.where(dist == layer,
+                          np.dot(np.where(dist == layer - 1, sigma, 0), binary),
+                          0)
+    delta = np.zeros((n, n))
+    for layer in range(max_dist, 0, -1):
+        coeff = np.where(dist == layer, (1 + delta) / np.where(sigma > 0, sigma, 1), 0)
+        delta += np.where(dist == layer - 1, sigma * np.dot(coeff, binary), 0)
+    betweenness = delta.sum(axis=0) - np.diag(delta)
+    if n > 2:
+        betweenness /= (n - 1) * (n - 2)
+    return betweenness
+
+
+def _core_number(binary):
+    """ k-core number of each node, peeling all the nodes of a k-shell at once """
+    degree = binary.sum(axis=1)
+    core = np.zeros(len(binary), dtype=int)
+    remaining = np.ones(len(binary), dtype=bool)
+    k = 0
+    while remaining.any():
+        k = max(k, int(degree[remaining].min()))
+        peel = remaining & (degree <= k)
+        while peel.any():
+            core[peel] = k
+            remaining &= ~peel
+            degree -= binary[:, peel].sum(axis=1)
+            peel = remaining & (degree <= k)
+    return core
+
+
+def compute_matrix_node_measures(adjacency, calculate_cliques=False, ntwk=None,
+                                 weights=None):
+    """
+    Node-based measures computed from an adjacency matrix
+
+    Returns the measures of compute_node_measures (except load centrality)
+    and the node strength, the sum of the edge weights of each node (of the
+    adjacency matrix if weights is not given). Any edge in the adjacency
+    matrix counts, whatever its value. Clique-related measures are computed
+    with networkx, from ntwk.
+    """
+    iflogger.info('Computing node measures from the adjacency matrix')
+    binary, degree = _binarize(adjacency)
+    n = len(binary)
+    dist = _shortest_path_lengths(binary)
+    reachable = np.isfinite(dist)
+
+    measures = {}
+    measures['degree'] = degree.astype(int)
+    if weights is None:
+        weights = adjacency
+    measures['strength'] = np.asarray(weights).sum(axis=1)
+    measures['degree_centrality'] = degree / max(n - 1, 1)
+    measures['betweenness_centrality'] = _betweenness_centrality(binary, dist)
+
+    n_reached = reachable.sum(axis=1) - 1.
+    total = np.where(reachable, dist, 0).sum(axis=1)
+    closeness = np.zeros(n)
+    valid = (total > 0) & (n > 1)
+    closeness[valid] = (n_reached[valid] / total[valid] *
+                        n_reached[valid] / (n - 1))
+    measures['closeness_centrality'] = closeness
+
+    triangles = (np.dot(binary, binary) * binary).sum(axis=1) / 2
+    measures['triangles'] = triangles.astype(int)
+    neighbors = binary.sum(axis=1)
+    possible = neighbors * (neighbors - 1)
+    measures['clustering'] = np.where(
+        possible > 0, 2 * triangles / np.where(possible > 0, possible, 1), 0)
+    measures['core_number'] = _core_number(binary)
+    measures['isolates'] = (degree == 0).astype(np.float64)[:, np.newaxis]
+    if calculate_cliques and ntwk is not None:
+        iflogger.info('...Calculating node clique number')
+        measures['node_clique_number'] = np.array(list(nx.node_clique_number(ntwk).values()))
+        iflogger.info('...Computing number of cliques for each node...')
+        measures['number_of_cliques'] = np.array(list(nx.number_of_cliques(ntwk).values()))
+    return measures
+
+
+def compute_matrix_singlevalued_measures(adjacency, calculate_cliques=False, ntwk=None):
+    """
+    Single valued measures computed from an adjacency matrix
+
+    The shortest path lengths are computed with scipy.sparse.csgraph. The
+    average shortest path length (characteristic path length) is taken over
+    the largest connected component, and the global efficiency over all
+    pairs of nodes.
+    """
+    iflogger.info('Computing single valued measures from the adjacency matrix')
+    binary, degree = _binarize(adjacency)
+    n = len(binary)
+    measures = {}
+
+    # pearson correlation of the degrees at both ends of the edges
+    rows, cols = np.nonzero(binary)
+    x, y = degree[rows], degree[cols]
+    x, y = x - x.mean(), y - y.mean()
+    measures['degree_pearsonr'] = (x * y).sum() / np.sqrt((x * x).sum() * (y * y).sum())
+    measures['degree_assortativity'] = measures['degree_pearsonr']
+
+    triangles = (np.dot(binary, binary) * binary).sum(axis=1)
+    neighbors = binary.sum(axis=1)
+    triads = (neighbors * (neighbors - 1)).sum()
+    measures['transitivity'] = triangles.sum() / triads if triangles.sum() > 0 else 0.
+    n_components, labels = csgraph.connected_components(sparse.csr_matrix(binary), directed=False)
+    measures['number_connected_components'] = n_components
+    n_edges = np.count_nonzero(np.triu(adjacency))
+    measures['graph_density'] = 2. * n_edges / (n * (n - 1)) if n > 1 else 0.
+    measures['number_of_edges'] = n_edges
+    measures['number_of_nodes'] = n
+    possible = neighbors * (neighbors - 1)
+    clustering = np.where(possible > 0, triangles / np.where(possible > 0, possible, 1), 0)
+    measures['average_clustering'] = clustering.mean()
+
+    dist = _shortest_path_lengths(binary)
+    largest = labels == np.argmax(np.bincount(labels))
+    component = dist[np.ix_(largest, largest)]
+    n_largest = largest.sum()
+    measures['average_shortest_path_length'] = (
+        component.sum() / (n_largest * (n_largest - 1)) if n_largest > 1 else 0.)
+    offdiag = ~np.eye(n, dtype=bool)
+    measures['global_efficiency'] = (1. / dist[offdiag]).mean() if n > 1 else 0.
+    if calculate_cliques and ntwk is not None:
+        iflogger.info('...Computing graph clique number...')
+        measures['graph_clique_number'] = nx.graph_clique_number(ntwk)
+    return measures
+
+
+def compute_matrix_measures(in_file, calculate_cliques=False,
+                            strength_key='number_of_fibers', nodelist=None):
+    """
+    Reads a network and returns its single valued and node measures,
+    computed from its adjacency matrix, the node strength being the sum of
+    the values of the strength_key edge key
+
+    The node measures follow the order of nodelist, which must hold the
+    nodes of the network (its sorted nodes by default).
+    """
+    ntwk = read_unknown_ntwk(in_file)
+    if nodelist is None:
+        nodelist = sorted(ntwk.nodes())
+    elif len(nodelist) != len(ntwk) or set(nodelist) != set(ntwk.nodes()):
+        raise ValueError('The nodes of %s differ from nodelist' % in_file)
+    return _matrix_measures(ntwk, nodelist, calculate_cliques, strength_key)
+
+
+def _matrix_measures(ntwk, nodelist, calculate_cliques, strength_key):
+    _, adjacency = ntwk_to_adjacency(ntwk, nodelist=nodelist)
+    _, weights = ntwk_to_adjacency(ntwk, strength_key, nodelist)
+    return (compute_matrix_singlevalued_measures(adjacency, calculate_cliques, ntwk),
+            compute_matrix_node_measures(adjacency, calculate_cliques, ntwk, weights))
+
+
+def _compute_matrix_measures(args):
+    in_file, calculate_cliques, strength_key = args
+    ntwk = read_unknown_ntwk(in_file)
+    nodelist = sorted(ntwk.nodes())
+    return (nodelist,) + _matrix_measures(ntwk, nodelist, calculate_cliques,
+                                          strength_key)
+
+
+def batch_matrix_measures(in_files, calculate_cliques=False, n_procs=1,
+                          strength_key='number_of_fibers'):
+    """
+    Computes the measures of compute_matrix_measures for many networks,
+    on a pool of n_procs processes
+
+    Returns a dictionary of single valued measures (one value per network)
+    and a dictionary of node measures (networks x nodes arrays, the nodes
+    being sorted). All the networks must have the same nodes.
+    """
+    from multiprocessing import Pool
+    args = [(in_file, calculate_cliques, strength_key) for in_file in in_files]
+    if n_procs > 1:
+        pool = Pool(processes=n_procs)
+        try:
+            results = pool.map(_compute_matrix_measures, args)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [_compute_matrix_measures(arg) for arg in args]
+
+    for in_file, result in zip(in_files, results):
+        if result[0] != results[0][0]:
+            raise ValueError('The nodes of %s differ from those of %s' %
+                             (in_file, in_files[0]))
+    global_measures = {}
+    node_measures = {}
+    for key in results[0][1]:
+        global_measures[key] = np.array([result[1][key] for result in results])
+    for key in results[0][2]:
+        node_measures[key] = np.vstack([np.ravel(result[2][key])
+                                        for result in results])
+    return global_measures, node_measures
+
+
 def add_node_data(node_array, ntwk):
     node_ntwk = nx.Graph()
     newdata = {}
@@ -350,6 +645,10 @@ class NetworkXMetricsInputSpec(BaseInterfaceInputSpec):
     out_k_crust = File('k_crust', usedefault=True, desc='Computed k-crust network stored as a NetworkX pickle.')
     treat_as_weighted_graph = traits.Bool(True, usedefault=True, desc='Some network metrics can be calculated while considering only a binarized version of the graph')
     compute_clique_related_measures = traits.Bool(False, usedefault=True, desc='Computing clique-related measures (e.g. node clique number) can be very time consuming')
+    engine = traits.Enum('networkx', 'matrix', usedefault=True, desc='Compute the node and single valued measures with networkx, or from the adjacency matrix '
+                         '(vectorized, with node strength and global efficiency but no load centrality)')
+    strength_edge_key = traits.Str('number_of_fibers', usedefault=True, desc='Edge key whose values are summed into the node strength '
+                                   '(matrix engine)')
     out_global_metrics_matlab = File(genfile=True, desc='Output node metrics in MATLAB .mat format')
     out_node_metrics_matlab = File(genfile=True, desc='Output node metrics in MATLAB .mat format')
     out_edge_metrics_matlab = File(genfile=True, desc='Output edge metrics in MATLAB .mat format')
@@ -403,7 +702,12 @@ class NetworkXMetrics(BaseInterface):
         calculate_cliques = self.inputs.compute_clique_related_measures
         weighted = self.inputs.treat_as_weighted_graph
 
-        global_measures = compute_singlevalued_measures(ntwk, weighted, calculate_cliques)
+        if self.inputs.engine == 'matrix':
+            _, adjacency = ntwk_to_adjacency(ntwk)
+            _, weights = ntwk_to_adjacency(ntwk, self.inputs.strength_edge_key)
+            global_measures = compute_matrix_singlevalued_measures(adjacency, calculate_cliques, ntwk)
+        else:
+            global_measures = compute_singlevalued_measures(ntwk, weighted, calculate_cliques)
         if isdefined(self.inputs.out_global_metrics_matlab):
             global_out_file = op.abspath(self.inputs.out_global_metrics_matlab)
         else:
@@ -411,7 +715,10 @@ class NetworkXMetrics(BaseInterface):
         sio.savemat(global_out_file, global_measures, oned_as='column')
         matlab.append(global_out_file)
 
-        node_measures = compute_node_measures(ntwk, calculate_cliques)
+        if self.inputs.engine == 'matrix':
+            node_measures = compute_matrix_node_measures(adjacency, calculate_cliques, ntwk, weights)
+        else:
+            node_measures = compute_node_measures(ntwk, calculate_cliques)
         for key in list(node_measures.keys()):
             newntwk = add_node_data(node_measures[key], ntwk)
             out_file = op.abspath(self._gen_outfilename(key, 'pck'))
@@ -503,11 +810,63 @@ class NetworkXMetrics(BaseInterface):
         return name + '.' + ext
 
 
+class BatchNetworkMetricsInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(File(exists=True), mandatory=True, desc='Networks with the same nodes')
+    compute_clique_related_measures = traits.Bool(False, usedefault=True, desc='Computing clique-related measures (e.g. node clique number) can be very time consuming')
+    n_procs = traits.Int(1, usedefault=True, desc='Number of processes the networks are distributed on')
+    strength_edge_key = traits.Str('number_of_fibers', usedefault=True, desc='Edge key whose values are summed into the node strength')
+    out_global_metrics_matlab = File('globalmetrics.mat', usedefault=True, desc='Output global metrics in MATLAB .mat format')
+    out_node_metrics_matlab = File('nodemetrics.mat', usedefault=True, desc='Output node metrics in MATLAB .mat format')
+
+
+class BatchNetworkMetricsOutputSpec(TraitedSpec):
+    global_measures_matlab = File(desc='Global metrics in MATLAB .mat format, one value per network')
+    node_measures_matlab = File(desc='Node metrics in MATLAB .mat format, as networks x nodes matrices')
+
+
+class BatchNetworkMetrics(BaseInterface):
+    """
+    Calculates the node and single valued network measures of many networks
+    at once, from their adjacency matrices
+
+    The networks are distributed on a pool of processes, and the measures of
+    all networks are stacked in the output .mat files.
+
+    Example
+    -------
+
+    >>> import nipype.interfaces.cmtk as cmtk
+    >>> metrics = cmtk.BatchNetworkMetrics()
+    >>> metrics.inputs.in_files = ['subj1.pck', 'subj2.pck']
+    >>> metrics.inputs.n_procs = 2
+    >>> metrics.run()                 # doctest: +SKIP
+    """
+    input_spec = BatchNetworkMetricsInputSpec
+    output_spec = BatchNetworkMetricsOutputSpec
+
+    def _run_interface(self, runtime):
+        global_measures, node_measures = batch_matrix_measures(
+            self.inputs.in_files, self.inputs.compute_clique_related_measures,
+            self.inputs.n_procs, self.inputs.strength_edge_key)
+        outputs = self._list_outputs()
+        sio.savemat(outputs['global_measures_matlab'], global_measures, oned_as='column')
+        sio.savemat(outputs['node_measures_matlab'], node_measures)
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs['global_measures_matlab'] = op.abspath(self.inputs.out_global_metrics_matlab)
+        outputs['node_measures_matlab'] = op.abspath(self.inputs.out_node_metrics_matlab)
+        return outputs
+
+
 class AverageNetworksInputSpec(BaseInterfaceInputSpec):
     in_files = InputMultiPath(File(exists=True), mandatory=True, desc='Networks for a group of subjects')
     resolution_network_file = File(exists=True, desc='Parcellation files from Connectome Mapping Toolkit. This is not necessary'
                                    ', but if included, the interface will output the statistical maps as networkx graphs.')
     group_id = traits.Str('group1', usedefault=True, desc='ID for group')
+    memmap_stacks = traits.Bool(False, usedefault=True, desc='Store the stacked edge values of all networks as memory-mapped .npy files '
+                                '(<group_id>_stack_<key>.npy) instead of in memory')
     out_gpickled_groupavg = File(desc='Average network saved as a NetworkX .pck')
     out_gexf_groupavg = File(desc='Average network saved as a .gexf file')
 
@@ -544,7 +903,8 @@ class AverageNetworks(BaseInterface):
             ntwk_res_file = self.inputs.in_files[0]
 
         global matlab_network_list
-        network_name, matlab_network_list = average_networks(self.inputs.in_files, ntwk_res_file, self.inputs.group_id)
+        network_name, matlab_network_list = average_networks(self.inputs.in_files, ntwk_res_file, self.inputs.group_id,
+                                                             self.inputs.memmap_stacks)
         return runtime
 
     def _list_outputs(self):
@@ -11,6 +11,8 @@ def test_AverageNetworks_inputs():
     ),
     in_files=dict(mandatory=True,
     ),
+    memmap_stacks=dict(usedefault=True,
+    ),
     out_gexf_groupavg=dict(),
     out_gpickled_groupavg=dict(),
     resolution_network_file=dict(),
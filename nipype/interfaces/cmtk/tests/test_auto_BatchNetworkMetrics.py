@@ -0,0 +1,38 @@
+# AUTO-GENERATED by tools/checkspecs.py - DO NOT EDIT
+from __future__ import unicode_literals
+from ..nx import BatchNetworkMetrics
+
+
+def test_BatchNetworkMetrics_inputs():
+    input_map = dict(compute_clique_related_measures=dict(usedefault=True,
+    ),
+    ignore_exception=dict(nohash=True,
+    usedefault=True,
+    ),
+    in_files=dict(mandatory=True,
+    ),
+    n_procs=dict(usedefault=True,
+    ),
+    out_global_metrics_matlab=dict(usedefault=True,
+    ),
+    out_node_metrics_matlab=dict(usedefault=True,
+    ),
+    strength_edge_key=dict(usedefault=True,
+    ),
+    )
+    inputs = BatchNetworkMetrics.input_spec()
+
+    for key, metadata in list(input_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(inputs.traits()[key], metakey) == value
+
+
+def test_BatchNetworkMetrics_outputs():
+    output_map = dict(global_measures_matlab=dict(),
+    node_measures_matlab=dict(),
+    )
+    outputs = BatchNetworkMetrics.output_spec()
+
+    for key, metadata in list(output_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(outputs.traits()[key], metakey) == value
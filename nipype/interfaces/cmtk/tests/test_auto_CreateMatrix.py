@@ -4,7 +4,9 @@ from ..cmtk import CreateMatrix
 
 
 def test_CreateMatrix_inputs():
-    input_map = dict(count_region_intersections=dict(usedefault=True,
+    input_map = dict(chunk_size=dict(usedefault=True,
+    ),
+    count_region_intersections=dict(usedefault=True,
     ),
     out_endpoint_array_name=dict(genfile=True,
     ),
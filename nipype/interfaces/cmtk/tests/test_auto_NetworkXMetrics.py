@@ -6,6 +6,8 @@ from ..nx import NetworkXMetrics
 def test_NetworkXMetrics_inputs():
     input_map = dict(compute_clique_related_measures=dict(usedefault=True,
     ),
+    engine=dict(usedefault=True,
+    ),
     ignore_exception=dict(nohash=True,
     usedefault=True,
     ),
@@ -25,6 +27,8 @@ def test_NetworkXMetrics_inputs():
     ),
     out_pickled_extra_measures=dict(usedefault=True,
     ),
+    strength_edge_key=dict(usedefault=True,
+    ),
     treat_as_weighted_graph=dict(usedefault=True,
     ),
     )
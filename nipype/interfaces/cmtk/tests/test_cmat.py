@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+from __future__ import division
+
+import numpy as np
+import nibabel as nb
+import networkx as nx
+import scipy.io as sio
+
+from ..cmtk import (cmat, label_streamlines, create_endpoints_array, length,
+                    get_rois_crossed, get_connectivity_matrix)
+
+VOXEL_SIZE = (2., 2., 2.)
+
+
+def _roi_data():
+    roiData = np.zeros((10, 10, 10), dtype=np.int16)
+    roiData[:5, :5] = 1
+    roiData[5:, :5] = 2
+    roiData[:5, 5:] = 3
+    roiData[5:, 5:, 5:] = 4
+    return roiData
+
+
+def _streamlines(n=60, seed=0):
+    rng = np.random.RandomState(seed)
+    streams = []
+    for _ in range(n):
+        steps = rng.randn(rng.randint(1, 15), 3) * 3
+        points = np.clip(rng.rand(3) * 20 + np.cumsum(steps, axis=0), 0, 19.9)
+        streams.append((points.astype(np.float32), None, None))
+    return streams
+
+
+def test_label_streamlines():
+    roiData = _roi_data()
+    streams = _streamlines()
+    endpoints, endpointsmm, endlabels, lengths, crossed, inter = \
+        label_streamlines(streams, roiData, VOXEL_SIZE, 4)
+
+    crossed_lists = []
+    for i, (points, _, _) in enumerate(streams):
+        assert np.allclose(endpointsmm[i], points[[0, -1]])
+        ijk = [[int(p[k] / VOXEL_SIZE[k]) for k in range(3)]
+               for p in points[[0, -1]]]
+        assert np.all(endpoints[i] == ijk)
+        assert endlabels[i].tolist() == [roiData[tuple(p)] for p in ijk]
+        assert np.isclose(lengths[i], length(points))
+        rois = get_rois_crossed(points, roiData, VOXEL_SIZE)
+        assert crossed[i] == (len(rois) > 0)
+        crossed_lists.append(rois)
+    assert np.all(inter == get_connectivity_matrix(4, crossed_lists))
+
+
+def test_label_streamlines_empty():
+    roiData = _roi_data()
+    empty = (np.zeros((0, 3), dtype=np.float32), None, None)
+    streams = _streamlines(6)
+    # empty streamlines at the start, in the middle and at the end
+    streams = [empty] + streams[:3] + [empty, empty] + streams[3:] + [empty]
+    endpoints, endpointsmm, endlabels, lengths, crossed, inter = \
+        label_streamlines(streams, roiData, VOXEL_SIZE, 4)
+    ends, endsmm = create_endpoints_array(streams, VOXEL_SIZE)
+    assert np.all(ends == endpoints)
+    assert np.all(endsmm == endpointsmm)
+
+    crossed_lists = []
+    for i, (points, _, _) in enumerate(streams):
+        if len(points):
+            assert np.allclose(endpointsmm[i], points[[0, -1]])
+        else:
+            assert np.all(endpointsmm[i] == 0)
+            assert np.all(endlabels[i] == 0)
+        assert np.isclose(lengths[i], length(points))
+        rois = get_rois_crossed(points, roiData, VOXEL_SIZE)
+        assert crossed[i] == (len(rois) > 0)
+        crossed_lists.append(rois)
+    assert np.all(inter == get_connectivity_matrix(4, crossed_lists))
+
+    for streams in ([empty], [empty, empty], []):
+        endpoints, _, endlabels, lengths, _, inter = label_streamlines(
+            streams, roiData, VOXEL_SIZE, 4)
+        assert np.all(endpoints == 0) and np.all(endlabels == 0)
+        assert np.all(lengths == 0) and np.all(inter == 0)
+        assert create_endpoints_array(streams, VOXEL_SIZE)[0].shape == \
+            (len(streams), 2, 3)
+
+
+def test_cmat(tmpdir):
+    tmpdir.chdir()
+    roiData = _roi_data()
+    nb.Nifti1Image(roiData, np.diag(VOXEL_SIZE + (1,))).to_filename('roi.nii')
+    streams = _streamlines()
+    hdr = {'voxel_size': VOXEL_SIZE, 'dim': roiData.shape}
+    nb.trackvis.write('fibers.trk', streams, hdr)
+    gp = nx.Graph()
+    for label in range(1, 5):
+        gp.add_node(label, dn_correspondence_id=label)
+    nx.write_gpickle(gp, 'network.pck')
+
+    for chunk_size in (7, 1000):
+        prefix = 'out%d' % chunk_size
+        cmat('fibers.trk', 'roi.nii', 'network.pck', prefix + '.pck',
+             prefix + '.mat', prefix, intersections=True,
+             chunk_size=chunk_size)
+
+        # expected values, fiber by fiber
+        count = np.zeros((4, 4))
+        lengths = {}
+        for points, _, _ in streams:
+            ends = sorted(roiData[tuple((p / VOXEL_SIZE).astype(int))]
+                          for p in points[[0, -1]])
+            if ends[0] > 0 and ends[0] != ends[1]:
+                lengths.setdefault(tuple(ends), []).append(length(points))
+        mean = np.zeros((4, 4))
+        for (u, v), values in lengths.items():
+            count[u - 1, v - 1] = count[v - 1, u - 1] = len(values)
+            mean[u - 1, v - 1] = mean[v - 1, u - 1] = np.mean(values)
+
+        mat = sio.loadmat(prefix + '.mat')['number_of_fibers']
+        assert np.all(mat == count)
+        mat = sio.loadmat(prefix + '_mean_fiber_length.mat')
+        assert np.allclose(mat['mean_fiber_length'], mean)
+        G = nx.read_gpickle(prefix + '.pck')
+        for (u, v), values in lengths.items():
+            assert np.isclose(G.edge[u][v]['fiber_length_median'],
+                              np.median(values))
+            assert np.isclose(G.edge[u][v]['fiber_length_std'],
+                              np.std(values))
+        labels = np.load(prefix + '_filtered_fiberslabel.npy')
+        assert labels.shape == (len(streams), 2)
+        fib, _ = nb.trackvis.read(prefix + '_streamline_final.trk')
+        assert len(fib) == np.sum(labels[:, 0] > 0)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+from __future__ import division
+
+import numpy as np
+import pytest
+import networkx as nx
+import scipy.io as sio
+
+from ..nx import (stack_networks, average_networks, ntwk_to_adjacency,
+                  compute_matrix_node_measures,
+                  compute_matrix_singlevalued_measures, compute_matrix_measures,
+                  BatchNetworkMetrics)
+
+
+def _networks(n_networks=5, n_nodes=8, seed=0):
+    rng = np.random.RandomState(seed)
+    in_files = []
+    for subject in range(n_networks):
+        ntwk = nx.Graph()
+        for node in range(1, n_nodes + 1):
+            ntwk.add_node(node, value=float(rng.rand()))
+        for _ in range(14):
+            u, v = rng.randint(1, n_nodes + 1, 2)
+            if u != v:
+                ntwk.add_edge(int(u), int(v),
+                              number_of_fibers=int(rng.randint(1, 50)),
+                              fiber_length_mean=float(rng.rand() * 100))
+        in_file = 'subj%d.pck' % subject
+        nx.write_gpickle(ntwk, in_file)
+        in_files.append(in_file)
+    return in_files
+
+
+def test_stack_networks(tmpdir):
+    tmpdir.chdir()
+    in_files = _networks()
+    nodelist, edges, edge_stacks, node_stacks = stack_networks(
+        in_files, out_prefix='group')
+    assert isinstance(edges, np.memmap)
+    assert edges.shape == (5, 8, 8)
+    assert set(edge_stacks) == set(['number_of_fibers', 'fiber_length_mean'])
+    for subject, in_file in enumerate(in_files):
+        ntwk = nx.read_gpickle(in_file)
+        matrix = nx.to_numpy_matrix(ntwk, nodelist=nodelist,
+                                    weight='number_of_fibers')
+        stack = edge_stacks['number_of_fibers'][subject]
+        assert np.all(np.isnan(stack) == ~edges[subject])
+        assert np.all(np.nan_to_num(stack) == matrix)
+        assert np.all(node_stacks['value'][subject] ==
+                      [ntwk.node[node]['value'] for node in nodelist])
+
+
+def test_average_networks(tmpdir):
+    tmpdir.chdir()
+    in_files = _networks()
+    ntwks = [nx.read_gpickle(in_file) for in_file in in_files]
+    _, mat_files = average_networks(in_files, in_files[0], 'group')
+    avg = nx.read_gpickle('group_average.pck')
+
+    count = sio.loadmat('group_count_average.mat')['count']
+    for u in range(1, 9):
+        assert np.isclose(avg.node[u]['value'],
+                          np.mean([ntwk.node[u]['value'] for ntwk in ntwks]))
+        for v in range(1, 9):
+            present = [ntwk for ntwk in ntwks if ntwk.has_edge(u, v)]
+            assert count[u - 1, v - 1] == len(present)
+            assert avg.has_edge(u, v) == (len(present) >= 2)  # round(5 / 2)
+            if avg.has_edge(u, v):
+                expected = sum(ntwk.edge[u][v]['number_of_fibers']
+                               for ntwk in present) / len(ntwks)
+                assert np.isclose(avg.edge[u][v]['number_of_fibers'],
+                                  expected)
+                assert avg.edge[u][v]['count'] == len(present)
+    assert len(mat_files) == 3
+
+
+def test_matrix_measures():
+    for seed in range(3):
+        ntwk = nx.relabel_nodes(nx.gnp_random_graph(30, 0.1, seed=seed),
+                                lambda x: x + 1)
+        nodelist, adjacency = ntwk_to_adjacency(ntwk)
+        node_measures = compute_matrix_node_measures(adjacency)
+        for key, func in [('betweenness_centrality', nx.betweenness_centrality),
+                          ('closeness_centrality', nx.closeness_centrality),
+                          ('clustering', nx.clustering),
+                          ('core_number', nx.core_number)]:
+            expected = func(ntwk)
+            assert np.allclose(node_measures[key],
+                               [expected[node] for node in nodelist])
+
+        measures = compute_matrix_singlevalued_measures(adjacency)
+        largest = max(nx.connected_component_subgraphs(ntwk), key=len)
+        assert np.isclose(measures['average_shortest_path_length'],
+                          nx.average_shortest_path_length(largest))
+        assert np.isclose(measures['transitivity'], nx.transitivity(ntwk))
+        assert np.isclose(measures['degree_pearsonr'],
+                          nx.degree_pearson_correlation_coefficient(ntwk))
+        assert (measures['number_connected_components'] ==
+                nx.number_connected_components(ntwk))
+
+
+def test_matrix_measures_zero_weight(tmpdir):
+    tmpdir.chdir()
+    ntwk = nx.Graph()
+    ntwk.add_nodes_from(range(1, 5))
+    ntwk.add_edge(1, 2, number_of_fibers=3, weight=1.)
+    ntwk.add_edge(2, 3, number_of_fibers=0, weight=0.)
+    ntwk.add_edge(3, 4, number_of_fibers=5, weight=2.)
+    nx.write_gpickle(ntwk, 'ntwk.pck')
+
+    global_measures, node_measures = compute_matrix_measures('ntwk.pck')
+    assert global_measures['number_of_edges'] == 3
+    assert global_measures['number_connected_components'] == 1
+    assert node_measures['degree'].tolist() == [1, 2, 2, 1]
+    assert node_measures['strength'].tolist() == [3, 3, 5, 5]
+    _, node_measures = compute_matrix_measures('ntwk.pck',
+                                               strength_key='weight')
+    assert node_measures['strength'].tolist() == [1, 1, 2, 2]
+
+    res = BatchNetworkMetrics(in_files=['ntwk.pck'],
+                              strength_edge_key='weight').run()
+    node_measures = sio.loadmat(res.outputs.node_measures_matlab)
+    assert node_measures['strength'].ravel().tolist() == [1, 1, 2, 2]
+
+
+def test_batch_network_metrics(tmpdir):
+    tmpdir.chdir()
+    in_files = _networks()
+    res = BatchNetworkMetrics(in_files=in_files, n_procs=2).run()
+    global_measures = sio.loadmat(res.outputs.global_measures_matlab)
+    node_measures = sio.loadmat(res.outputs.node_measures_matlab)
+    assert global_measures['number_of_nodes'].ravel().tolist() == [8] * 5
+    assert node_measures['clustering'].shape == (5, 8)
+    for subject, in_file in enumerate(in_files):
+        clustering = nx.clustering(nx.read_gpickle(in_file))
+        assert np.allclose(node_measures['clustering'][subject],
+                           [clustering[node] for node in range(1, 9)])
+
+
+def test_batch_network_metrics_node_order(tmpdir):
+    tmpdir.chdir()
+    edges = [(1, 2), (2, 3), (2, 4)]
+    for name, nodes in [('a.pck', [1, 2, 3, 4]), ('b.pck', [4, 3, 2, 1])]:
+        ntwk = nx.Graph()
+        ntwk.add_nodes_from(nodes)
+        ntwk.add_edges_from(edges, number_of_fibers=1)
+        nx.write_gpickle(ntwk, name)
+    # the node measures are aligned whatever the order of the nodes
+    res = BatchNetworkMetrics(in_files=['a.pck', 'b.pck']).run()
+    node_measures = sio.loadmat(res.outputs.node_measures_matlab)
+    assert node_measures['degree'].tolist() == [[1, 3, 1, 1]] * 2
+
+    ntwk = nx.Graph()
+    ntwk.add_nodes_from([1, 2, 3, 5])
+    ntwk.add_edges_from(edges[:2], number_of_fibers=1)
+    nx.write_gpickle(ntwk, 'c.pck')
+    with pytest.raises(ValueError):
+        BatchNetworkMetrics(in_files=['a.pck', 'c.pck']).run()
@@ -7,9 +7,11 @@
 """
 from __future__ import print_function, division, unicode_literals, absolute_import
 from multiprocessing import (Pool, cpu_count)
+import os
 import os.path as op
 from builtins import range
 
+import numpy as np
 import nibabel as nb
 
 from ... import logging
@@ -39,6 +41,8 @@ class SimulateMultiTensorInputSpec(BaseInterfaceInputSpec):
         desc='Single fiber tensor')
 
     n_proc = traits.Int(0, usedefault=True, desc='number of processes')
+    chunk_size = traits.Int(1000, usedefault=True,
+                            desc='number of voxels simulated by each task')
     baseline = File(exists=True, mandatory=True, desc='baseline T2 signal')
     gradients = File(exists=True, desc='gradients file')
     in_bvec = File(exists=True, desc='input bvecs file')
@@ -173,74 +177,72 @@ class SimulateMultiTensor(DipyBaseInterface):
         nb.Nifti1Image(msk, aff, mhdr).to_filename(
             op.abspath(self.inputs.out_mask))
 
-        # Initialize stack of args
-        fracs = fractions[msk > 0]
+        # Stack fractions and directions as contiguous (voxels x ...) arrays
+        fracs = np.ascontiguousarray(fractions[msk > 0], dtype=np.float64)
 
-        # Stack directions
-        dirs = None
+        dirs = np.zeros((nvox, nsticks + nballs, 3))
         for i in range(nsticks):
             f = self.inputs.in_dirs[i]
-            fd = np.nan_to_num(nb.load(f, mmap=NUMPY_MMAP).get_data())
-            w = np.linalg.norm(fd, axis=3)[..., np.newaxis]
+            fd = np.nan_to_num(nb.load(f, mmap=NUMPY_MMAP).get_data()[msk > 0])
+            w = np.linalg.norm(fd, axis=1)[..., np.newaxis]
             w[w < np.finfo(float).eps] = 1.0
-            fd /= w
-            if dirs is None:
-                dirs = fd[msk > 0].copy()
-            else:
-                dirs = np.hstack((dirs, fd[msk > 0]))
-
-        # Add random directions for isotropic components
-        for d in range(nballs):
-            fd = np.random.randn(nvox, 3)
-            w = np.linalg.norm(fd, axis=1)
-            fd[w < np.finfo(float).eps, ...] = np.array([1., 0., 0.])
-            w[w < np.finfo(float).eps] = 1.0
-            fd /= w[..., np.newaxis]
-            dirs = np.hstack((dirs, fd))
+            dirs[:, i] = fd / w
+        # Directions of isotropic components are irrelevant
+        dirs[:, nsticks:, 0] = 1.0
 
         sf_evals = list(self.inputs.diff_sf)
         ba_evals = list(self.inputs.diff_iso)
 
-        mevals = [sf_evals] * nsticks + \
-            [[ba_evals[d]] * 3 for d in range(nballs)]
-
-        b0 = b0_im.get_data()[msk > 0]
-        args = []
-        for i in range(nvox):
-            args.append(
-                {'fractions': fracs[i, ...].tolist(),
-                 'sticks': [tuple(dirs[i, j:j + 3])
-                            for j in range(nsticks + nballs)],
-                 'gradients': gtab,
-                 'mevals': mevals,
-                 'S0': b0[i],
-                 'snr': self.inputs.snr
-                 })
+        mevals = np.array([sf_evals] * nsticks +
+                          [[ba_evals[d]] * 3 for d in range(nballs)])
+
+        b0 = np.asarray(b0_im.get_data()[msk > 0], dtype=np.float64)
 
         n_proc = self.inputs.n_proc
         if n_proc == 0:
             n_proc = cpu_count()
 
-        try:
-            pool = Pool(processes=n_proc, maxtasksperchild=50)
-        except TypeError:
-            pool = Pool(processes=n_proc)
+        # Simulated signal of the in-mask voxels, written by the workers
+        result_file = op.abspath('sim_signal.dat')
+        result = np.memmap(result_file, dtype=np.float32, mode='w+',
+                           shape=(max(nvox, 1), ndirs))
+        del result
 
-        # Simulate sticks using dipy
-        IFLOGGER.info(('Starting simulation of %d voxels, %d diffusion'
-                       ' directions.') % (len(args), ndirs))
-        result = np.array(pool.map(_compute_voxel, args))
-        if np.shape(result)[1] != ndirs:
-            raise RuntimeError(('Computed directions do not match number'
-                                'of b-values.'))
+        chunk_size = max(1, self.inputs.chunk_size)
+        args = [(start, fracs[start:start + chunk_size],
+                 dirs[start:start + chunk_size], b0[start:start + chunk_size],
+                 gtab.bvals, gtab.bvecs, mevals, self.inputs.snr,
+                 result_file, nvox, np.random.randint(2 ** 31))
+                for start in range(0, nvox, chunk_size)]
 
-        signal = np.zeros((shape[0], shape[1], shape[2], ndirs))
-        signal[msk > 0] = result
+        # Simulate sticks
+        IFLOGGER.info(('Starting simulation of %d voxels, %d diffusion'
+                       ' directions.') % (nvox, ndirs))
+        try:
+            if n_proc > 1 and len(args) > 1:
+                pool = Pool(processes=n_proc)
+                try:
+                    pool.map(_compute_voxels, args)
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                for arg in args:
+                    _compute_voxels(arg)
+
+            result = np.memmap(result_file, dtype=np.float32, mode='r',
+                               shape=(max(nvox, 1), ndirs))
+            signal = np.zeros((shape[0], shape[1], shape[2], ndirs),
+                              dtype=np.float32)
+            signal[msk > 0] = result[:nvox]
+            del result
+        finally:
+            os.remove(result_file)
 
         simhdr = hdr.copy()
         simhdr.set_data_dtype(np.float32)
         simhdr.set_xyzt_units('mm', 'sec')
-        nb.Nifti1Image(signal.astype(np.float32), aff,
+        nb.Nifti1Image(signal, aff,
                        simhdr).to_filename(op.abspath(self.inputs.out_file))
 
         return runtime
@@ -255,10 +257,11 @@ class SimulateMultiTensor(DipyBaseInterface):
         return outputs
 
 
-def _compute_voxel(args):
+def _compute_voxels(args):
     """
-    Simulate DW signal for one voxel. Uses the multi-tensor model and
-    three isotropic compartments.
+    Simulate DW signal for a block of voxels, and write it into the shared
+    (memory-mapped) result array. Uses the multi-tensor model and three
+    isotropic compartments.
 
     Apparent diffusivity tensors are taken from [Alexander2002]_
     and [Pierpaoli1996]_.
@@ -270,27 +273,82 @@ def _compute_voxel(args):
     .. [Pierpaoli1996] Pierpaoli et al., Diffusion tensor MR imaging
       of the human brain, Radiology 201:637-648. 1996.
     """
-    from dipy.sims.voxel import multi_tensor
-
-    ffs = args['fractions']
-    gtab = args['gradients']
-    signal = np.zeros_like(gtab.bvals, dtype=np.float32)
-
-    # Simulate dwi signal
-    sf_vf = np.sum(ffs)
-    if sf_vf > 0.0:
-        ffs = ((np.array(ffs) / sf_vf) * 100)
-        snr = args['snr'] if args['snr'] > 0 else None
-
-        try:
-            signal, _ = multi_tensor(
-                gtab, args['mevals'], S0=args['S0'],
-                angles=args['sticks'], fractions=ffs, snr=snr)
-        except Exception as e:
-            pass
-            # IFLOGGER.warn('Exception simulating dwi signal: %s' % e)
-
-    return signal.tolist()
+    (start, fractions, dirs, S0, bvals, bvecs, mevals, snr,
+     result_file, nvox, seed) = args
+    # blocks run in forked workers must not share the same noise
+    np.random.seed(seed)
+    signal = multi_tensor_signal(bvals, bvecs, fractions, dirs, mevals, S0,
+                                 snr)
+    result = np.memmap(result_file, dtype=np.float32, mode='r+',
+                       shape=(nvox, len(bvals)))
+    result[start:start + len(signal)] = signal
+    result.flush()
+    del result
+
+
+def multi_tensor_signal(bvals, bvecs, fractions, dirs, mevals, S0, snr=0):
+    """
+    Simulates the multi-tensor DW signal of many voxels at once, as dipy's
+    ``multi_tensor`` does for one voxel
+
+    Parameters
+    ----------
+    bvals : (ndirs,) array of b-values
+    bvecs : (ndirs, 3) array of gradient directions
+    fractions : (nvox, ncomp) array of volume fractions, normalized to sum
+        one in each voxel (voxels with no fraction get no signal)
+    dirs : (nvox, ncomp, 3) array of unit principal directions
+    mevals : (ncomp, 3) array of tensor eigenvalues
+    S0 : (nvox,) array of baseline signals
+    snr : signal-to-noise ratio of the Rician noise added (no noise if 0)
+
+    Returns
+    -------
+    signal : (nvox, ndirs) float32 array
+
+    >>> bvals = np.array([0., 1000.])
+    >>> bvecs = np.array([[0., 0., 0.], [1., 0., 0.]])
+    >>> mevals = np.array([[1.7e-3, 2e-4, 2e-4]])
+    >>> signal = multi_tensor_signal(bvals, bvecs, [[1.]], [[[1., 0., 0.]]],
+    ...                              mevals, [100.])
+    >>> np.allclose(signal, [[100., 100. * np.exp(-1.7)]])
+    True
+    """
+    bvals = np.asarray(bvals, dtype=np.float64)
+    bvecs = np.asarray(bvecs, dtype=np.float64)
+    fractions = np.asarray(fractions, dtype=np.float64)
+    dirs = np.asarray(dirs, dtype=np.float64)
+    mevals = np.asarray(mevals, dtype=np.float64)
+    S0 = np.asarray(S0, dtype=np.float64)
+
+    total = fractions.sum(axis=1)
+    valid = total > 0.0
+    weights = fractions[valid] / total[valid, np.newaxis]
+    gnorm2 = (bvecs ** 2).sum(axis=1)
+
+    signal = np.zeros((len(fractions), len(bvals)))
+    attenuation = np.zeros((valid.sum(), len(bvals)))
+    for k, evals in enumerate(mevals):
+        if evals[1] == evals[2]:
+            # axially symmetric tensor: g'Dg = l2 |g|^2 + (l1 - l2) (g.e)^2
+            proj = np.dot(dirs[valid, k], bvecs.T)
+            adc = evals[1] * gnorm2 + (evals[0] - evals[1]) * proj ** 2
+            attenuation += weights[:, k, np.newaxis] * np.exp(-bvals * adc)
+        else:
+            from dipy.sims.voxel import single_tensor, all_tensor_evecs
+            from dipy.core.gradients import gradient_table
+            gtab = gradient_table(bvals, bvecs)
+            for i, stick in enumerate(dirs[valid, k]):
+                attenuation[i] += weights[i, k] * single_tensor(
+                    gtab, S0=1., evals=evals, evecs=all_tensor_evecs(stick))
+    signal[valid] = S0[valid, np.newaxis] * attenuation
+
+    if snr > 0:
+        sigma = S0[valid, np.newaxis] / snr
+        noise1 = np.random.normal(0, 1, attenuation.shape) * sigma
+        noise2 = np.random.normal(0, 1, attenuation.shape) * sigma
+        signal[valid] = np.sqrt((signal[valid] + noise1) ** 2 + noise2 ** 2)
+    return signal.astype(np.float32)
 
 
 def _generate_gradients(ndirs=64, values=[1000, 3000], nb0s=1):
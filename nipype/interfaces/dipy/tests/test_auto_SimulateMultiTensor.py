@@ -8,6 +8,8 @@ def test_SimulateMultiTensor_inputs():
     ),
     bvalues=dict(usedefault=True,
     ),
+    chunk_size=dict(usedefault=True,
+    ),
     diff_iso=dict(usedefault=True,
     ),
     diff_sf=dict(usedefault=True,
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from nipype.interfaces.dipy.simulate import (multi_tensor_signal,
+                                             _compute_voxels)
+
+
+def _tensor_signal(bvals, bvecs, fractions, dirs, mevals, S0):
+    signal = np.zeros(len(bvals))
+    for fraction, stick, evals in zip(fractions, dirs, mevals):
+        # tensor with principal direction stick and axial symmetry
+        D = evals[1] * np.eye(3) + (evals[0] - evals[1]) * np.outer(stick, stick)
+        adc = np.einsum('ij,jk,ik->i', bvecs, D, bvecs)
+        signal += fraction / np.sum(fractions) * S0 * np.exp(-bvals * adc)
+    return signal
+
+
+def test_multi_tensor_signal(tmpdir):
+    rng = np.random.RandomState(0)
+    bvecs = rng.randn(20, 3)
+    bvecs /= np.linalg.norm(bvecs, axis=1)[:, np.newaxis]
+    bvecs[0] = 0
+    bvals = np.r_[0, [1000] * 10, [3000] * 9]
+    mevals = np.array([[1.7e-3, 2e-4, 2e-4], [1.7e-3, 2e-4, 2e-4],
+                       [3e-3] * 3, [9.6e-4] * 3])
+    fractions = rng.rand(30, 4)
+    fractions[3] = 0
+    dirs = rng.randn(30, 4, 3)
+    dirs /= np.linalg.norm(dirs, axis=2)[..., np.newaxis]
+    S0 = rng.rand(30) * 100
+
+    signal = multi_tensor_signal(bvals, bvecs, fractions, dirs, mevals, S0)
+    assert signal.dtype == np.float32
+    for i in range(30):
+        if i == 3:
+            assert np.all(signal[i] == 0)
+            continue
+        assert np.allclose(signal[i],
+                           _tensor_signal(bvals, bvecs, fractions[i], dirs[i],
+                                          mevals, S0[i]), rtol=1e-5)
+
+    result_file = tmpdir.join('result.dat').strpath
+    np.memmap(result_file, dtype=np.float32, mode='w+', shape=(30, 20))
+    for start in (0, 16):
+        sl = slice(start, start + 16)
+        _compute_voxels((start, fractions[sl], dirs[sl], S0[sl], bvals,
+                         bvecs, mevals, 0, result_file, 30, 0))
+    result = np.memmap(result_file, dtype=np.float32, mode='r', shape=(30, 20))
+    assert np.all(result == signal)
@@ -14,6 +14,7 @@ import nibabel as nb
 import nibabel.trackvis as nbt
 
 from ... import logging
+from ...utils.tracks import iter_track_points, read_track_header, write_tracks
 from ..base import (TraitedSpec, BaseInterfaceInputSpec,
                     File, isdefined, traits)
 from .base import DipyBaseInterface
@@ -62,8 +63,8 @@ class TrackDensityMap(DipyBaseInterface):
         from numpy import min_scalar_type
         from dipy.tracking.utils import density_map
 
-        tracks, header = nbt.read(self.inputs.in_file)
-        streams = ((ii[0]) for ii in tracks)
+        header = read_track_header(self.inputs.in_file)
+        streams = iter_track_points(self.inputs.in_file)
 
         if isdefined(self.inputs.reference):
             refnii = nb.load(self.inputs.reference)
@@ -267,11 +268,11 @@ class StreamlineTractography(DipyBaseInterface):
                   odf_vertices=sphere.vertices,
                   a_low=a_low)
 
-        ss_mm = [np.array(s) for s in eu]
-
-        trkfilev = nb.trackvis.TrackvisFile(
-            [(s, None, None) for s in ss_mm], points_space='rasmm', affine=np.eye(4))
-        trkfilev.to_file(self._gen_filename('tracked', ext='.trk'))
+        trk_header = nbt.empty_header()
+        nbt.aff_to_hdr(np.eye(4), trk_header, pos_vox=True, set_order=True)
+        write_tracks(self._gen_filename('tracked', ext='.trk'),
+                     ((np.asarray(s), None, None) for s in eu),
+                     trk_header, points_space='rasmm')
         return runtime
 
     def _list_outputs(self):
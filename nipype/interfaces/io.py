@@ -23,6 +23,7 @@ from builtins import object, zip, filter, range, open, str
 
 import glob
 import fnmatch
+import numbers
 import string
 import os
 import os.path as op
@@ -35,7 +36,8 @@ from warnings import warn
 import sqlite3
 
 from .. import config, logging
-from ..utils.filemanip import copyfile, list_to_filename, filename_to_list
+from ..utils.filemanip import (list_to_filename, filename_to_list,
+                               get_related_files, reflink)
 from ..utils.misc import human_order_sorted, str2bool
 from .base import (
     TraitedSpec, traits, Str, File, Directory, BaseInterface, InputMultiPath,
@@ -59,40 +61,49 @@ except:
 
 iflogger = logging.getLogger('interface')
 
-def copytree(src, dst, use_hardlink=False):
-    """Recursively copy a directory tree using
-    nipype.utils.filemanip.copyfile()
+def sinkfile(src, dst, use_hardlink=False, copy_related_files=True):
+    """Copy ``src`` to ``dst`` (and its related files), as fast as possible
 
-    This is not a thread-safe routine. However, in the case of creating new
-    directories, it checks to see if a particular directory has already been
-    created by another process.
+    A destination with the same size and modification time as the source is
+    considered unchanged and kept. Otherwise the file is cloned with a
+    reflink, hard-linked (if ``use_hardlink``) or copied, whichever works
+    first. Copies keep the source modification time so that the next run
+    can recognize them.
+
+    Returns the number of bytes that were copied.
     """
-    names = os.listdir(src)
-    try:
-        os.makedirs(dst)
-    except OSError as why:
-        if 'File exists' in why:
+    copied = 0
+    pairs = [(src, dst)]
+    if copy_related_files:
+        pairs = list(zip(get_related_files(src), get_related_files(dst)))
+    for srcname, dstname in pairs:
+        if srcname != src and not os.path.exists(srcname):
+            continue
+        srcstat = os.stat(srcname)
+        if os.path.lexists(dstname):
+            if not os.path.islink(dstname):
+                dststat = os.stat(dstname)
+                if (dststat.st_size == srcstat.st_size and
+                        dststat.st_mtime == srcstat.st_mtime):
+                    continue
+            os.unlink(dstname)
+        try:
+            reflink(srcname, dstname)
+        except OSError:
             pass
         else:
-            raise why
-    errors = []
-    for name in names:
-        srcname = os.path.join(src, name)
-        dstname = os.path.join(dst, name)
-        try:
-            if os.path.isdir(srcname):
-                copytree(srcname, dstname, use_hardlink)
+            shutil.copystat(srcname, dstname)
+            continue
+        if use_hardlink:
+            try:
+                os.link(os.path.realpath(srcname), dstname)
+            except OSError:
+                pass
             else:
-                copyfile(srcname, dstname, True, hashmethod='content',
-                         use_hardlink=use_hardlink)
-        except (IOError, os.error) as why:
-            errors.append((srcname, dstname, str(why)))
-        # catch the Error from the recursive copytree so that we can
-        # continue with other files
-        except Exception as err:
-            errors.extend(err.args[0])
-    if errors:
-        raise Exception(errors)
+                continue
+        shutil.copy2(srcname, dstname)
+        copied += srcstat.st_size
+    return copied
 
 
 def add_traits(base, names, trait_type=None):
@@ -196,6 +207,8 @@ class DataSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     _outputs = traits.Dict(Str, value={}, usedefault=True)
     remove_dest_dir = traits.Bool(False, usedefault=True,
                                   desc='remove dest directory when copying dirs')
+    num_threads = traits.Int(1, usedefault=True,
+                             desc='number of threads copying files in parallel')
 
     # AWS S3 data attributes
     creds_path = Str(desc='Filepath to AWS credentials file for S3 bucket '\
@@ -268,6 +281,13 @@ class DataSink(IOBase):
             This interface **cannot** be used in a MapNode as the inputs are
             defined only when the connect statement is executed.
 
+        All copies are planned before any file is written and run by
+        ``num_threads`` threads. Each file is cloned with a reflink when the
+        file system allows it, else hard-linked (see the
+        ``try_hard_link_datasink`` configuration option) or copied.
+        Destination files with the same size and modification time as their
+        source are considered up to date and left untouched.
+
         Examples
         --------
 
@@ -628,6 +648,60 @@ class DataSink(IOBase):
             bucket.upload_file(src_f, dst_k, ExtraArgs=extra_args,
                                Callback=ProgressPercentage(src_f))
 
+    # Plan the copy of a directory tree, creating its directories
+    def _plan_copydir(self, src, dst):
+        plan = []
+        for root, dirs, files in os.walk(src):
+            dstroot = os.path.join(dst, os.path.relpath(root, src))
+            if not os.path.isdir(dstroot):
+                try:
+                    os.makedirs(dstroot)
+                except OSError:
+                    if not os.path.isdir(dstroot):
+                        raise
+            plan.extend([(os.path.join(root, name),
+                          os.path.normpath(os.path.join(dstroot, name)),
+                          False, False) for name in files])
+        return plan
+
+    # Copy all planned files, in parallel if num_threads > 1
+    def _copy_files(self, copy_plan):
+        import time
+
+        # the same destination may be planned for several inputs
+        plan = []
+        seen = set()
+        for item in copy_plan:
+            if item[1] not in seen:
+                seen.add(item[1])
+                plan.append(item)
+        if not plan:
+            return
+
+        def _copy(item):
+            src, dst, use_hardlink, copy_related = item
+            iflogger.debug('copyfile: %s %s' % (src, dst))
+            return sinkfile(src, dst, use_hardlink=use_hardlink,
+                            copy_related_files=copy_related)
+
+        start = time.time()
+        nthreads = min(self.inputs.num_threads, len(plan))
+        if nthreads > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(nthreads)
+            try:
+                copied = pool.map(_copy, plan)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            copied = [_copy(item) for item in plan]
+        elapsed = max(time.time() - start, 1e-6)
+        mbytes = sum(copied) / 1e6
+        iflogger.info('DataSink: sinked %d files, copied %.1f MB in %.2f s '
+                      '(%.1f MB/s)' % (len(plan), mbytes, elapsed,
+                                        mbytes / elapsed))
+
     # List outputs, main run routine
     def _list_outputs(self):
         """Execute this module.
@@ -637,6 +711,8 @@ class DataSink(IOBase):
         iflogger = logging.getLogger('interface')
         outputs = self.output_spec().get()
         out_files = []
+        # (src, dst, use_hardlink, copy_related_files) of files to copy
+        copy_plan = []
         # Use hardlink
         use_hardlink = str2bool(config.get('execution', 'try_hard_link_datasink'))
 
@@ -744,19 +820,18 @@ class DataSink(IOBase):
                                 raise(inst)
                     # If src is a file, copy it to dst
                     if os.path.isfile(src):
-                        iflogger.debug('copyfile: %s %s' % (src, dst))
-                        copyfile(src, dst, copy=True, hashmethod='content',
-                                 use_hardlink=use_hardlink)
+                        copy_plan.append((src, dst, use_hardlink, True))
                         out_files.append(dst)
                     # If src is a directory, copy entire contents to dst dir
                     elif os.path.isdir(src):
                         if os.path.exists(dst) and self.inputs.remove_dest_dir:
                             iflogger.debug('removing: %s' % dst)
                             shutil.rmtree(dst)
-                        iflogger.debug('copydir: %s %s' % (src, dst))
-                        copytree(src, dst)
+                        copy_plan.extend(self._plan_copydir(src, dst))
                         out_files.append(dst)
 
+        self._copy_files(copy_plan)
+
         # Return outputs dictionary
         outputs['out_file'] = out_files
 
@@ -2082,9 +2157,68 @@ def push_provenance():
     pass
 
 
+def _sql_rows(inputs, names, batch=False):
+    """Collect the values of ``names`` from ``inputs`` as a list of rows
+
+    In batch mode every list (or tuple) input holds one value per row and
+    all of them must have the same length; other inputs are constants
+    repeated on every row. Otherwise a single row is returned.
+    """
+    values = [getattr(inputs, name) for name in names]
+    if not batch:
+        return [tuple(values)]
+    lengths = [(name, len(value)) for name, value in zip(names, values)
+               if isinstance(value, (list, tuple))]
+    nrows = set([length for _, length in lengths])
+    if len(nrows) > 1:
+        raise ValueError('All list inputs must have the same number of '
+                         'values in batch mode, got lengths: %s' %
+                         ', '.join(['%s=%d' % item for item in lengths]))
+    nrows = nrows.pop() if nrows else 1
+    values = [value if isinstance(value, (list, tuple)) else [value] * nrows
+              for value in values]
+    return list(zip(*values))
+
+
+def _sql_column_type(value):
+    """Guess a SQL column type for ``value``"""
+    if isinstance(value, numbers.Integral):
+        return 'INTEGER'
+    if isinstance(value, numbers.Real):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _sql_create_table(table_name, names, row, text_type='TEXT'):
+    """Statement creating ``table_name`` with one column per input name,
+    typed after the values in ``row``"""
+    columns = []
+    for name, value in zip(names, row):
+        coltype = _sql_column_type(value)
+        if coltype == 'TEXT':
+            coltype = text_type
+        columns.append('%s %s' % (name, coltype))
+    return 'CREATE TABLE IF NOT EXISTS %s (%s)' % (table_name,
+                                                   ', '.join(columns))
+
+
 class SQLiteSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     database_file = File(exists=True, mandatory=True)
     table_name = Str(mandatory=True)
+    batch = traits.Bool(False, usedefault=True,
+                        desc=('each list input holds one value per row, and '
+                              'other inputs are repeated on every row; all '
+                              'rows are written in a single transaction'))
+    create_table = traits.Bool(False, usedefault=True,
+                               desc=('create the table from the input names '
+                                     'if it does not exist'))
+    journal_mode = traits.Enum('delete', 'wal', usedefault=True,
+                               desc=('SQLite journal mode, use wal to let '
+                                     'concurrent writers and readers proceed '
+                                     'without blocking each other'))
+    timeout = traits.Float(30.0, usedefault=True,
+                           desc=('seconds to wait for the database lock '
+                                 'held by another writer'))
 
 
 class SQLiteSink(IOBase):
@@ -2095,6 +2229,11 @@ class SQLiteSink(IOBase):
             This is not a thread-safe node because it can write to a common
             shared location. It will not complain when it overwrites a file.
 
+        Rows are written inside one ``BEGIN IMMEDIATE`` transaction that
+        waits up to ``timeout`` seconds for other writers. Setting
+        ``journal_mode`` to ``'wal'`` lets concurrent nodes write without
+        blocking readers.
+
         Examples
         --------
 
@@ -2105,6 +2244,21 @@ class SQLiteSink(IOBase):
         >>> sql.inputs.some_measurement = 11.4
         >>> sql.run() # doctest: +SKIP
 
+        In batch mode each list input holds one value per row, and other
+        inputs are repeated on every row. Used as a
+        :class:`~nipype.pipeline.engine.JoinNode`, it funnels the writes of
+        all iterations through a single node and a single transaction.
+
+        >>> sql = SQLiteSink(input_names=['subject_id', 'some_measurement'])
+        >>> sql.inputs.database_file = 'my_database.db'
+        >>> sql.inputs.table_name = 'experiment_results'
+        >>> sql.inputs.batch = True
+        >>> sql.inputs.create_table = True
+        >>> sql.inputs.journal_mode = 'wal'
+        >>> sql.inputs.subject_id = ['s1', 's2']
+        >>> sql.inputs.some_measurement = [11.4, 12.1]
+        >>> sql.run() # doctest: +SKIP
+
     """
     input_spec = SQLiteSinkInputSpec
 
@@ -2118,15 +2272,39 @@ class SQLiteSink(IOBase):
     def _list_outputs(self):
         """Execute this module.
         """
+        rows = _sql_rows(self.inputs, self._input_names, self.inputs.batch)
+        if not rows:
+            return None
+        # autocommit mode, transactions are handled explicitly below
         conn = sqlite3.connect(self.inputs.database_file,
+                               timeout=self.inputs.timeout,
+                               isolation_level=None,
                                check_same_thread=False)
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO %s (" % self.inputs.table_name +
-                  ",".join(self._input_names) + ") VALUES (" +
-                  ",".join(["?"] * len(self._input_names)) + ")",
-                  [getattr(self.inputs, name) for name in self._input_names])
-        conn.commit()
-        c.close()
+        try:
+            c = conn.cursor()
+            c.execute("PRAGMA busy_timeout = %d" %
+                      int(self.inputs.timeout * 1000))
+            if self.inputs.journal_mode == 'wal':
+                c.execute("PRAGMA journal_mode = WAL")
+            # take the write lock up front so that concurrent writers queue
+            # on busy_timeout instead of failing on lock upgrade
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                if self.inputs.create_table:
+                    c.execute(_sql_create_table(self.inputs.table_name,
+                                                self._input_names, rows[0]))
+                c.executemany("INSERT OR REPLACE INTO %s (" %
+                              self.inputs.table_name +
+                              ",".join(self._input_names) + ") VALUES (" +
+                              ",".join(["?"] * len(self._input_names)) + ")",
+                              rows)
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+            c.execute("COMMIT")
+            c.close()
+        finally:
+            conn.close()
         return None
 
 
@@ -2141,6 +2319,13 @@ class MySQLSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     table_name = Str(mandatory=True)
     username = Str()
     password = Str()
+    batch = traits.Bool(False, usedefault=True,
+                        desc=('each list input holds one value per row, and '
+                              'other inputs are repeated on every row; all '
+                              'rows are written in a single transaction'))
+    create_table = traits.Bool(False, usedefault=True,
+                               desc=('create the table from the input names '
+                                     'if it does not exist'))
 
 
 class MySQLSink(IOBase):
@@ -2172,6 +2357,9 @@ class MySQLSink(IOBase):
         """Execute this module.
         """
         import MySQLdb
+        rows = _sql_rows(self.inputs, self._input_names, self.inputs.batch)
+        if not rows:
+            return None
         if isdefined(self.inputs.config):
             conn = MySQLdb.connect(db=self.inputs.database_name,
                                    read_default_file=self.inputs.config)
@@ -2180,13 +2368,23 @@ class MySQLSink(IOBase):
                                    user=self.inputs.username,
                                    passwd=self.inputs.password,
                                    db=self.inputs.database_name)
-        c = conn.cursor()
-        c.execute("REPLACE INTO %s (" % self.inputs.table_name +
-                  ",".join(self._input_names) + ") VALUES (" +
-                  ",".join(["%s"] * len(self._input_names)) + ")",
-                  [getattr(self.inputs, name) for name in self._input_names])
-        conn.commit()
-        c.close()
+        try:
+            c = conn.cursor()
+            if self.inputs.create_table:
+                c.execute(_sql_create_table(self.inputs.table_name,
+                                            self._input_names, rows[0],
+                                            text_type='VARCHAR(255)'))
+            c.executemany("REPLACE INTO %s (" % self.inputs.table_name +
+                          ",".join(self._input_names) + ") VALUES (" +
+                          ",".join(["%s"] * len(self._input_names)) + ")",
+                          rows)
+            conn.commit()
+            c.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         return None
 
 
@@ -17,8 +17,10 @@ import os
 
 import numpy as np
 import nibabel as nb
+from scipy import sparse, signal
 
 from .. import logging
+from ..utils import NUMPY_MMAP
 from ..interfaces.base import (traits, TraitedSpec, BaseInterface,
                                BaseInterfaceInputSpec, File, InputMultiPath)
 IFLOG = logging.getLogger('interface')
@@ -50,7 +52,10 @@ class SignalExtractionInputSpec(BaseInterfaceInputSpec):
                                  desc='If True, include an extra column '
                                  'labeled "GlobalSignal", with values calculated from the entire brain '
                                  '(instead of just regions).')
-    detrend = traits.Bool(False, usedefault=True, desc='If True, perform detrending using nilearn.')
+    detrend = traits.Bool(False, usedefault=True, desc='If True, remove the linear trend of the signals.')
+    chunk_size = traits.Int(100, usedefault=True,
+                            desc='Number of volumes of in_file read and '
+                            'processed at once')
 
 class SignalExtractionOutputSpec(TraitedSpec):
     out_file = File(exists=True, desc='tsv file containing the computed '
@@ -76,40 +81,61 @@ class SignalExtraction(BaseInterface):
     _results = {}
 
     def _run_interface(self, runtime):
-        maskers = self._process_inputs()
-
-        signals = []
-        for masker in maskers:
-            signals.append(masker.fit_transform(self.inputs.in_file))
-        region_signals = np.hstack(signals)
-
-        output = np.vstack((self.inputs.class_labels, region_signals.astype(str)))
+        img = nb.load(self.inputs.in_file, mmap=NUMPY_MMAP)
+        weights, class_labels = self._process_inputs(img)
+
+        # only the voxels in a region are needed for the signals
+        voxels = np.flatnonzero(np.diff(weights.indptr))
+        weights = weights[voxels].T.tocsr()
+        n_volumes = img.shape[3]
+        region_signals = np.zeros((n_volumes, weights.shape[0]))
+        chunk_size = max(self.inputs.chunk_size, 1)
+        for start in range(0, n_volumes, chunk_size):
+            stop = min(start + chunk_size, n_volumes)
+            # read one slab of volumes, flattened in the (Fortran) order of
+            # the voxels of the weight matrix
+            data = np.asarray(img.dataobj[..., start:stop])
+            data = data.reshape((-1, stop - start), order='F')[voxels]
+            region_signals[start:stop] = weights.dot(data).T
+
+        if self.inputs.detrend:
+            region_signals = signal.detrend(region_signals, axis=0)
+
+        output = np.vstack((class_labels, region_signals.astype(str)))
 
         # save output
         self._results['out_file'] = os.path.abspath(self.inputs.out_file)
         np.savetxt(self._results['out_file'], output, fmt=b'%s', delimiter='\t')
         return runtime
 
-    def _process_inputs(self):
+    def _process_inputs(self, img):
         ''' validate and  process inputs into useful form.
-        Returns a list of nilearn maskers and the list of corresponding label names.'''
-        import nilearn.input_data as nl
-        import nilearn.image as nli
-
-        label_data = nli.concat_imgs(self.inputs.label_files)
-        maskers = []
-
-        # determine form of label files, choose appropriate nilearn masker
-        if np.amax(label_data.get_data()) > 1: # 3d label file
-            n_labels = np.amax(label_data.get_data())
-            maskers.append(nl.NiftiLabelsMasker(label_data))
+        Returns a sparse (voxels x regions) matrix of weights, such that the
+        signals of the regions are the products of the volumes of in_file
+        with it, and the list of corresponding label names.'''
+        label_data = [nb.load(label_file) for label_file in self.inputs.label_files]
+        label_data = nb.Nifti1Image(
+            np.concatenate([np.asarray(label.get_data()).reshape(label.shape[:3] + (-1,))
+                            for label in label_data], axis=3),
+            label_data[0].affine)
+        labels = label_data.get_data()
+        is_3d = np.amax(labels) > 1
+
+        if (label_data.shape[:3] != img.shape[:3] or
+                not np.allclose(label_data.affine, img.affine)):
+            import nilearn.image as nli
+            # resample the labels to the data, as the nilearn maskers do
+            label_data = nli.resample_to_img(
+                label_data, img, interpolation='nearest' if is_3d else 'continuous')
+            labels = label_data.get_data()
+        # voxels are flattened in the order of the data on disk
+        labels = labels.reshape((-1, labels.shape[3]), order='F')
+
+        # determine form of label files, and the matching weights
+        if is_3d: # 3d label file
+            n_labels = np.amax(labels)
         else: # 4d labels
-            n_labels = label_data.get_data().shape[3]
-            if self.inputs.incl_shared_variance: # 4d labels, independent computation
-                for img in nli.iter_img(label_data):
-                    maskers.append(nl.NiftiMapsMasker(self._4d(img.get_data(), img.affine)))
-            else: # 4d labels, one computation fitting all
-                maskers.append(nl.NiftiMapsMasker(label_data))
+            n_labels = labels.shape[1]
 
         # check label list size
         if not np.isclose(int(n_labels), n_labels):
@@ -123,23 +149,44 @@ class SignalExtraction(BaseInterface):
                                                      n_labels,
                                                      self.inputs.label_files))
 
+        class_labels = list(self.inputs.class_labels)
+        n_voxels = labels.shape[0]
+        global_label_data = labels.sum(axis=1) # sum across all regions
+        global_label_data = np.rint(global_label_data).astype(int).clip(0, 1) # binarize
+
+        if is_3d: # average over the voxels of each label
+            labels = labels[:, 0]
+            voxels = np.flatnonzero(labels > 0)
+            weights = self._mean_weights(voxels, np.rint(labels[voxels]).astype(int) - 1,
+                                         n_voxels, int(n_labels))
+        elif self.inputs.incl_shared_variance: # 4d labels, independent fits
+            weights = sparse.csr_matrix(labels)
+            norms = np.asarray(weights.multiply(weights).sum(axis=0)).ravel()
+            norms[norms == 0] = 1
+            weights = weights.dot(sparse.diags(1. / norms))
+        else: # 4d labels, one least-squares fit of all the maps
+            voxels = np.flatnonzero(np.any(labels != 0, axis=1))
+            fit = np.linalg.pinv(labels[voxels]).T
+            weights = sparse.csr_matrix(
+                (fit.ravel(), (np.repeat(voxels, fit.shape[1]),
+                               np.tile(np.arange(fit.shape[1]), len(voxels)))),
+                shape=labels.shape)
+
         if self.inputs.include_global:
-            global_label_data = label_data.get_data().sum(axis=3) # sum across all regions
-            global_label_data = np.rint(global_label_data).astype(int).clip(0, 1) # binarize
-            global_label_data = self._4d(global_label_data, label_data.affine)
-            global_masker = nl.NiftiLabelsMasker(global_label_data, detrend=self.inputs.detrend)
-            maskers.insert(0, global_masker)
-            self.inputs.class_labels.insert(0, 'GlobalSignal')
-
-        for masker in maskers:
-            masker.set_params(detrend=self.inputs.detrend)
-
-        return maskers
-
-    def _4d(self, array, affine):
-        ''' takes a 3-dimensional numpy array and an affine,
-        returns the equivalent 4th dimensional nifti file '''
-        return nb.Nifti1Image(array[:, :, :, np.newaxis], affine)
+            voxels = np.flatnonzero(global_label_data)
+            weights = sparse.hstack((self._mean_weights(voxels, np.zeros(len(voxels), dtype=int),
+                                                        n_voxels, 1),
+                                     weights))
+            class_labels.insert(0, 'GlobalSignal')
+
+        return weights.tocsr(), class_labels
+
+    def _mean_weights(self, voxels, regions, n_voxels, n_regions):
+        ''' sparse (voxels x regions) matrix averaging the given voxels of
+        each region '''
+        counts = np.bincount(regions, minlength=n_regions).astype(float)
+        return sparse.csr_matrix((1. / counts[regions], (voxels, regions)),
+                                 shape=(n_voxels, n_regions))
 
     def _list_outputs(self):
         return self._results
@@ -9,12 +9,15 @@ Interfaces to functionality from nitime for time-series analysis of fmri data
 - nitime.fmri.io:
 - nitime.viz.drawmatrix_channels
 
+Stacks of time series of many subjects are analyzed with a vectorized
+implementation of the same Welch estimate, which does not require nitime.
+
 """
 from __future__ import print_function, division, unicode_literals, absolute_import
-from builtins import zip, object, open
+from builtins import zip, object, open, range
 
+import os
 import numpy as np
-import tempfile
 
 from ...utils.misc import package_check
 from ...utils.filemanip import fname_presuffix
@@ -49,6 +52,19 @@ class CoherenceAnalyzerInputSpec(BaseInterfaceInputSpec):
 
     in_TS = traits.Any(desc='a nitime TimeSeries object')
 
+    in_array = File(desc=('a .npy file with the ROI time series of many '
+                          'subjects, with shape (subjects, ROIs, time-points), '
+                          'or a .npz file with this array as "data" and '
+                          'optionally the ROI names as "roi_names". The '
+                          'coherence and time-delay of all subjects are '
+                          'written to .npy stacks of shape '
+                          '(subjects, ROIs, ROIs)'),
+                    exists=True, xor=['in_file', 'in_TS'],
+                    requires=('TR',))
+    chunk_size = traits.Int(100, usedefault=True,
+                            desc=('Number of subjects of <in_array> '
+                                  'analyzed at once'))
+
     NFFT = traits.Range(low=32, value=64, usedefault=True,
                         desc=('This is the size of the window used for '
                               'the spectral estimation. Use values between '
@@ -92,6 +108,11 @@ class CoherenceAnalyzerOutputSpec(TraitedSpec):
     coherence_fig = File(desc=('Figure representing coherence values'))
     timedelay_fig = File(desc=('Figure representing coherence values'))
 
+    coherence_stack = File(desc=('A .npy file with the pairwise coherence '
+                                 'values of all the subjects of <in_array>'))
+    timedelay_stack = File(desc=('A .npy file with the pairwise time delays '
+                                 'of all the subjects of <in_array>'))
+
 
 class CoherenceAnalyzer(BaseInterface):
 
@@ -109,14 +130,15 @@ class CoherenceAnalyzer(BaseInterface):
         (TRs) will becomes the second (and last) dimension of the array
 
         """
-        # Check that input conforms to expectations:
-        first_row = open(self.inputs.in_file).readline()
-        if not first_row[1].isalpha():
-            raise ValueError("First row of in_file should contain ROI names as strings of characters")
+        with open(self.inputs.in_file) as fp:
+            # Check that input conforms to expectations:
+            first_row = fp.readline()
+            if not first_row[1].isalpha():
+                raise ValueError("First row of in_file should contain ROI names as strings of characters")
 
-        roi_names = open(self.inputs.in_file).readline().replace('\"', '').strip('\n').split(',')
-        # Transpose, so that the time is the last dimension:
-        data = np.loadtxt(self.inputs.in_file, skiprows=1, delimiter=',').T
+            roi_names = first_row.replace('\"', '').strip('\n').split(',')
+            # Transpose, so that the time is the last dimension:
+            data = np.loadtxt(fp, delimiter=',').T
 
         return data, roi_names
 
@@ -132,8 +154,48 @@ class CoherenceAnalyzer(BaseInterface):
 
         return TS
 
+    def _stack_files(self):
+        return [fname_presuffix(self.inputs.in_array, suffix='_%s' % name,
+                                newpath=os.getcwd(), use_ext=False) + '.npy'
+                for name in ('coherence', 'delay')]
+
+    def _run_batch(self):
+        """Analyze all the subjects of in_array, chunk_size at a time"""
+        data = np.load(self.inputs.in_array, mmap_mode='r')
+        if isinstance(data, np.lib.npyio.NpzFile):
+            npz = data
+            data = npz['data']
+            if 'roi_names' in npz.files:
+                self.ROIs = [str(name) for name in npz['roi_names']]
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        n_subjects, n_rois = data.shape[:2]
+        if not hasattr(self, 'ROIs'):
+            self.ROIs = ['roi_%d' % x for x in range(n_rois)]
+
+        stacks = [np.lib.format.open_memmap(
+            fname, mode='w+', dtype=np.float64,
+            shape=(n_subjects, n_rois, n_rois))
+            for fname in self._stack_files()]
+        chunk_size = max(self.inputs.chunk_size, 1)
+        for start in range(0, n_subjects, chunk_size):
+            stop = min(start + chunk_size, n_subjects)
+            coherence, delay = welch_coherence(
+                np.asarray(data[start:stop], dtype=np.float64),
+                1. / self.inputs.TR, self.inputs.NFFT,
+                self.inputs.n_overlap, self.inputs.frequency_range)
+            stacks[0][start:stop] = coherence
+            stacks[1][start:stop] = delay
+        for stack in stacks:
+            stack.flush()
+        del stacks
+
     # Rewrite _run_interface, but not run
     def _run_interface(self, runtime):
+        if isdefined(self.inputs.in_array):
+            self._run_batch()
+            return runtime
+
         lb, ub = self.inputs.frequency_range
 
         if self.inputs.in_TS is Undefined:
@@ -169,6 +231,11 @@ class CoherenceAnalyzer(BaseInterface):
     def _list_outputs(self):
         outputs = self.output_spec().get()
 
+        if isdefined(self.inputs.in_array):
+            outputs['coherence_stack'], outputs['timedelay_stack'] = \
+                self._stack_files()
+            return outputs
+
         # if isdefined(self.inputs.output_csv_file):
 
         # write to a csv file and assign a value to self.coherence_file (a
@@ -201,17 +268,14 @@ class CoherenceAnalyzer(BaseInterface):
         Generate the output csv files.
         """
         for this in zip([self.coherence, self.delay], ['coherence', 'delay']):
-            tmp_f = tempfile.mkstemp()[1]
-            np.savetxt(tmp_f, this[0], delimiter=',')
-
-            fid = open(fname_presuffix(self.inputs.output_csv_file,
-                                       suffix='_%s' % this[1]), 'w+')
-            # this writes ROIs as header line
-            fid.write(',' + ','.join(self.ROIs) + '\n')
-            # this writes ROI and data to a line
-            for r, line in zip(self.ROIs, open(tmp_f)):
-                fid.write('%s,%s' % (r, line))
-            fid.close()
+            with open(fname_presuffix(self.inputs.output_csv_file,
+                                      suffix='_%s' % this[1]), 'w+') as fid:
+                # this writes ROIs as header line
+                fid.write(',' + ','.join(self.ROIs) + '\n')
+                # this writes ROI and data to a line
+                for r, line in zip(self.ROIs, this[0]):
+                    fid.write('%s,%s\n' % (r, ','.join('%.18e' % x
+                                                       for x in line)))
 
     def _make_output_figures(self):
         """
@@ -247,6 +311,71 @@ class CoherenceAnalyzer(BaseInterface):
                                            suffix='_delay'))
 
 
+def welch_coherence(data, sampling_rate, NFFT=64, n_overlap=0,
+                    frequency_range=(0.02, 0.15)):
+    """Coherence and time delay between all pairs of time series
+
+    The cross-spectra are estimated with Welch's method, as in
+    nitime.analysis.CoherenceAnalyzer (Hanning window, no detrending), with
+    the FFTs of all the windows of all the time series computed at once, and
+    are averaged over the frequencies strictly within frequency_range.
+
+    Parameters
+    ----------
+    data: array of shape (..., ROIs, time-points)
+    sampling_rate: sampling rate of the time series, in Hz
+    NFFT: size of the windows
+    n_overlap: number of samples shared by subsequent windows
+    frequency_range: [low, high] range of frequencies (in Hz)
+
+    Returns
+    -------
+    coherence, delay: arrays of shape (..., ROIs, ROIs), the delays are in
+        seconds, positive when the second ROI lags the first one (as in
+        nitime)
+
+    >>> t = np.arange(200) * 2.
+    >>> data = np.array([np.sin(2 * np.pi * 0.05 * t),
+    ...                  np.sin(2 * np.pi * 0.05 * (t - 2.))])
+    >>> coherence, delay = welch_coherence(data, 0.5)
+    >>> np.round(coherence, 3)
+    array([[ 1.,  1.],
+           [ 1.,  1.]])
+    >>> np.sign(delay)  # the second time series lags the first one
+    array([[ 0.,  1.],
+           [-1.,  0.]])
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n_samples = data.shape[-1]
+    if n_samples < NFFT:
+        # zero-pad the time series to one window
+        pad = [(0, 0)] * (data.ndim - 1) + [(0, NFFT - n_samples)]
+        data = np.pad(data, pad, mode='constant')
+        n_samples = NFFT
+    step = NFFT - n_overlap
+    n_windows = (n_samples - n_overlap) // step
+    frequencies = np.linspace(0, sampling_rate / 2., NFFT // 2 + 1)
+    freq_idx = np.where((frequencies > frequency_range[0]) *
+                        (frequencies < frequency_range[1]))[0]
+
+    # (..., ROIs, windows, NFFT) view of the windows of all the time series
+    windows = np.lib.stride_tricks.as_strided(
+        data, shape=data.shape[:-1] + (n_windows, NFFT),
+        strides=data.strides[:-1] + (data.strides[-1] * step,
+                                     data.strides[-1]))
+    spectra = np.fft.rfft(windows * np.hanning(NFFT), axis=-1)[..., freq_idx]
+    # cross-spectra of all the pairs, averaged over the windows, with the
+    # conjugate on the second series as in nitime; the scaling of the
+    # estimate cancels out in the coherence and the phase
+    cross = np.einsum('...iwf,...jwf->...ijf', spectra, spectra.conj())
+    power = np.real(np.einsum('...iif->...if', cross))
+
+    coherence = np.abs(cross) ** 2
+    coherence /= power[..., :, np.newaxis, :] * power[..., np.newaxis, :, :]
+    delay = np.angle(cross) / (2 * np.pi * frequencies[freq_idx])
+    return coherence.mean(-1), delay.mean(-1)
+
+
 class GetTimeSeriesInputSpec(object):
     pass
 
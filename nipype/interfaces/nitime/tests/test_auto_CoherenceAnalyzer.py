@@ -7,6 +7,8 @@ def test_CoherenceAnalyzer_inputs():
     input_map = dict(NFFT=dict(usedefault=True,
     ),
     TR=dict(),
+    chunk_size=dict(usedefault=True,
+    ),
     figure_type=dict(usedefault=True,
     ),
     frequency_range=dict(usedefault=True,
@@ -15,6 +17,9 @@ def test_CoherenceAnalyzer_inputs():
     usedefault=True,
     ),
     in_TS=dict(),
+    in_array=dict(requires=('TR',),
+    xor=['in_file', 'in_TS'],
+    ),
     in_file=dict(requires=('TR',),
     ),
     n_overlap=dict(usedefault=True,
@@ -33,9 +38,11 @@ def test_CoherenceAnalyzer_outputs():
     output_map = dict(coherence_array=dict(),
     coherence_csv=dict(),
     coherence_fig=dict(),
+    coherence_stack=dict(),
     timedelay_array=dict(),
     timedelay_csv=dict(),
     timedelay_fig=dict(),
+    timedelay_stack=dict(),
     )
     outputs = CoherenceAnalyzer.output_spec()
 
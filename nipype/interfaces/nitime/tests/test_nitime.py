@@ -74,3 +74,80 @@ def test_coherence_analysis():
     coh = np.mean(C.coherence[:, :, freq_idx], -1)  # Averaging on the last dimension
 
     assert (o.outputs.coherence_array == coh).all()
+
+
+def test_welch_coherence():
+    """Test the vectorized coherence against the Welch estimates of scipy"""
+    from scipy import signal
+    from nipype.interfaces.nitime.analysis import welch_coherence
+
+    rng = np.random.RandomState(0)
+    data = rng.randn(3, 4, 150)
+    data[:, 1, 2:] += data[:, 0, :-2]
+    TR = 2.
+    coherence, delay = welch_coherence(data, 1 / TR, NFFT=32, n_overlap=16,
+                                       frequency_range=[0.02, 0.15])
+    assert coherence.shape == delay.shape == (3, 4, 4)
+    # ROI 1 lags ROI 0
+    assert np.all(delay[:, 0, 1] > 0)
+    for subject in range(3):
+        for i in range(4):
+            for j in range(4):
+                f, cxy = signal.coherence(
+                    data[subject, i], data[subject, j], fs=1 / TR,
+                    window=np.hanning(32), noverlap=16, detrend=False)
+                idx = (f > 0.02) & (f < 0.15)
+                assert np.isclose(coherence[subject, i, j], cxy[idx].mean())
+                # scipy conjugates the first series, nitime the second one
+                f, pxy = signal.csd(
+                    data[subject, i], data[subject, j], fs=1 / TR,
+                    window=np.hanning(32), noverlap=16, detrend=False)
+                assert np.isclose(delay[subject, i, j],
+                                  -np.mean(np.angle(pxy[idx]) /
+                                           (2 * np.pi * f[idx])))
+
+
+@pytest.mark.skipif(no_nitime, reason="nitime is not installed")
+def test_welch_coherence_nitime():
+    """Test the vectorized coherence and delays against nitime"""
+    import nitime.analysis as nta
+    import nitime.timeseries as ts
+    from nipype.interfaces.nitime.analysis import welch_coherence
+
+    CA = nitime.CoherenceAnalyzer()
+    CA.inputs.TR = 1.89
+    CA.inputs.in_file = example_data('fmri_timeseries.csv')
+    data, _ = CA._read_csv()
+    coherence, delay = welch_coherence(data, 1 / CA.inputs.TR,
+                                       NFFT=CA.inputs.NFFT,
+                                       n_overlap=CA.inputs.n_overlap,
+                                       frequency_range=CA.inputs.frequency_range)
+
+    T = ts.TimeSeries(data, sampling_interval=CA.inputs.TR)
+    C = nta.CoherenceAnalyzer(T, method=dict(this_method='welch',
+                                             NFFT=CA.inputs.NFFT,
+                                             n_overlap=CA.inputs.n_overlap))
+    freq_idx = np.where((C.frequencies > CA.inputs.frequency_range[0]) *
+                        (C.frequencies < CA.inputs.frequency_range[1]))[0]
+    assert np.allclose(coherence, np.mean(C.coherence[:, :, freq_idx], -1))
+    assert np.allclose(delay, np.mean(C.delay[:, :, freq_idx], -1))
+
+
+def test_coherence_batch(tmpdir):
+    """Test the analysis of a stack of subjects, by chunks"""
+    from nipype.interfaces.nitime.analysis import welch_coherence
+
+    tmpdir.chdir()
+    rng = np.random.RandomState(0)
+    data = rng.randn(5, 6, 120)
+    np.savez('subjects.npz', data=data,
+             roi_names=['roi%d' % i for i in range(6)])
+    CA = nitime.CoherenceAnalyzer(in_array='subjects.npz', TR=2.,
+                                  NFFT=32, chunk_size=2)
+    o = CA.run()
+    coherence = np.load(o.outputs.coherence_stack)
+    delay = np.load(o.outputs.timedelay_stack)
+    expected = welch_coherence(data, 0.5, NFFT=32)
+    assert np.allclose(coherence, expected[0])
+    assert np.allclose(delay, expected[1])
+    assert CA.ROIs == ['roi%d' % i for i in range(6)]
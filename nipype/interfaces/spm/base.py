@@ -19,6 +19,7 @@ from builtins import range, object, str, bytes
 
 # Standard library imports
 import os
+import gzip
 from copy import deepcopy
 
 # Third-party imports
@@ -39,14 +40,58 @@ __docformat__ = 'restructuredtext'
 logger = logging.getLogger('interface')
 
 
+# shapes of the images read by _image_shape, with the stat signature of the
+# header file they were read from
+_shape_cache = {}
+
+
+def _image_shape(fname):
+    """Returns the shape of an image, reading only its header
+
+    The dimensions of NIfTI-1/2 and Analyze images are read from the first
+    348 or 540 bytes of the header (file), decompressing only the start of
+    gzipped files. Shapes are cached until the header file changes. Other
+    formats are loaded with nibabel.
+    """
+    hdr_file = fname
+    for img_ext, hdr_ext in (('.img', '.hdr'), ('.img.gz', '.hdr.gz')):
+        if fname.endswith(img_ext):
+            hdr_file = fname[:-len(img_ext)] + hdr_ext
+    stat = os.stat(hdr_file)
+    signature = (stat.st_size, stat.st_mtime, stat.st_ino)
+    key = os.path.abspath(hdr_file)
+    if key in _shape_cache and _shape_cache[key][0] == signature:
+        return _shape_cache[key][1]
+
+    shape = None
+    if hdr_file.endswith(('.nii', '.hdr', '.nii.gz', '.hdr.gz')):
+        opener = gzip.open if hdr_file.endswith('.gz') else open
+        with opener(hdr_file, 'rb') as fp:
+            hdr = fp.read(540)
+        for endianness in '<>':
+            sizeof_hdr = np.frombuffer(hdr[:4], dtype=endianness + 'i4')[0]
+            if sizeof_hdr == 348 and len(hdr) >= 348:
+                dim = np.frombuffer(hdr[40:56], dtype=endianness + 'i2')
+            elif sizeof_hdr == 540 and len(hdr) >= 540:
+                dim = np.frombuffer(hdr[16:80], dtype=endianness + 'i8')
+            else:
+                continue
+            if 0 < dim[0] <= 7:
+                shape = tuple(int(d) for d in dim[1:dim[0] + 1])
+            break
+    if shape is None:
+        shape = load(fname, mmap=NUMPY_MMAP).shape
+    _shape_cache[key] = (signature, shape)
+    return shape
+
+
 def func_is_3d(in_file):
     """Checks if input functional files are 3d."""
 
     if isinstance(in_file, list):
         return func_is_3d(in_file[0])
     else:
-        img = load(in_file, mmap=NUMPY_MMAP)
-        shape = img.shape
+        shape = _image_shape(in_file)
         if len(shape) == 3 or (len(shape) == 4 and shape[3] == 1):
             return True
         else:
@@ -65,22 +110,20 @@ def scans_for_fname(fname):
     """Reads a nifti file and converts it to a numpy array storing
     individual nifti volumes.
 
-    Opens images so will fail if they are not found.
+    Reads the image headers so will fail if they are not found.
 
     """
     if isinstance(fname, list):
         scans = np.zeros((len(fname),), dtype=object)
-        for sno, f in enumerate(fname):
-            scans[sno] = '%s,1' % f
+        scans[:] = ['%s,1' % f for f in fname]
         return scans
-    img = load(fname, mmap=NUMPY_MMAP)
-    if len(img.shape) == 3:
+    shape = _image_shape(fname)
+    if len(shape) == 3:
         return np.array(('%s,1' % fname,), dtype=object)
     else:
-        n_scans = img.shape[3]
+        n_scans = shape[3]
         scans = np.zeros((n_scans,), dtype=object)
-        for sno in range(n_scans):
-            scans[sno] = '%s,%d' % (fname, sno + 1)
+        scans[:] = ['%s,%d' % (fname, sno + 1) for sno in range(n_scans)]
         return scans
 
 
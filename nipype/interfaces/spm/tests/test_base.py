@@ -31,6 +31,31 @@ def test_scan_for_fnames(create_files_in_directory):
     assert names[1] == filelist[1]
 
 
+def test_image_shape(tmpdir):
+    import nibabel as nb
+    tmpdir.chdir()
+    data = np.zeros((3, 4, 5, 6), dtype=np.int16)
+    for klass, fname in [(nb.Nifti1Image, 'func.nii'),
+                         (nb.Nifti1Image, 'func.nii.gz'),
+                         (nb.Nifti1Pair, 'func.img'),
+                         (nb.Nifti2Image, 'func2.nii.gz'),
+                         (nb.AnalyzeImage, 'func_analyze.img')]:
+        klass(data, np.eye(4)).to_filename(fname)
+        assert spm._image_shape(fname) == (3, 4, 5, 6)
+        assert spm.func_is_3d(fname) is False
+        assert len(spm.scans_for_fname(fname)) == 6
+    hdr = nb.Nifti1Header(endianness='>')
+    nb.Nifti1Image(data[..., :1], np.eye(4), hdr).to_filename('big.nii')
+    assert spm._image_shape('big.nii') == (3, 4, 5, 1)
+    assert spm.func_is_3d('big.nii')
+    assert spm.scans_for_fname('big.nii').tolist() == ['big.nii,1']
+
+    # the cached shape is updated when the file changes
+    nb.Nifti1Image(data[:, :, :, 0], np.eye(4)).to_filename('func.nii')
+    os.utime('func.nii', (0, 0))
+    assert spm._image_shape('func.nii') == (3, 4, 5)
+
+
 save_time = False
 if not save_time:
     @pytest.mark.skipif(no_spm(), reason="spm is not installed")
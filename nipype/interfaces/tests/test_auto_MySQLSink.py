@@ -4,9 +4,13 @@ from ..io import MySQLSink
 
 
 def test_MySQLSink_inputs():
-    input_map = dict(config=dict(mandatory=True,
+    input_map = dict(batch=dict(usedefault=True,
+    ),
+    config=dict(mandatory=True,
     xor=['host'],
     ),
+    create_table=dict(usedefault=True,
+    ),
     database_name=dict(mandatory=True,
     ),
     host=dict(mandatory=True,
@@ -4,13 +4,21 @@ from ..io import SQLiteSink
 
 
 def test_SQLiteSink_inputs():
-    input_map = dict(database_file=dict(mandatory=True,
+    input_map = dict(batch=dict(usedefault=True,
+    ),
+    create_table=dict(usedefault=True,
+    ),
+    database_file=dict(mandatory=True,
     ),
     ignore_exception=dict(nohash=True,
     usedefault=True,
     ),
+    journal_mode=dict(usedefault=True,
+    ),
     table_name=dict(mandatory=True,
     ),
+    timeout=dict(usedefault=True,
+    ),
     )
     inputs = SQLiteSink.input_spec()
 
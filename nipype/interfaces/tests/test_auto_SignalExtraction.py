@@ -4,7 +4,9 @@ from ..nilearn import SignalExtraction
 
 
 def test_SignalExtraction_inputs():
-    input_map = dict(class_labels=dict(mandatory=True,
+    input_map = dict(chunk_size=dict(usedefault=True,
+    ),
+    class_labels=dict(mandatory=True,
     ),
     detrend=dict(usedefault=True,
     ),
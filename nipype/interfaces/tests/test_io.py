@@ -362,6 +362,38 @@ def test_datasink_copydir():
     shutil.rmtree(pth)
 
 
+@pytest.mark.parametrize("num_threads", [1, 3])
+def test_datasink_parallel_copy(tmpdir, num_threads):
+    indir = tmpdir.mkdir('in')
+    outdir = tmpdir.mkdir('out')
+    files = []
+    for i in range(5):
+        f = indir.join('file%d.txt' % i)
+        f.write('data%d' % i)
+        files.append(str(f))
+    subdir = indir.mkdir('subdir').mkdir('nested')
+    subdir.join('inner.txt').write('inner')
+
+    ds = nio.DataSink(base_directory=str(outdir), parameterization=False,
+                      num_threads=num_threads)
+    setattr(ds.inputs, '@files', files)
+    setattr(ds.inputs, 'tree', str(indir.join('subdir')))
+    ds.run()
+
+    for i, f in enumerate(files):
+        out = outdir.join(os.path.basename(f))
+        assert out.read() == 'data%d' % i
+        assert os.path.getmtime(str(out)) == os.path.getmtime(f)
+    assert outdir.join('tree', 'subdir', 'nested', 'inner.txt').read() == \
+        'inner'
+
+    # a changed source is copied again, unchanged destinations are kept
+    indir.join('file0.txt').write('changed content')
+    ds.run()
+    assert outdir.join('file0.txt').read() == 'changed content'
+    assert outdir.join('file1.txt').read() == 'data1'
+
+
 def test_datafinder_depth(tmpdir):
     outdir = str(tmpdir)
     os.makedirs(os.path.join(outdir, '0', '1', '2', '3'))
@@ -434,3 +466,69 @@ def test_jsonsink(tmpdir, inputs_attributes):
 
 
 
+
+
+def test_sqlitesink(tmpdir):
+    import sqlite3
+    db = tmpdir.join('results.db')
+    sqlite3.connect(str(db)).close()
+
+    sql = nio.SQLiteSink(input_names=['subject_id', 'measurement'])
+    sql.inputs.database_file = str(db)
+    sql.inputs.table_name = 'results'
+    sql.inputs.create_table = True
+    sql.inputs.journal_mode = 'wal'
+    sql.inputs.subject_id = 's1'
+    sql.inputs.measurement = 1.5
+    sql.run()
+
+    sql.inputs.batch = True
+    sql.inputs.subject_id = ['s2', 's3']
+    sql.inputs.measurement = [2.5, 3.5]
+    sql.run()
+
+    conn = sqlite3.connect(str(db))
+    rows = conn.execute('SELECT subject_id, measurement FROM results '
+                        'ORDER BY subject_id').fetchall()
+    mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    conn.close()
+    assert rows == [('s1', 1.5), ('s2', 2.5), ('s3', 3.5)]
+    assert mode == 'wal'
+
+
+def test_sqlitesink_batch_length_mismatch(tmpdir):
+    import sqlite3
+    db = tmpdir.join('results.db')
+    sqlite3.connect(str(db)).close()
+
+    sql = nio.SQLiteSink(input_names=['subject_id', 'measurement'])
+    sql.inputs.database_file = str(db)
+    sql.inputs.table_name = 'results'
+    sql.inputs.create_table = True
+    sql.inputs.batch = True
+    sql.inputs.subject_id = ['s1', 's2']
+    sql.inputs.measurement = [1.5]
+    with pytest.raises(ValueError):
+        sql.run()
+
+
+def test_sqlitesink_batch_broadcast(tmpdir):
+    import sqlite3
+    db = tmpdir.join('results.db')
+    sqlite3.connect(str(db)).close()
+
+    sql = nio.SQLiteSink(input_names=['run', 'subject_id', 'measurement'])
+    sql.inputs.database_file = str(db)
+    sql.inputs.table_name = 'results'
+    sql.inputs.create_table = True
+    sql.inputs.batch = True
+    sql.inputs.run = 'rest'
+    sql.inputs.subject_id = ['s1', 's2']
+    sql.inputs.measurement = 2
+    sql.run()
+
+    conn = sqlite3.connect(str(db))
+    rows = conn.execute('SELECT run, subject_id, measurement FROM results '
+                        'ORDER BY subject_id').fetchall()
+    conn.close()
+    assert rows == [('rest', 's1', 2), ('rest', 's2', 2)]
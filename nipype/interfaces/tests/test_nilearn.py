@@ -14,14 +14,6 @@ from ...pipeline import engine as pe
 import pytest
 import numpy.testing as npt
 
-no_nilearn = True
-try:
-    __import__('nilearn')
-    no_nilearn = False
-except ImportError:
-    pass
-
-@pytest.mark.skipif(no_nilearn, reason="the nilearn library is not available")
 class TestSignalExtraction():
 
     filenames = {
@@ -107,6 +99,27 @@ class TestSignalExtraction():
         self._test_4d_label(wanted, self.fake_4d_label_data)
 
 
+    def test_signal_extr_chunks_detrend(self):
+        # set up
+        from scipy.signal import detrend
+        wanted = [[-4./6], [-1./6], [3./6], [-1./6], [-7./6]]
+        for i, vals in enumerate(self.base_wanted):
+            wanted[i].extend(vals)
+        wanted = detrend(np.array(wanted), axis=0)
+
+        # run, reading two volumes at a time
+        labels = list(self.labels)
+        iface.SignalExtraction(in_file=self.filenames['in_file'],
+                               label_files=self.filenames['label_files'],
+                               class_labels=labels,
+                               include_global=True,
+                               detrend=True,
+                               chunk_size=2).run()
+
+        # assert
+        self.assert_expected_output(self.global_labels, wanted)
+        assert labels == self.labels
+
     def test_signal_extr_traits_valid(self):
         ''' Test a node using the SignalExtraction interface.
         Unlike interface.run(), node.run() checks the traits
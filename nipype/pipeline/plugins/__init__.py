@@ -18,6 +18,10 @@ from .sgegraph import SGEGraphPlugin
 from .lsf import LSFPlugin
 from .slurm import SLURMPlugin
 from .slurmgraph import SLURMGraphPlugin
+try:
+    from .asyncproc import AsyncPlugin
+except ImportError:  # asyncio is only available on Python 3.4+
+    pass
 
 from .callback_log import log_nodes_cb
 from . import  semaphore_singleton
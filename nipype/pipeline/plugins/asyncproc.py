@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Parallel workflow execution driven by an asyncio event loop
+
+Requires Python 3.4 or later.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import locale
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from traceback import format_exception
+
+from ... import logging
+from ...interfaces import base as nib
+from .multiproc import MultiProcPlugin, run_node
+
+# Init logger
+logger = logging.getLogger('workflow')
+
+
+def run_command_async(runtime, output=None, timeout=0.01, redirect_x=False):
+    """Drop-in replacement of :func:`nipype.interfaces.base.run_command`,
+    running the command as a subprocess of an asyncio event loop, in the
+    working directory of the runtime
+
+    Streamed output is collected all at once.
+    """
+    cmdline = runtime.cmdline
+    if redirect_x:
+        exist_xvfb, _ = nib._exists_in_path('xvfb-run', runtime.environ)
+        if not exist_xvfb:
+            raise RuntimeError('Xvfb was not found, X redirection aborted')
+        cmdline = 'xvfb-run -a ' + cmdline
+
+    default_encoding = locale.getdefaultlocale()[1]
+    if default_encoding is None:
+        default_encoding = 'UTF-8'
+    outfile = os.path.join(runtime.cwd, 'stdout.nipype')
+    errfile = os.path.join(runtime.cwd, 'stderr.nipype')
+    if output == 'file':
+        stdout, stderr = open(outfile, 'wb'), open(errfile, 'wb')
+    elif output == 'none':
+        stdout = stderr = asyncio.subprocess.DEVNULL
+    else:
+        stdout = stderr = asyncio.subprocess.PIPE
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        proc = loop.run_until_complete(asyncio.create_subprocess_exec(
+            '/bin/sh', '-c', cmdline, cwd=runtime.cwd, env=runtime.environ,
+            stdout=stdout, stderr=stderr))
+        out, err = loop.run_until_complete(proc.communicate())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+        if output == 'file':
+            stdout.close()
+            stderr.close()
+
+    if output == 'file':
+        with open(outfile, 'rb') as fp:
+            out = [line.decode(default_encoding).strip() for line in fp]
+        with open(errfile, 'rb') as fp:
+            err = [line.decode(default_encoding).strip() for line in fp]
+    elif output == 'none':
+        out, err = [], []
+    else:
+        out = out.decode(default_encoding).split('\n')
+        err = err.decode(default_encoding).split('\n')
+
+    runtime.runtime_memory_gb = 0.
+    runtime.runtime_threads = 1
+    runtime.stderr = '\n'.join(err)
+    runtime.stdout = '\n'.join(out)
+    runtime.merged = ''
+    runtime.returncode = proc.returncode
+    return runtime
+
+
+def run_node_async(node, updatehash, taskid):
+    """Same as :func:`run_node`, with the commands of the node run by
+    :func:`run_command_async`
+    """
+    run_command = nib.run_command
+    nib.run_command = run_command_async
+    try:
+        return run_node(node, updatehash, taskid)
+    finally:
+        nib.run_command = run_command
+
+
+class AsyncPlugin(MultiProcPlugin):
+    """Execute workflow on an asyncio event loop, within the same ``n_procs``
+    and ``memory_gb`` budgets as :class:`MultiProcPlugin`.
+
+    Every node, I/O nodes included, runs in a bounded pool of ``n_procs``
+    worker processes, so a slow DataSink or SelectFiles never blocks the
+    scheduler. The commands of CommandLine nodes are run by the workers as
+    asyncio subprocesses, in the working directory of their node. Every node
+    gets a future that is resolved as soon as it finishes, so the scheduler
+    wakes up on completion instead of polling.
+
+    Currently supported options are:
+
+    - n_procs: maximum number of threads to be executed in parallel
+    - memory_gb: maximum memory (in GB) that can be used at once.
+
+    """
+
+    def __init__(self, plugin_args=None):
+        super(AsyncPlugin, self).__init__(plugin_args=plugin_args)
+        self._loop = None
+        self._futures = {}
+
+    def _create_pool(self, non_daemon):
+        return ProcessPoolExecutor(max_workers=self.processors)
+
+    def run(self, graph, config, updatehash=False):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            super(AsyncPlugin, self).run(graph, config, updatehash=updatehash)
+        finally:
+            asyncio.set_event_loop(None)
+            self._loop.close()
+            self._loop = None
+
+    def _wait(self):
+        pending = [future for future in self._futures.values()
+                   if not future.done()]
+        if pending and len(pending) == len(self._futures):
+            if self._config['execution']['poll_sleep_duration']:
+                self._timeout = float(
+                    self._config['execution']['poll_sleep_duration'])
+            self._loop.run_until_complete(
+                asyncio.wait(pending, timeout=self._timeout,
+                             return_when=asyncio.FIRST_COMPLETED))
+
+    def _task_done(self, args):
+        self._taskresult[args['taskid']] = args
+        future = self._futures.get(args['taskid'])
+        if future is not None and not future.done():
+            future.set_result(args)
+
+    def _clear_task(self, taskid):
+        self._futures.pop(taskid, None)
+        self._task_obj.pop(taskid, None)
+
+    def _close(self):
+        self.pool.shutdown()
+        return True
+
+    def _submit_job(self, node, updatehash=False):
+        self._taskid += 1
+        if hasattr(node.inputs, 'terminal_output'):
+            if node.inputs.terminal_output == 'stream':
+                node.inputs.terminal_output = 'allatonce'
+
+        self._futures[self._taskid] = self._loop.create_future()
+        future = self._loop.run_in_executor(
+            self.pool, run_node_async, node, updatehash, self._taskid)
+        future.add_done_callback(partial(self._node_done, node, self._taskid))
+        self._task_obj[self._taskid] = future
+        return self._taskid
+
+    def _node_done(self, node, taskid, future):
+        try:
+            self._task_done(future.result())
+        except Exception:
+            etype, eval, etr = sys.exc_info()
+            self._task_done(dict(result=None, taskid=taskid,
+                                 traceback=format_exception(etype, eval, etr)))
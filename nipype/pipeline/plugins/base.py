@@ -10,10 +10,13 @@ from copy import deepcopy
 from glob import glob
 import os
 import getpass
+import pickle
 import shutil
 from socket import gethostname
+import struct
 import sys
 import uuid
+import zlib
 from time import strftime, sleep, time
 from traceback import format_exception, format_exc
 from warnings import warn
@@ -102,8 +105,8 @@ def report_nodes_not_run(notrun):
                             'Check log for details'))
 
 
-def create_pyscript(node, updatehash=False, store_exception=True):
-    # pickle node
+def _batch_location(node):
+    """Return the file suffix and batch directory for scripts of ``node``"""
     timestamp = strftime('%Y%m%d_%H%M%S')
     if node._hierarchy:
         suffix = '%s_%s_%s' % (timestamp, node._hierarchy, node._id)
@@ -115,9 +118,97 @@ def create_pyscript(node, updatehash=False, store_exception=True):
         batch_dir = os.path.join(node.base_dir, 'batch')
     if not os.path.exists(batch_dir):
         os.makedirs(batch_dir)
+    return suffix, batch_dir
+
+
+def save_node_container(filename, records):
+    """Pickle a list of records into a single, indexed file
+
+    Each record is pickled and compressed on its own and the file ends with
+    the offsets of all records, so that :func:`load_node_container` can read
+    one record without reading the others.
+    """
+    offsets = []
+    with open(filename, 'wb') as fp:
+        for record in records:
+            offsets.append(fp.tell())
+            fp.write(zlib.compress(pickle.dumps(record)))
+        offsets.append(fp.tell())
+        fp.write(pickle.dumps(offsets))
+        fp.write(struct.pack('<Q', offsets[-1]))
+
+
+def load_node_container(filename, index):
+    """Load record ``index`` from a file written by
+    :func:`save_node_container`"""
+    footer = struct.calcsize('<Q')
+    with open(filename, 'rb') as fp:
+        fp.seek(-footer, os.SEEK_END)
+        end = fp.tell()
+        index_offset = struct.unpack('<Q', fp.read(footer))[0]
+        fp.seek(index_offset)
+        offsets = pickle.loads(fp.read(end - index_offset))
+        fp.seek(offsets[index])
+        data = fp.read(offsets[index + 1] - offsets[index])
+    return pickle.loads(zlib.decompress(data))
+
+
+def create_pyscript(node, updatehash=False, store_exception=True):
+    # pickle node
+    suffix, batch_dir = _batch_location(node)
     pkl_file = os.path.join(batch_dir, 'node_%s.pklz' % suffix)
     savepkl(pkl_file, dict(node=node, updatehash=updatehash))
-    mpl_backend = node.config["execution"]["matplotlib_backend"]
+    pyscript = os.path.join(batch_dir, 'pyscript_%s.py' % suffix)
+    _write_pyscript(pyscript, node.config, pkl_file, batch_dir, suffix,
+                    store_exception)
+    return pyscript
+
+
+def create_packed_pyscript(nodes, updatehash=False, store_exception=True):
+    """Pickle all nodes into one indexed container and write a single
+    launcher script for them
+
+    The launcher takes the index of the node to run as its only argument,
+    so that a graph is submitted with two files instead of two per node.
+    The config of each node is stored with it and applied by the launcher
+    before the node runs.
+
+    Returns
+    -------
+    pyscript : str
+        path to the launcher script
+    job_names : list
+        file names, one per node, to derive names of job-specific files
+        from. These files are not created.
+    """
+    suffix, batch_dir = _batch_location(nodes[0])
+    pkl_file = os.path.join(batch_dir, 'nodes_%s.pklc' % suffix)
+    save_node_container(pkl_file, [dict(node=node, updatehash=updatehash,
+                                        config=node.config)
+                                   for node in nodes])
+    pyscript = os.path.join(batch_dir, 'pyscript_%s.py' % suffix)
+    _write_pyscript(pyscript, nodes[0].config, pkl_file, batch_dir, suffix,
+                    store_exception, packed=True)
+    job_names = [os.path.join(batch_dir, 'node_%s_%d.job' % (suffix, idx))
+                 for idx in range(len(nodes))]
+    return pyscript, job_names
+
+
+def _write_pyscript(pyscript, node_config, pkl_file, batch_dir, suffix,
+                    store_exception=True, packed=False):
+    mpl_backend = node_config["execution"]["matplotlib_backend"]
+    if packed:
+        load_info = """from nipype.pipeline.plugins.base import load_node_container
+    info = load_node_container(pklfile, int(sys.argv[1]))
+    config.update_config(info['config'])
+    if can_import_matplotlib:
+        matplotlib.use(info['config']['execution']['matplotlib_backend'])
+        config.update_matplotlib()
+    logging.update_logging(config)"""
+        crashdump = "'crashdump_%s_%%s.pklz' %% sys.argv[1]" % suffix
+    else:
+        load_info = "info = loadpkl(pklfile)"
+        crashdump = "'crashdump_%s.pklz'" % suffix
     # create python script to load and trap exception
     cmdstr = """import os
 import sys
@@ -149,14 +240,14 @@ try:
     logging.update_logging(config)
     traceback=None
     cwd = os.getcwd()
-    info = loadpkl(pklfile)
+    %s
     result = info['node'].run(updatehash=info['updatehash'])
 except Exception as e:
     etype, eval, etr = sys.exc_info()
     traceback = format_exception(etype,eval,etr)
     if info is None or not os.path.exists(info['node'].output_dir()):
         result = None
-        resultsfile = os.path.join(batchdir, 'crashdump_%s.pklz')
+        resultsfile = os.path.join(batchdir, %s)
     else:
         result = info['node'].result
         resultsfile = os.path.join(info['node'].output_dir(),
@@ -177,11 +268,10 @@ except Exception as e:
         report_crash(info['node'], traceback, gethostname())
     raise Exception(e)
 """
-    cmdstr = cmdstr % (mpl_backend, pkl_file, batch_dir, node.config, suffix)
-    pyscript = os.path.join(batch_dir, 'pyscript_%s.py' % suffix)
+    cmdstr = cmdstr % (mpl_backend, pkl_file, batch_dir, node_config,
+                       load_info, crashdump)
     with open(pyscript, 'wt') as fp:
         fp.writelines(cmdstr)
-    return pyscript
 
 
 class PluginBase(object):
@@ -598,11 +688,22 @@ class SGELikeBatchManagerBase(DistributedPluginBase):
 
 class GraphPluginBase(PluginBase):
     """Base class for plugins that distribute graphs to workflows
+
+    All graph plugins accept the following plugin_args:
+
+    - pack_nodes : if True, pickle all nodes into a single indexed file and
+                   run every job through one launcher script taking the node
+                   index, instead of writing a pickle and a script per node
+                   (default: False)
     """
 
     def __init__(self, plugin_args=None):
         if plugin_args and 'status_callback' in plugin_args:
             warn('status_callback not supported for Graph submission plugins')
+        self._pack_nodes = False
+        if plugin_args and 'pack_nodes' in plugin_args:
+            self._pack_nodes = plugin_args['pack_nodes']
+        self._launcher = None
         super(GraphPluginBase, self).__init__(plugin_args=plugin_args)
 
     def run(self, graph, config, updatehash=False):
@@ -610,15 +711,31 @@ class GraphPluginBase(PluginBase):
         dependencies = {}
         self._config = config
         nodes = nx.topological_sort(graph)
-        logger.debug('Creating executable python files for each node')
+        node_index = dict((node, idx) for idx, node in enumerate(nodes))
         for idx, node in enumerate(nodes):
-            pyfiles.append(create_pyscript(node,
-                                           updatehash=updatehash,
-                                           store_exception=False))
-            dependencies[idx] = [nodes.index(prevnode) for prevnode in
+            dependencies[idx] = [node_index[prevnode] for prevnode in
                                  graph.predecessors(node)]
+        if self._pack_nodes:
+            logger.debug('Creating a single executable python file for all '
+                         'nodes')
+            self._launcher, pyfiles = create_packed_pyscript(
+                nodes, updatehash=updatehash, store_exception=False)
+        else:
+            logger.debug('Creating executable python files for each node')
+            self._launcher = None
+            for node in nodes:
+                pyfiles.append(create_pyscript(node,
+                                               updatehash=updatehash,
+                                               store_exception=False))
         self._submit_graph(pyfiles, dependencies, nodes)
 
+    def _get_pyscript_args(self, idx, pyscript):
+        """Return the arguments to the python interpreter running job
+        ``idx`` of the graph"""
+        if self._launcher is None:
+            return pyscript
+        return '%s %d' % (self._launcher, idx)
+
     def _get_args(self, node, keywords):
         values = ()
         for keyword in keywords:
@@ -646,7 +763,8 @@ class GraphPluginBase(PluginBase):
 
     def _submit_graph(self, pyfiles, dependencies, nodes):
         """
-        pyfiles: list of files corresponding to a topological sort
+        pyfiles: list of files corresponding to a topological sort; use
+            _get_pyscript_args to get the command line running each of them
         dependencies: dictionary of dependencies based on the toplogical sort
         """
         raise NotImplementedError
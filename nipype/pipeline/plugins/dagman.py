@@ -122,11 +122,12 @@ getenv = True
                     '%(override_specs)s')
                 batch_dir, name = os.path.split(pyscript)
                 name = '.'.join(name.split('.')[:-1])
+                pyscript_args = self._get_pyscript_args(idx, pyscript)
                 specs = dict(
                     # TODO make parameter for this,
                     initial_specs=initial_specs,
                     executable=sys.executable,
-                    nodescript=pyscript,
+                    nodescript=pyscript_args,
                     basename=os.path.join(batch_dir, name),
                     override_specs=override_specs
                 )
@@ -135,7 +136,7 @@ getenv = True
                     specs['nodescript'] = \
                         '%s %s %s' % (wrapper_args % specs,  # give access to variables
                                       sys.executable,
-                                      pyscript)
+                                      pyscript_args)
                 submitspec = template % specs
                 # write submit spec for this job
                 submitfile = os.path.join(batch_dir,
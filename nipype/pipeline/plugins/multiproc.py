@@ -155,12 +155,14 @@ class MultiProcPlugin(DistributedPluginBase):
 
         logger.debug("MultiProcPlugin starting %d threads in pool"%(self.processors))
 
+        self.pool = self._create_pool(non_daemon)
+
+    def _create_pool(self, non_daemon):
         # Instantiate different thread pools for non-daemon processes
         if non_daemon:
             # run the execution using the non-daemon pool subclass
-            self.pool = NonDaemonPool(processes=self.processors)
-        else:
-            self.pool = Pool(processes=self.processors)
+            return NonDaemonPool(processes=self.processors)
+        return Pool(processes=self.processors)
 
     def _wait(self):
         if len(self.pending_tasks) > 0:
@@ -107,8 +107,9 @@ class SGEGraphPlugin(GraphPluginBase):
 
                     batch_dir, name = os.path.split(pyscript)
                     name = '.'.join(name.split('.')[:-1])
+                    pyscript_args = self._get_pyscript_args(idx, pyscript)
                     batchscript = '\n'.join((template,
-                                             '%s %s' % (sys.executable, pyscript)))
+                                             '%s %s' % (sys.executable, pyscript_args)))
                     batchscriptfile = os.path.join(batch_dir,
                                                    'batchscript_%s.sh' % name)
 
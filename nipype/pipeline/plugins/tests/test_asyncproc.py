@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+import nipype.interfaces.base as nib
+import nipype.interfaces.io as nio
+import nipype.interfaces.utility as niu
+import nipype.pipeline.engine as pe
+
+asyncproc = pytest.importorskip('nipype.pipeline.plugins.asyncproc')
+
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+    input2 = nib.traits.Int(desc='a random int')
+
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.List(nib.traits.Int, desc='outputs')
+
+
+class AsyncTestInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+
+    def _run_interface(self, runtime):
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = [1, self.inputs.input1]
+        return outputs
+
+
+def test_run_async(tmpdir):
+    os.chdir(str(tmpdir))
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=AsyncTestInterface(), name='mod1')
+    ident = pe.Node(niu.IdentityInterface(fields=['value']), name='ident')
+    mod2 = pe.MapNode(interface=AsyncTestInterface(),
+                      iterfield=['input1'],
+                      name='mod2')
+    pipe.connect([(mod1, ident, [('output1', 'value')]),
+                  (ident, mod2, [('value', 'input1')])])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    execgraph = pipe.run(plugin="Async", plugin_args={'n_procs': 2})
+    names = ['.'.join((node._hierarchy, node.name)) for node in execgraph.nodes()]
+    node = execgraph.nodes()[names.index('pipe.mod2')]
+    result = node.get_output('output1')
+    assert result == [[1, 1], [1, 1]]
+
+
+class StampInputSpec(nib.TraitedSpec):
+    stamp = nib.traits.Str(mandatory=True, desc='file to write the end time to')
+    delay = nib.traits.Float(0., usedefault=True, desc='seconds to sleep')
+    value = nib.traits.Any(desc='ignored, used to chain nodes')
+
+
+class StampOutputSpec(nib.TraitedSpec):
+    value = nib.traits.Any(desc='the end time')
+
+
+class StampInterface(nib.BaseInterface):
+    input_spec = StampInputSpec
+    output_spec = StampOutputSpec
+
+    def _run_interface(self, runtime):
+        time.sleep(self.inputs.delay)
+        self._end = time.time()
+        with open(self.inputs.stamp, 'w') as fp:
+            fp.write('%f' % self._end)
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['value'] = self._end
+        return outputs
+
+
+class SlowSink(StampInterface, nio.IOBase):
+    input_spec = StampInputSpec
+    output_spec = StampOutputSpec
+
+
+def test_slow_io_does_not_stall(tmpdir):
+    os.chdir(str(tmpdir))
+
+    pipe = pe.Workflow(name='pipe', base_dir=os.getcwd())
+    sink = pe.Node(SlowSink(stamp=str(tmpdir.join('sink')), delay=5.),
+                   name='sink')
+    pipe.add_nodes([sink])
+    previous = None
+    for i in range(3):
+        node = pe.Node(StampInterface(stamp=str(tmpdir.join('fast%d' % i))),
+                       name='fast%d' % i)
+        if previous is None:
+            pipe.add_nodes([node])
+        else:
+            pipe.connect(previous, 'value', node, 'value')
+        previous = node
+    pipe.run(plugin='Async', plugin_args={'n_procs': 2})
+
+    sink_end = float(tmpdir.join('sink').read())
+    fast_end = max(float(tmpdir.join('fast%d' % i).read()) for i in range(3))
+    assert fast_end < sink_end
+
+
+def test_run_command_async(tmpdir):
+    os.chdir(str(tmpdir))
+
+    pipe = pe.Workflow(name='pipe', base_dir=os.getcwd())
+    pwd = pe.Node(nib.CommandLine(command='pwd', terminal_output='allatonce'),
+                  name='pwd')
+    pipe.add_nodes([pwd])
+    execgraph = pipe.run(plugin='Async', plugin_args={'n_procs': 2})
+    node = execgraph.nodes()[0]
+    assert node.result.runtime.returncode == 0
+    assert node.result.runtime.stdout.strip() == node.output_dir()
+    assert os.path.exists(os.path.join(node.output_dir(), 'command.txt'))
+
+
+def test_run_command_async_failure(tmpdir):
+    os.chdir(str(tmpdir))
+
+    pipe = pe.Workflow(name='pipe', base_dir=os.getcwd())
+    pipe.add_nodes([pe.Node(nib.CommandLine(command='false'), name='fail')])
+    pipe.config['execution']['crashdump_dir'] = os.getcwd()
+    with pytest.raises(RuntimeError):
+        pipe.run(plugin='Async', plugin_args={'n_procs': 2})
+
+
+class CatInputSpec(nib.CommandLineInputSpec):
+    in_file = nib.File(exists=True, mandatory=True, argstr='%s', position=0,
+                       copyfile=True, desc='file to print')
+
+
+class Cat(nib.CommandLine):
+    _cmd = 'cat'
+    input_spec = CatInputSpec
+
+
+def test_copyfile_matches_multiproc(tmpdir):
+    os.chdir(str(tmpdir))
+    tmpdir.join('data.txt').write('some data\n')
+
+    outputs = {}
+    for plugin in ['MultiProc', 'Async']:
+        pipe = pe.Workflow(name=plugin.lower(), base_dir=os.getcwd())
+        cat = pe.Node(Cat(in_file=str(tmpdir.join('data.txt'))), name='cat')
+        pipe.add_nodes([cat])
+        execgraph = pipe.run(plugin=plugin, plugin_args={'n_procs': 2})
+        node = execgraph.nodes()[0]
+        outputs[plugin] = (sorted(os.listdir(node.output_dir())),
+                           node.result.runtime.stdout)
+    assert outputs['Async'] == outputs['MultiProc']
+    assert 'data.txt' in outputs['Async'][0]
+    assert outputs['Async'][1].strip() == 'some data'
@@ -3,12 +3,19 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 """Tests for the engine module
 """
+import os
+import re
+import subprocess
+import sys
+
 import numpy as np
 import scipy.sparse as ssp
-import re
 
 import mock
 
+import nipype
+import nipype.interfaces.utility as niu
+import nipype.pipeline.engine as pe
 import nipype.pipeline.plugins.base as pb
 
 
@@ -38,6 +45,84 @@ def test_report_crash():
             assert expected_crashfile.match(actual_crashfile).group() == actual_crashfile
             assert mock_pickle_dump.call_count == 1
 
+
+def test_node_container(tmpdir):
+    records = [dict(index=i, data=list(range(i))) for i in range(5)]
+    container = tmpdir.join('nodes.pklc').strpath
+    pb.save_node_container(container, records)
+    for i in [3, 0, 4]:
+        assert pb.load_node_container(container, i) == records[i]
+
+
+class SerialGraphPlugin(pb.GraphPluginBase):
+    """Runs the submitted jobs one after the other"""
+
+    def _submit_graph(self, pyfiles, dependencies, nodes):
+        self.jobs = pyfiles
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(nipype.__file__))] +
+            env.get('PYTHONPATH', '').split(os.pathsep))
+        for idx, pyscript in enumerate(pyfiles):
+            cmd = '%s %s' % (sys.executable,
+                             self._get_pyscript_args(idx, pyscript))
+            subprocess.check_call(cmd.split(), env=env)
+
+
+def _add_one(x):
+    return x + 1
+
+
+def test_graph_plugin_pack_nodes(tmpdir):
+    os.chdir(str(tmpdir))
+    wf = pe.Workflow(name='wf', base_dir=str(tmpdir))
+    nodes = [pe.Node(niu.Function(function=_add_one, input_names=['x'],
+                                  output_names=['out']), name='add%d' % i)
+             for i in range(3)]
+    nodes[0].inputs.x = 0
+    wf.connect([(nodes[0], nodes[1], [('out', 'x')]),
+                (nodes[1], nodes[2], [('out', 'x')])])
+
+    plugin = SerialGraphPlugin(plugin_args={'pack_nodes': True})
+    wf.run(plugin=plugin)
+
+    batch_dir = os.path.join(str(tmpdir), 'wf', 'batch')
+    assert len(set([os.path.basename(job) for job in plugin.jobs])) == 3
+    assert len([f for f in os.listdir(batch_dir)
+                if f.startswith('pyscript_')]) == 1
+    result = pb.loadpkl(os.path.join(str(tmpdir), 'wf', 'add2',
+                                     'result_add2.pklz'))
+    assert result.outputs.out == 3
+
+
+
+def _config_value(x):
+    from nipype import config
+    return config.get('execution', 'remove_unnecessary_outputs')
+
+
+def test_graph_plugin_pack_nodes_config(tmpdir):
+    os.chdir(str(tmpdir))
+    wf = pe.Workflow(name='wf', base_dir=str(tmpdir))
+    sub = pe.Workflow(name='sub')
+    first = pe.Node(niu.Function(function=_config_value, input_names=['x'],
+                                 output_names=['out']), name='first')
+    first.inputs.x = 0
+    second = pe.Node(niu.Function(function=_config_value, input_names=['x'],
+                                  output_names=['out']), name='second')
+    second.config = {'execution': {'remove_unnecessary_outputs': 'false'}}
+    sub.add_nodes([second])
+    wf.connect(first, 'out', sub, 'second.x')
+
+    wf.run(plugin=SerialGraphPlugin(plugin_args={'pack_nodes': True}))
+
+    # each node runs with its own config, not that of the first node
+    for path, expected in [(('first', 'result_first.pklz'), 'true'),
+                           (('sub', 'second', 'result_second.pklz'),
+                            'false')]:
+        result = pb.loadpkl(os.path.join(str(tmpdir), 'wf', *path))
+        assert result.outputs.out == expected
+
 '''
 Can use the following code to test that a mapnode crash continues successfully
 Need to put this into a nose-test with a timeout
@@ -286,6 +286,41 @@ def on_cifs(fname):
     return False
 
 
+# ioctl request cloning a whole file, from linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink(originalfile, newfile):
+    """Create ``newfile`` as a copy-on-write clone of ``originalfile``.
+
+    The clone shares its data blocks with the original, so it is created
+    without copying any data, but it behaves as an independent copy. This is
+    only supported on Linux filesystems with reflinks (e.g. Btrfs, XFS).
+
+    Raises
+    ------
+    OSError
+        if the clone cannot be created. ``newfile`` does not exist then.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError('reflinks are not supported on this platform')
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflinks are not supported on this platform')
+
+    with open(originalfile, 'rb') as fsrc:
+        with open(newfile, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                cloned = True
+            except (IOError, OSError):
+                cloned = False
+    if not cloned:
+        os.unlink(newfile)
+        raise OSError('cannot reflink %s to %s' % (originalfile, newfile))
+
+
 def copyfile(originalfile, newfile, copy=False, create_new=False,
              hashmethod=None, use_hardlink=False,
              copy_related_files=True):
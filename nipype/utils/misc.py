@@ -247,7 +247,8 @@ def unflatten(in_list, prev_structure):
 
 def normalize_mc_params(params, source):
     """
-    Normalize a single row of motion parameters to the SPM format.
+    Normalize a row of motion parameters, or an array of rows (one per
+    time point), to the SPM format.
 
     SPM saves motion parameters as:
         x   Right-Left          (mm)
@@ -256,17 +257,64 @@ def normalize_mc_params(params, source):
         rx  Pitch               (rad)
         ry  Yaw                 (rad)
         rz  Roll                (rad)
+
+    >>> params = np.array([[1., 2., 3., 0.1, 0.2, 0.3],
+    ...                    [4., 5., 6., 0.4, 0.5, 0.6]])
+    >>> normalize_mc_params(params, 'FSL')
+    array([[ 0.1,  0.2,  0.3,  1. ,  2. ,  3. ],
+           [ 0.4,  0.5,  0.6,  4. ,  5. ,  6. ]])
+    >>> normalize_mc_params(params[0], 'FSL')
+    array([ 0.1,  0.2,  0.3,  1. ,  2. ,  3. ])
     """
+    params = np.asarray(params)
     if source.upper() == 'FSL':
-        params = params[[3, 4, 5, 0, 1, 2]]
+        params = params[..., [3, 4, 5, 0, 1, 2]]
     elif source.upper() in ('AFNI', 'FSFAST'):
-        params = params[np.asarray([4, 5, 3, 1, 2, 0]) + (len(params) > 6)]
-        params[3:] = params[3:] * np.pi / 180.
+        params = params[..., np.asarray([4, 5, 3, 1, 2, 0]) +
+                        (params.shape[-1] > 6)]
+        params[..., 3:] = params[..., 3:] * np.pi / 180.
     elif source.upper() == 'NIPY':
         from nipy.algorithms.registration import to_matrix44, aff2euler
+        if params.ndim > 1:
+            return np.array([normalize_mc_params(row, source)
+                             for row in params])
         matrix = to_matrix44(params)
         params = np.zeros(6)
         params[:3] = matrix[:3, 3]
         params[-1:2:-1] = aff2euler(matrix)
 
     return params
+
+
+def iter_volume_chunks(img, chunk_size=None):
+    """
+    Yields ``(start, stop, data)`` for consecutive chunks of the volumes of
+    a 3D or 4D image, ``data`` holding the volumes ``start:stop`` along its
+    last axis.
+
+    Each chunk is a single read of ``img.dataobj`` of about ``chunk_size``
+    voxels (at least one volume, 2**25 voxels by default), so that the
+    image, even if compressed, is read in a few sequential passes instead
+    of once per volume.
+
+    >>> import nibabel as nb
+    >>> img = nb.Nifti1Image(np.arange(120.).reshape(2, 3, 4, 5), np.eye(4))
+    >>> [(start, stop, data.shape)
+    ...  for start, stop, data in iter_volume_chunks(img, 48)]
+    [(0, 2, (2, 3, 4, 2)), (2, 4, (2, 3, 4, 2)), (4, 5, (2, 3, 4, 1))]
+    """
+    if chunk_size is None:
+        chunk_size = 2 ** 25
+    shape = tuple(img.shape[:3])
+    nvols = int(np.prod(img.shape[3:]))
+    if len(img.shape) == 4:
+        step = max(1, int(chunk_size // np.prod(shape)))
+    else:
+        step = nvols
+    for start in range(0, nvols, step):
+        stop = min(start + step, nvols)
+        if len(img.shape) == 4:
+            data = np.asanyarray(img.dataobj[..., start:stop])
+        else:
+            data = np.asanyarray(img.dataobj).reshape(shape + (nvols,))
+        yield start, stop, data.reshape(shape + (stop - start,))
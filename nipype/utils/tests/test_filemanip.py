@@ -16,7 +16,7 @@ from ...utils.filemanip import (save_json, load_json,
                                 fname_presuffix, fnames_presuffix,
                                 hash_rename, check_forhash,
                                 _cifs_table, on_cifs,
-                                copyfile, copyfiles,
+                                copyfile, copyfiles, reflink,
                                 filename_to_list, list_to_filename,
                                 check_depends,
                                 split_filename, get_related_files)
@@ -117,6 +117,19 @@ def test_copyfile_true(_temp_analyze_files):
     assert os.path.exists(new_hdr)
 
 
+def test_reflink(tmpdir):
+    orig = tmpdir.join('orig.txt')
+    orig.write('some data')
+    new = tmpdir.join('new.txt').strpath
+    try:
+        reflink(orig.strpath, new)
+    except OSError:
+        # unsupported filesystem, nothing must be left behind
+        assert not os.path.exists(new)
+    else:
+        assert open(new).read() == 'some data'
+
+
 def test_copyfiles(_temp_analyze_files, _temp_analyze_files_prime):
     orig_img1, orig_hdr1 = _temp_analyze_files
     orig_img2, orig_hdr2 = _temp_analyze_files_prime
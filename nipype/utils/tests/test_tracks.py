@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import numpy as np
+import nibabel.trackvis as nbt
+
+from nipype.utils.tracks import (read_track_header, iter_track_chunks,
+                                 write_tracks, filter_tracks)
+
+
+def _streamlines(n=25, seed=0):
+    rng = np.random.RandomState(seed)
+    streams = []
+    for _ in range(n):
+        npoints = rng.randint(1, 10)
+        streams.append((rng.rand(npoints, 3).astype(np.float32),
+                        rng.rand(npoints, 2).astype(np.float32),
+                        rng.rand(3).astype(np.float32)))
+    return streams
+
+
+def test_write_and_read_chunks(tmpdir):
+    tmpdir.chdir()
+    streams = _streamlines()
+    hdr = {'voxel_size': (2., 2., 2.), 'dim': (10, 10, 10)}
+    assert write_tracks('tracks.trk', (s for s in streams), hdr) == 25
+
+    header = read_track_header('tracks.trk')
+    assert header['n_count'] == 25
+    chunks = list(iter_track_chunks('tracks.trk', chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    read = [stream for chunk in chunks for stream in chunk]
+    for (pts, sc, props), (rpts, rsc, rprops) in zip(streams, read):
+        assert np.all(pts == rpts)
+        assert np.all(sc == rsc)
+        assert np.all(props == rprops)
+
+
+def test_filter_tracks(tmpdir):
+    tmpdir.chdir()
+    streams = _streamlines()
+    nbt.write('tracks.trk', streams, {'voxel_size': (2., 2., 2.)})
+
+    indices = [3, 0, 17, 3, 9]
+    assert filter_tracks('tracks.trk', 'filtered.trk', indices,
+                         chunk_size=4) == 4
+    filtered, header = nbt.read('filtered.trk')
+    assert header['n_count'] == 4
+    for i, (pts, sc, props) in zip([0, 3, 9, 17], filtered):
+        assert np.all(pts == streams[i][0])
+        assert np.all(sc == streams[i][1])
+        assert np.all(props == streams[i][2])
+
+    assert filter_tracks('tracks.trk', 'empty.trk', []) == 0
+    filtered, header = nbt.read('empty.trk')
+    assert len(filtered) == 0
+    assert header['n_count'] == 0
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Streaming reading and writing of TrackVis (.trk) track files
+
+Tractograms are read as a generator of chunks of streamlines, so only one
+chunk is held in memory at a time, and the points of a chunk can be packed
+into one contiguous buffer with offsets. Filtered copies of a track file are
+written streaming from the original file.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import numpy as np
+import nibabel.trackvis as nbt
+
+
+def read_track_header(in_file):
+    """Read the header of a track file, without reading the streamlines"""
+    with open(in_file, 'rb') as fp:
+        _, header = nbt.read(fp, as_generator=True)
+    return header
+
+
+def iter_track_chunks(in_file, chunk_size=100000, points_space=None):
+    """Iterate over a track file by chunks of streamlines
+
+    Yields lists of at most ``chunk_size`` (points, scalars, properties)
+    tuples, in the order of the file.
+    """
+    with open(in_file, 'rb') as fp:
+        streams, _ = nbt.read(fp, as_generator=True,
+                              points_space=points_space)
+        chunk = []
+        for stream in streams:
+            chunk.append(stream)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def iter_track_points(in_file, chunk_size=100000, points_space=None):
+    """Iterate over the (n_points, 3) point arrays of a track file"""
+    for chunk in iter_track_chunks(in_file, chunk_size, points_space):
+        for stream in chunk:
+            yield stream[0]
+
+
+def concatenate_streamlines(streamlines):
+    """Stack the points of streamlines in one contiguous array
+
+    Parameters
+    ----------
+    streamlines: sequence of (points, scalars, properties) tuples, as
+        returned by nibabel.trackvis.read
+
+    Returns
+    -------
+    points: array of shape (n_points, 3) with the points of all streamlines
+    offsets: array of shape (n_streamlines + 1,), the points of streamline i
+        are points[offsets[i]:offsets[i + 1]]
+
+    >>> streams = [(np.zeros((2, 3)), None, None), (np.ones((3, 3)), None, None)]
+    >>> points, offsets = concatenate_streamlines(streams)
+    >>> points.shape
+    (5, 3)
+    >>> offsets.tolist()
+    [0, 2, 5]
+    """
+    lengths = np.array([len(stream[0]) for stream in streamlines], dtype=np.intp)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    if offsets[-1] == 0:
+        return np.zeros((0, 3)), offsets
+    points = np.concatenate([np.asarray(stream[0]).reshape(-1, 3)
+                             for stream in streamlines])
+    return points, offsets
+
+
+def write_tracks(out_file, streamlines, header=None, points_space=None):
+    """Write an iterable of streamlines to a track file
+
+    The streamlines are written as they are consumed, and the number of
+    streamlines is stored in the header once they have all been written.
+    Returns the number of streamlines written.
+    """
+    counter = _Counter(streamlines)
+    nbt.write(out_file, counter, header, points_space=points_space)
+    if counter.count:
+        _set_track_count(out_file, counter.count)
+    return counter.count
+
+
+def filter_tracks(in_file, out_file, indices, chunk_size=100000, header=None):
+    """Copy the streamlines of in_file at the given indices to out_file
+
+    The input file is read streaming, and reading stops after the last
+    selected streamline. Scalars and properties are preserved. Returns the
+    number of streamlines written.
+    """
+    indices = np.unique(np.asarray(indices, dtype=np.intp))
+    if header is None:
+        header = read_track_header(in_file)
+    keep = np.zeros(indices[-1] + 1 if len(indices) else 0, dtype=bool)
+    keep[indices] = True
+
+    def _selected():
+        index = 0
+        for chunk in iter_track_chunks(in_file, chunk_size):
+            for i in np.flatnonzero(keep[index:index + len(chunk)]):
+                yield chunk[i]
+            index += len(chunk)
+            if index >= len(keep):
+                break
+
+    # the count of the input file is wrong if no streamline is written
+    header = header.copy()
+    header['n_count'] = 0
+    return write_tracks(out_file, _selected(), header)
+
+
+class _Counter(object):
+    """Iterable wrapper counting the items consumed"""
+
+    def __init__(self, iterable):
+        self._iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for item in self._iterable:
+            self.count += 1
+            yield item
+
+
+def _set_track_count(out_file, count):
+    """Store the number of streamlines in the header of a track file"""
+    hdr_size = nbt.header_2_dtype.fields['hdr_size'][1]
+    n_count = nbt.header_2_dtype.fields['n_count'][1]
+    with open(out_file, 'r+b') as fp:
+        fp.seek(hdr_size)
+        endianness = '<'
+        if np.frombuffer(fp.read(4), dtype='<i4')[0] != 1000:
+            endianness = '>'
+        fp.seek(n_count)
+        fp.write(np.array(count, dtype=endianness + 'i4').tostring())